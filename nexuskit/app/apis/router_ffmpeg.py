@@ -1,55 +1,105 @@
-from fastapi import APIRouter, File, UploadFile, BackgroundTasks, Depends
-from fastapi.responses import FileResponse
-from ..models.ffmpeg_models import FFmpegUploadResponse, FFmpegConvertRequest
-from ..services import service_ffmpeg, task_service
-from ..database import get_db
-import os
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request
+from ..models.ffmpeg_models import FFmpegUploadResponse, FFmpegConvertRequest, FFmpegProbeResponse
+from ..services import service_ffmpeg, task_service, progress_bus, job_scheduler, upload_ingest, result_cache, cleanup_service, result_serving
 import asyncio
-import json
 from sse_starlette.sse import EventSourceResponse
 
 router = APIRouter()
 
 @router.post("/upload", response_model=FFmpegUploadResponse)
 async def upload_media(file: UploadFile = File(...)):
-    return service_ffmpeg.handle_ffmpeg_upload(file)
+    try:
+        return await service_ffmpeg.handle_ffmpeg_upload(file)
+    except upload_ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@router.get("/{task_id}/probe", response_model=FFmpegProbeResponse)
+async def probe_media(task_id: str):
+    probe = await asyncio.to_thread(service_ffmpeg.get_task_probe, task_id)
+    if probe is None:
+        raise HTTPException(status_code=404, detail="No probe available for this task")
+    media_format = probe.get('format', {})
+    return {
+        "task_id": task_id,
+        "format_name": media_format.get('format_name'),
+        "duration": media_format.get('duration'),
+        "size": media_format.get('size'),
+        "bit_rate": media_format.get('bit_rate'),
+        "streams": probe.get('streams', []),
+    }
 
 @router.post("/convert")
-async def convert_media(request: FFmpegConvertRequest, background_tasks: BackgroundTasks):
-    task = task_service.get_task_status(request.task_id)
+async def convert_media(request: FFmpegConvertRequest):
+    task = await task_service.get_task_status_async(request.task_id)
     if not task:
         return {"error": "Task not found"}
-    
-    background_tasks.add_task(
-        service_ffmpeg.run_ffmpeg_conversion,
-        request.task_id,
-        task['result_path'], # The original file path is stored in result_path after upload
+    # Completing it from the cache would also replace the result a running
+    # job is still writing.
+    if job_scheduler.scheduler.has_job('ffmpeg', request.task_id):
+        raise HTTPException(status_code=409, detail="A conversion of this task is already queued or running.")
+
+    # Normalized once, so the cache lookup and the encoder see the same values.
+    params = service_ffmpeg.normalize_conversion_params(
         request.output_format,
         request.extract_audio,
         request.resolution,
         request.quality,
-        request.bitrate
+        request.bitrate,
+        request.preset,
     )
-    return {"message": "Conversion started", "task_id": request.task_id}
+    if await asyncio.to_thread(
+        service_ffmpeg.complete_from_cache,
+        request.task_id,
+        task['input_path'],
+        streaming=request.streaming,
+        **params,
+    ):
+        return {"message": "Conversion completed from cache", "task_id": request.task_id}
+
+    try:
+        # Submitting writes the queued task to the store; keep it off the loop.
+        await asyncio.to_thread(
+            job_scheduler.scheduler.submit,
+            'ffmpeg',
+            request.task_id,
+            original_file_path=task['input_path'],
+            threads=request.threads,
+            segmented=request.segmented,
+            streaming=request.streaming,
+            **params,
+        )
+    except job_scheduler.TaskAlreadyQueuedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except job_scheduler.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"message": "Conversion queued", "task_id": request.task_id}
+
+@router.post("/tasks/{task_id}/cancel")
+async def cancel_conversion(task_id: str):
+    try:
+        cancelled = await asyncio.to_thread(job_scheduler.scheduler.cancel, task_id)
+    except job_scheduler.TaskNotCancellableError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="No queued conversion for this task")
+    return {"message": "Conversion cancelled", "task_id": task_id}
+
+@router.get("/cache/stats")
+async def cache_stats():
+    return result_cache.ffmpeg_cache.stats()
 
 @router.get("/tasks/{task_id}/stream")
-async def stream_task_progress(task_id: str, db=Depends(get_db)):
-    async def event_generator():
-        last_progress = -1
-        while True:
-            task = task_service.get_task_status(task_id)
-            if task:
-                if task['progress'] != last_progress:
-                    yield {"data": json.dumps(task)}
-                    last_progress = task['progress']
-                if task['status'] in ['completed', 'failed']:
-                    break
-            await asyncio.sleep(1)
-    return EventSourceResponse(event_generator())
+async def stream_task_progress(task_id: str):
+    return EventSourceResponse(progress_bus.task_event_stream(task_id, task_service.get_task_status_async))
 
 @router.get("/download/{task_id}")
-async def download_converted_file(task_id: str):
-    task = task_service.get_task_status(task_id)
+async def download_converted_file(task_id: str, request: Request):
+    task = await task_service.get_task_status_async(task_id)
     if task and task['status'] == 'completed':
-        return FileResponse(task['result_path'], media_type='application/octet-stream', filename=os.path.basename(task['result_path']))
+        await cleanup_service.record_download(task)
+        return await result_serving.serve_result(request, task, 'application/octet-stream')
+    if task and task['status'] == 'processing' and task.get('result_path'):
+        # A streaming conversion: send the output while ffmpeg writes it.
+        await cleanup_service.record_download(task)
+        return await result_serving.follow_result(request, task, 'application/octet-stream')
     return {"error": "File not found or conversion not complete"}
@@ -1,30 +1,107 @@
-from fastapi import APIRouter, File, UploadFile, Body
-from fastapi.responses import FileResponse
-from ..models.image_editor_models import ImageUploadResponse, ImageEditRequest, ImageEditResponse
-from ..services import service_image_editor, task_service
+from fastapi import APIRouter, File, UploadFile, Body, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from ..models.image_editor_models import ImageUploadResponse, ImageEditRequest, ImageEditResponse, ImageBatchOperation
+from ..services import service_image_editor, task_service, upload_ingest, image_ops, image_batch, progress_bus
+from sse_starlette.sse import EventSourceResponse
+import asyncio
 import os
+from typing import List
+
+_batch_operations = TypeAdapter(List[ImageBatchOperation])
 
 router = APIRouter()
 
 @router.post("/upload", response_model=ImageUploadResponse)
 async def upload_image(file: UploadFile = File(...)):
-    return service_image_editor.handle_image_upload(file)
+    try:
+        return await service_image_editor.handle_image_upload(file)
+    except upload_ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _run_session_call(fn, *args):
+    # Edits decode and transform full-size images, so keep them off the event loop.
+    try:
+        return await asyncio.to_thread(fn, *args)
+    except image_ops.InvalidOperationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @router.post("/edit", response_model=ImageEditResponse)
 async def edit_image(request: ImageEditRequest):
-    return service_image_editor.apply_image_edit(request.task_id, request.action, request.params)
+    return await _run_session_call(service_image_editor.apply_image_edit, request.task_id, request.action, request.params)
 
 @router.post("/undo", response_model=ImageEditResponse)
 async def undo_edit(task_id: str = Body(..., embed=True)):
-    return service_image_editor.undo_last_edit(task_id)
+    return await _run_session_call(service_image_editor.undo_last_edit, task_id)
 
 @router.post("/redo", response_model=ImageEditResponse)
 async def redo_edit(task_id: str = Body(..., embed=True)):
-    return service_image_editor.redo_last_edit(task_id)
+    return await _run_session_call(service_image_editor.redo_last_edit, task_id)
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 @router.get("/view/{task_id}/{filename}")
-async def view_image(task_id: str, filename: str):
-    image_path = service_image_editor.get_image_path(task_id, filename)
+async def view_image(request: Request, task_id: str, filename: str, w: int | None = Query(None, ge=1)):
+    """
+    Serves a version as shown in the editor, as AVIF, WebP or JPEG when the
+    Accept header allows it and PNG otherwise, optionally scaled down to about
+    `w` pixels wide.
+    """
+    variant = await asyncio.to_thread(service_image_editor.get_view_variant, task_id, filename, request.headers.get("accept"), w)
+    if not variant:
+        return {"error": "Image not found"}
+    # A version never changes, but which variant is served depends on Accept.
+    headers = {"ETag": variant["etag"], "Cache-Control": "private, max-age=31536000, immutable", "Vary": "Accept"}
+    if _etag_matches(request.headers.get("if-none-match"), variant["etag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(variant["path"], media_type=variant["media_type"], headers=headers)
+
+@router.get("/export/{task_id}/{filename}")
+async def export_image(task_id: str, filename: str):
+    """Serves a version at full resolution, replaying its edits on the original if needed."""
+    image_path = await asyncio.to_thread(service_image_editor.get_export_path, task_id, filename)
     if image_path:
-        return FileResponse(image_path, media_type="image/png")
+        return FileResponse(image_path, media_type="image/png", filename="edited_image.png")
     return {"error": "Image not found"}
+
+@router.post("/batch")
+async def batch_process(files: List[UploadFile] = File(...), operations: str = Form(...), output_format: str = Form("png", alias="format"), quality: int = Form(90, ge=1, le=100)):
+    """
+    Applies the same operations to many images, uploaded as files or zips of
+    files, and streams back a zip of the results as they finish. Progress is
+    published on the task named by the X-Task-Id header.
+    """
+    try:
+        recipe = [(operation.action, operation.params) for operation in _batch_operations.validate_json(operations)]
+        for action, _ in recipe:
+            image_ops.validate(action)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid operations: {e}")
+    except image_ops.InvalidOperationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if output_format not in image_batch.OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{output_format}'")
+
+    try:
+        task_id, inputs = await image_batch.create_batch(files)
+    except upload_ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        image_batch.stream_batch(task_id, inputs, recipe, output_format, quality),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="batch_results.zip"', "X-Task-Id": task_id},
+    )
+
+@router.get("/tasks/{task_id}/stream")
+async def stream_task_status(task_id: str):
+    return EventSourceResponse(progress_bus.task_event_stream(task_id, task_service.get_task_status_async))
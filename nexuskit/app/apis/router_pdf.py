@@ -1,53 +1,124 @@
-from fastapi import APIRouter, File, UploadFile, Depends, Form
-from fastapi.responses import FileResponse, StreamingResponse
-from ..models.pdf_models import PDFUploadResponse, DeletePagesRequest, ReorderPagesRequest, AddSignatureRequest
-from ..services import service_pdf, task_service
+from fastapi import APIRouter, File, UploadFile, Depends, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from ..models.pdf_models import PDFUploadResponse, DeletePagesRequest, ReorderPagesRequest, AddSignatureRequest, PageOperationsRequest
+from ..services import service_pdf, task_service, upload_ingest, pdf_rasterizer, progress_bus, cleanup_service, result_serving, job_scheduler
+from ..core import config
+import asyncio
 import os
+import json
 from typing import List
+from sse_starlette.sse import EventSourceResponse
 
 router = APIRouter()
 
 @router.post("/upload", response_model=PDFUploadResponse)
 async def upload_pdf(file: UploadFile = File(...)):
-    return service_pdf.handle_pdf_upload(file)
+    try:
+        return await service_pdf.handle_pdf_upload(file)
+    except upload_ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 @router.get("/preview/{task_id}/{page_name}")
-async def get_preview_image(task_id: str, page_name: str):
-    task_dir = os.path.join(task_service.cleanup_service.TEMP_DIR, task_id)
-    image_path = os.path.join(task_dir, page_name)
-    if os.path.exists(image_path):
-        return FileResponse(image_path)
-    return {"error": "Image not found"}
+async def get_preview_image(
+    task_id: str,
+    page_name: str,
+    size: str = config.PDF_PREVIEW_DEFAULT_TIER,
+    image_format: str = Query("png", alias="format"),
+    quality: int = Query(config.PDF_PREVIEW_QUALITY, ge=1, le=100),
+):
+    try:
+        image = await asyncio.to_thread(service_pdf.render_page_preview, task_id, page_name, size, image_format, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if image is None:
+        return {"error": "Image not found"}
+    # Preview URLs change with every edit of the document, so they can be cached.
+    return Response(image, media_type=pdf_rasterizer.MEDIA_TYPES[image_format], headers={"Cache-Control": "private, max-age=3600"})
+
+@router.get("/{task_id}/render")
+async def render_all_previews(
+    task_id: str,
+    size: str = config.PDF_PREVIEW_DEFAULT_TIER,
+    image_format: str = Query("png", alias="format"),
+    quality: int = Query(config.PDF_PREVIEW_QUALITY, ge=1, le=100),
+):
+    """Renders all pages in parallel and streams each page's preview URL as it becomes available."""
+    if size not in config.PDF_PREVIEW_TIERS or image_format not in pdf_rasterizer.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported preview size or format")
+
+    async def event_generator():
+        async for page in service_pdf.render_all_previews(task_id, size, image_format, quality):
+            yield {"data": json.dumps(page)}
+    return EventSourceResponse(event_generator())
+
+async def _run_page_operations(task_id: str, operations: list[dict]):
+    task = await task_service.get_task_status_async(task_id)
+    if not task or not task['result_path']:
+        raise HTTPException(status_code=404, detail="Task not found")
+    try:
+        return await asyncio.to_thread(service_pdf.apply_page_operations, task_id, operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{task_id}/pages", response_model=PDFUploadResponse)
+async def apply_page_operations(task_id: str, request: PageOperationsRequest):
+    """Applies a batch of delete/reorder/move/add_blank operations in one pass."""
+    return await _run_page_operations(task_id, [operation.model_dump() for operation in request.operations])
 
 @router.post("/{task_id}/add-blank-page", response_model=PDFUploadResponse)
 async def add_blank_page(task_id: str):
-    return service_pdf.add_blank_page(task_id)
+    return await _run_page_operations(task_id, [{"op": "add_blank"}])
 
 @router.post("/{task_id}/delete-pages", response_model=PDFUploadResponse)
 async def delete_pages(task_id: str, request: DeletePagesRequest):
-    return service_pdf.delete_pages(task_id, request.pages)
+    return await _run_page_operations(task_id, [{"op": "delete", "pages": request.pages}])
 
 @router.post("/{task_id}/reorder-pages", response_model=PDFUploadResponse)
 async def reorder_pages(task_id: str, request: ReorderPagesRequest):
-    return service_pdf.reorder_pages(task_id, request.page_order)
+    return await _run_page_operations(task_id, [{"op": "reorder", "page_order": request.page_order}])
 
 @router.post("/{task_id}/add-signature", response_model=PDFUploadResponse)
 async def add_signature(task_id: str, request: AddSignatureRequest):
-    return service_pdf.add_signature(task_id, request.page_index, request.x, request.y, request.width, request.signature_data_url)
+    # Waits for any other edit of the document, so it must not block the event loop.
+    return await asyncio.to_thread(service_pdf.add_signature, task_id, request.page_index, request.x, request.y, request.width, request.signature_data_url)
 
 @router.post("/merge")
 async def merge_pdfs(files: List[UploadFile] = File(...)):
-    merged_pdf = service_pdf.merge_pdfs(files)
-    return StreamingResponse(merged_pdf, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=merged.pdf"})
+    try:
+        task_id, merged_path = await service_pdf.merge_pdfs(files)
+    except upload_ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The merged file stays in the task directory until cleanup, so it is
+    # also available from /{task_id}/download.
+    return FileResponse(merged_path, media_type="application/pdf", filename="merged.pdf", headers={"X-Task-Id": task_id})
 
 @router.post("/compress")
 async def compress_pdf(file: UploadFile = File(...), level: str = Form(...)):
-    compressed_pdf = service_pdf.compress_pdf(file, level)
-    return StreamingResponse(compressed_pdf, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=compressed.pdf"})
+    """Starts a compression task; follow it on /tasks/{task_id}/stream and fetch the result from /{task_id}/download."""
+    try:
+        compression = await service_pdf.start_compression(file, level)
+    except upload_ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    job_args = compression.pop("job_args", None)
+    if job_args is None:
+        return compression
+    try:
+        await asyncio.to_thread(job_scheduler.scheduler.submit, 'pdf-compress', compression['task_id'], **job_args)
+    except job_scheduler.QueueFullError as e:
+        await task_service.fail_task_async(compression['task_id'], str(e))
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"task_id": compression['task_id'], "status": "queued"}
+
+@router.get("/tasks/{task_id}/stream")
+async def stream_task_progress(task_id: str):
+    return EventSourceResponse(progress_bus.task_event_stream(task_id, task_service.get_task_status_async))
 
 @router.get("/{task_id}/download")
-async def download_pdf(task_id: str):
-    task = task_service.get_task_status(task_id)
+async def download_pdf(task_id: str, request: Request):
+    task = await task_service.get_task_status_async(task_id)
     if task and task['status'] == 'completed':
-        return FileResponse(task['result_path'], media_type='application/pdf', filename=os.path.basename(task['result_path']))
+        await cleanup_service.record_download(task)
+        return await result_serving.serve_result(request, task, 'application/pdf')
     return {"error": "File not found"}
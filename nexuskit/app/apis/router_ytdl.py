@@ -1,43 +1,70 @@
-from fastapi import APIRouter, BackgroundTasks, Depends
-from fastapi.responses import FileResponse
-from ..models.ytdl_models import YTdlRequest, YTdlInfo, YTdlDownloadRequest
-from ..services import service_ytdl, task_service
-from ..database import get_db
-import os
+from fastapi import APIRouter, HTTPException, Request
+from ..models.ytdl_models import YTdlRequest, YTdlInfo, YTdlDownloadRequest, YTdlBatchInfoRequest, YTdlBatchInfoResponse
+from ..services import service_ytdl, task_service, progress_bus, job_scheduler, ytdl_info, cleanup_service, result_serving
 import asyncio
-import json
+import yt_dlp
 from sse_starlette.sse import EventSourceResponse
 
 router = APIRouter()
 
 @router.post("/fetch-info", response_model=YTdlInfo)
 async def fetch_info(request: YTdlRequest):
-    return service_ytdl.fetch_video_info(request.url)
+    try:
+        return await ytdl_info.fetch_video_info(request.url)
+    except yt_dlp.utils.DownloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/fetch-info/batch", response_model=YTdlBatchInfoResponse)
+async def fetch_info_batch(request: YTdlBatchInfoRequest):
+    """
+    Fetches the information of several videos at once, given either as a list
+    of URLs or as a playlist. Videos that fail are reported per item.
+    """
+    if request.urls:
+        items = await ytdl_info.fetch_many(request.urls)
+        return {"entries": len(items), "items": items}
+    try:
+        return await ytdl_info.fetch_playlist(request.playlist_url, request.limit)
+    except yt_dlp.utils.DownloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/download-request")
-async def download_request(request: YTdlDownloadRequest, background_tasks: BackgroundTasks):
-    task_id = service_ytdl.create_download_task(request.url, request.format_id, request.audio_only, request.audio_format)
-    background_tasks.add_task(service_ytdl.run_download_task, task_id, request.url, request.format_id, request.audio_only, request.audio_format)
+async def download_request(request: YTdlDownloadRequest):
+    task_id = await service_ytdl.create_download_task(request.url, request.format_id, request.audio_only, request.audio_format)
+    try:
+        # Submitting writes the queued task to the store; keep it off the loop.
+        await asyncio.to_thread(
+            job_scheduler.scheduler.submit,
+            'ytdl',
+            task_id,
+            url=request.url,
+            format_id=request.format_id,
+            audio_only=request.audio_only,
+            audio_format=request.audio_format,
+        )
+    except job_scheduler.QueueFullError as e:
+        await task_service.fail_task_async(task_id, str(e))
+        raise HTTPException(status_code=429, detail=str(e))
     return {"task_id": task_id}
 
+@router.post("/tasks/{task_id}/cancel")
+async def cancel_download(task_id: str):
+    try:
+        cancelled = await asyncio.to_thread(job_scheduler.scheduler.cancel, task_id)
+    except job_scheduler.TaskNotCancellableError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="No queued download for this task")
+    return {"message": "Download cancelled", "task_id": task_id}
+
 @router.get("/tasks/{task_id}/stream")
-async def stream_task_progress(task_id: str, db=Depends(get_db)):
-    async def event_generator():
-        last_progress = -1
-        while True:
-            task = task_service.get_task_status(task_id)
-            if task:
-                if task['progress'] != last_progress:
-                    yield {"data": json.dumps(task)}
-                    last_progress = task['progress']
-                if task['status'] in ['completed', 'failed']:
-                    break
-            await asyncio.sleep(1)
-    return EventSourceResponse(event_generator())
+async def stream_task_progress(task_id: str):
+    return EventSourceResponse(progress_bus.task_event_stream(task_id, task_service.get_task_status_async))
 
 @router.get("/download/{task_id}")
-async def download_file(task_id: str):
-    task = task_service.get_task_status(task_id)
+async def download_file(task_id: str, request: Request):
+    task = await task_service.get_task_status_async(task_id)
     if task and task['status'] == 'completed':
-        return FileResponse(task['result_path'], media_type='application/octet-stream', filename=os.path.basename(task['result_path']))
+        await cleanup_service.record_download(task)
+        return await result_serving.serve_result(request, task, 'application/octet-stream')
     return {"error": "File not found or task not completed"}
@@ -0,0 +1,181 @@
+import os
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+_CPU_COUNT = os.cpu_count() or 2
+
+# --- Job scheduler ---
+# ffmpeg transcodes run in a process pool, yt-dlp downloads in a thread pool.
+# *_MAX_WORKERS caps how many jobs of a tool run at once; *_MAX_QUEUED caps how
+# many may wait behind them before new submissions are rejected with a 429.
+FFMPEG_MAX_WORKERS = _env_int("NEXUSKIT_FFMPEG_MAX_WORKERS", max(1, _CPU_COUNT // 2))
+FFMPEG_MAX_QUEUED = _env_int("NEXUSKIT_FFMPEG_MAX_QUEUED", 50)
+# ffmpeg encoder threads per job when a request does not set them. Splitting the
+# cores between the pool's workers keeps concurrent jobs from oversubscribing
+# the CPU regardless of the machine size.
+FFMPEG_DEFAULT_THREADS = _env_int("NEXUSKIT_FFMPEG_DEFAULT_THREADS", max(1, _CPU_COUNT // FFMPEG_MAX_WORKERS))
+# Number of trailing stderr lines kept per ffmpeg run for error reporting.
+FFMPEG_STDERR_TAIL_LINES = _env_int("NEXUSKIT_FFMPEG_STDERR_TAIL_LINES", 200)
+# Segmented transcoding: inputs at least FFMPEG_SEGMENTED_MIN_DURATION seconds
+# long are split at keyframes and up to FFMPEG_SEGMENT_WORKERS segments are
+# encoded at once, each segment spanning at least FFMPEG_MIN_SEGMENT_SECONDS.
+FFMPEG_SEGMENTED_MIN_DURATION = _env_int("NEXUSKIT_FFMPEG_SEGMENTED_MIN_DURATION", 600)
+FFMPEG_SEGMENT_WORKERS = _env_int("NEXUSKIT_FFMPEG_SEGMENT_WORKERS", 4)
+FFMPEG_MIN_SEGMENT_SECONDS = _env_int("NEXUSKIT_FFMPEG_MIN_SEGMENT_SECONDS", 10)
+# Streamed conversions are read from ffmpeg's stdout and appended to the output
+# file in chunks of up to FFMPEG_STREAM_CHUNK_BYTES.
+FFMPEG_STREAM_CHUNK_BYTES = _env_int("NEXUSKIT_FFMPEG_STREAM_CHUNK_BYTES", 256 * 1024)
+YTDL_MAX_WORKERS = _env_int("NEXUSKIT_YTDL_MAX_WORKERS", 4)
+YTDL_MAX_QUEUED = _env_int("NEXUSKIT_YTDL_MAX_QUEUED", 100)
+# HLS and DASH downloads fetch up to YTDL_FRAGMENT_CONCURRENCY fragments at once
+# per job, and at most YTDL_MAX_FRAGMENT_CONCURRENCY across all jobs (each job
+# always gets at least one).
+YTDL_FRAGMENT_CONCURRENCY = _env_int("NEXUSKIT_YTDL_FRAGMENT_CONCURRENCY", 4)
+YTDL_MAX_FRAGMENT_CONCURRENCY = _env_int("NEXUSKIT_YTDL_MAX_FRAGMENT_CONCURRENCY", 16)
+# A download's progress is reported at most every YTDL_PROGRESS_INTERVAL_MS, and
+# only once it has moved by YTDL_PROGRESS_MIN_DELTA percent; its speed and ETA
+# are still refreshed every YTDL_PROGRESS_HEARTBEAT_MS.
+YTDL_PROGRESS_INTERVAL_MS = _env_int("NEXUSKIT_YTDL_PROGRESS_INTERVAL_MS", 250)
+YTDL_PROGRESS_MIN_DELTA = _env_int("NEXUSKIT_YTDL_PROGRESS_MIN_DELTA", 1)
+YTDL_PROGRESS_HEARTBEAT_MS = _env_int("NEXUSKIT_YTDL_PROGRESS_HEARTBEAT_MS", 2000)
+# Every JOB_HEARTBEAT_SECONDS, a server process marks the jobs it runs as alive.
+# A running job not marked for JOB_HEARTBEAT_TIMEOUT seconds has lost its
+# process, and is requeued if its tool can resume it.
+JOB_HEARTBEAT_SECONDS = _env_int("NEXUSKIT_JOB_HEARTBEAT_SECONDS", 30)
+JOB_HEARTBEAT_TIMEOUT = _env_int("NEXUSKIT_JOB_HEARTBEAT_TIMEOUT", 120)
+
+# --- yt-dlp metadata ---
+# Video information is extracted on YTDL_INFO_WORKERS threads and cached per
+# normalized URL for YTDL_INFO_CACHE_TTL seconds, keeping at most
+# YTDL_INFO_CACHE_MAX_ENTRIES videos. A batch lookup resolves at most
+# YTDL_INFO_BATCH_MAX_URLS videos.
+YTDL_INFO_WORKERS = _env_int("NEXUSKIT_YTDL_INFO_WORKERS", 8)
+YTDL_INFO_CACHE_TTL = _env_int("NEXUSKIT_YTDL_INFO_CACHE_TTL", 15 * 60)
+YTDL_INFO_CACHE_MAX_ENTRIES = _env_int("NEXUSKIT_YTDL_INFO_CACHE_MAX_ENTRIES", 2000)
+YTDL_INFO_BATCH_MAX_URLS = _env_int("NEXUSKIT_YTDL_INFO_BATCH_MAX_URLS", 50)
+
+# --- Task store ---
+# Where task records live: "sqlite" for the application database, or a
+# redis://host:port/db URL to share them between several server processes.
+TASK_STORE_URL = os.environ.get("NEXUSKIT_TASK_STORE_URL", "sqlite")
+# Writers wait up to TASK_DB_BUSY_TIMEOUT_MS for a lock before failing with
+# "database is locked". Progress updates are written behind, at most once per
+# TASK_PROGRESS_FLUSH_MS for all tasks together; status changes are committed
+# right away.
+TASK_DB_BUSY_TIMEOUT_MS = _env_int("NEXUSKIT_TASK_DB_BUSY_TIMEOUT_MS", 5000)
+TASK_PROGRESS_FLUSH_MS = _env_int("NEXUSKIT_TASK_PROGRESS_FLUSH_MS", 1000)
+# Updates reach progress streams and followed downloads on an in-process bus.
+# Those of jobs run by another server process only reach the store, so a
+# stream that has heard nothing for TASK_STORE_POLL_MS reloads its task.
+TASK_STORE_POLL_MS = _env_int("NEXUSKIT_TASK_STORE_POLL_MS", 2000)
+
+# --- Cleanup ---
+# A task's directory and record are deleted once the task expires: its tool's
+# TTL in CLEANUP_TTLS (CLEANUP_DEFAULT_TTL for the others) after its result is
+# ready, or CLEANUP_AFTER_DOWNLOAD_SECONDS after a result of one of the one-off
+# tools in CLEANUP_EXPIRE_ON_DOWNLOAD was downloaded, which leaves time to resume
+# the download. Whenever the disk holding the task directories is more than
+# CLEANUP_DISK_HIGH_PERCENT full, the least recently used results are deleted
+# until it is below CLEANUP_DISK_LOW_PERCENT. Tasks are deleted
+# CLEANUP_BATCH_SIZE at a time, and a full pass, which also picks up the expiry
+# times set by worker processes, runs every CLEANUP_INTERVAL_SECONDS.
+CLEANUP_DEFAULT_TTL = _env_int("NEXUSKIT_CLEANUP_DEFAULT_TTL", 24 * 3600)
+CLEANUP_TTLS = {
+    "ytdl": _env_int("NEXUSKIT_CLEANUP_YTDL_TTL", 6 * 3600),
+    "pdf-compress": _env_int("NEXUSKIT_CLEANUP_PDF_COMPRESS_TTL", 6 * 3600),
+    "pdf-merge": _env_int("NEXUSKIT_CLEANUP_PDF_MERGE_TTL", 6 * 3600),
+    "image-batch": _env_int("NEXUSKIT_CLEANUP_IMAGE_BATCH_TTL", 3600),
+}
+CLEANUP_EXPIRE_ON_DOWNLOAD = ("ytdl", "pdf-compress", "pdf-merge", "image-batch")
+CLEANUP_AFTER_DOWNLOAD_SECONDS = _env_int("NEXUSKIT_CLEANUP_AFTER_DOWNLOAD_SECONDS", 600)
+CLEANUP_DISK_HIGH_PERCENT = _env_int("NEXUSKIT_CLEANUP_DISK_HIGH_PERCENT", 90)
+CLEANUP_DISK_LOW_PERCENT = _env_int("NEXUSKIT_CLEANUP_DISK_LOW_PERCENT", 80)
+CLEANUP_BATCH_SIZE = _env_int("NEXUSKIT_CLEANUP_BATCH_SIZE", 100)
+CLEANUP_INTERVAL_SECONDS = _env_int("NEXUSKIT_CLEANUP_INTERVAL_SECONDS", 60)
+# Every task expires, including those that fail or are abandoned before their
+# result is ready, but active ones (pending, queued or processing) are kept.
+# An active task that has not been updated for CLEANUP_STALE_TASK_SECONDS, more
+# than any job should take to run or wait in a queue, was abandoned, e.g. by a
+# server that stopped while running it, and is failed by the full pass so
+# that it expires too.
+CLEANUP_STALE_TASK_SECONDS = _env_int("NEXUSKIT_CLEANUP_STALE_TASK_SECONDS", 12 * 3600)
+
+# --- Downloads ---
+# Results are sent DOWNLOAD_CHUNK_BYTES at a time when the ASGI server cannot
+# send files itself, and a Range header asking for more than
+# DOWNLOAD_MAX_RANGES ranges is ignored. Behind nginx, set
+# DOWNLOAD_ACCEL_REDIRECT_PREFIX to an internal location aliased to the task
+# directories, e.g. "/_results/" with `location /_results/ { internal; alias
+# /var/tmp/nexuskit_data/; }`, and nginx sends the files instead.
+DOWNLOAD_CHUNK_BYTES = _env_int("NEXUSKIT_DOWNLOAD_CHUNK_BYTES", 1024 * 1024)
+DOWNLOAD_MAX_RANGES = _env_int("NEXUSKIT_DOWNLOAD_MAX_RANGES", 16)
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get("NEXUSKIT_DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
+# A result that is still being written is followed: after catching up with
+# the writer, a download looks again after the task's next update or
+# DOWNLOAD_FOLLOW_POLL_MS, and gives up once neither the file nor the task has
+# changed for DOWNLOAD_FOLLOW_IDLE_TIMEOUT seconds.
+DOWNLOAD_FOLLOW_POLL_MS = _env_int("NEXUSKIT_DOWNLOAD_FOLLOW_POLL_MS", 200)
+DOWNLOAD_FOLLOW_IDLE_TIMEOUT = _env_int("NEXUSKIT_DOWNLOAD_FOLLOW_IDLE_TIMEOUT", 300)
+
+# --- Uploads ---
+# Per-tool upload size limits, in bytes.
+FFMPEG_MAX_UPLOAD_BYTES = _env_int("NEXUSKIT_FFMPEG_MAX_UPLOAD_BYTES", 4 * 1024 ** 3)
+IMAGE_MAX_UPLOAD_BYTES = _env_int("NEXUSKIT_IMAGE_MAX_UPLOAD_BYTES", 100 * 1024 ** 2)
+PDF_MAX_UPLOAD_BYTES = _env_int("NEXUSKIT_PDF_MAX_UPLOAD_BYTES", 500 * 1024 ** 2)
+
+# --- Result cache ---
+# Content-addressed store for finished outputs, kept outside the task
+# directories so the cleanup sweep never removes it. It must be on the same
+# filesystem as the task directories for outputs to be hard-linked.
+RESULT_CACHE_DIR = os.environ.get("NEXUSKIT_RESULT_CACHE_DIR", "/var/tmp/nexuskit_cache")
+FFMPEG_CACHE_MAX_BYTES = _env_int("NEXUSKIT_FFMPEG_CACHE_MAX_BYTES", 20 * 1024 ** 3)
+PDF_COMPRESS_CACHE_MAX_BYTES = _env_int("NEXUSKIT_PDF_COMPRESS_CACHE_MAX_BYTES", 5 * 1024 ** 3)
+
+# --- PDF previews ---
+# Page previews are rendered on first request at one of these DPI tiers and
+# kept in an in-memory LRU cache of at most PDF_PREVIEW_CACHE_MAX_BYTES.
+PDF_PREVIEW_TIERS = {"small": 36, "medium": 72, "large": 144}
+PDF_PREVIEW_DEFAULT_TIER = "medium"
+PDF_PREVIEW_CACHE_MAX_BYTES = _env_int("NEXUSKIT_PDF_PREVIEW_CACHE_MAX_BYTES", 256 * 1024 ** 2)
+# Default quality of JPEG and WebP previews.
+PDF_PREVIEW_QUALITY = _env_int("NEXUSKIT_PDF_PREVIEW_QUALITY", 80)
+# Rendering whole documents is spread over PDF_RASTER_WORKERS processes, in
+# ranges of at most PDF_RASTER_CHUNK_PAGES pages.
+PDF_RASTER_WORKERS = _env_int("NEXUSKIT_PDF_RASTER_WORKERS", max(1, _CPU_COUNT - 1))
+PDF_RASTER_CHUNK_PAGES = _env_int("NEXUSKIT_PDF_RASTER_CHUNK_PAGES", 8)
+# At most this many Ghostscript compressions run at once; up to
+# PDF_COMPRESS_MAX_QUEUED more wait in the job queue.
+PDF_COMPRESS_MAX_CONCURRENCY = _env_int("NEXUSKIT_PDF_COMPRESS_MAX_CONCURRENCY", max(1, _CPU_COUNT // 2))
+PDF_COMPRESS_MAX_QUEUED = _env_int("NEXUSKIT_PDF_COMPRESS_MAX_QUEUED", 100)
+# Merging keeps at most this much input in memory before flushing the partial
+# result to disk.
+PDF_MERGE_FLUSH_BYTES = _env_int("NEXUSKIT_PDF_MERGE_FLUSH_BYTES", 128 * 1024 ** 2)
+# Garbage collection level of merged PDFs: 3 drops unused objects and merges
+# identical ones; 4 also compares stream contents, which catches fonts and
+# images embedded separately by each input but is quadratic in their number.
+PDF_MERGE_GARBAGE_LEVEL = _env_int("NEXUSKIT_PDF_MERGE_GARBAGE_LEVEL", 3)
+
+# --- Image editor ---
+# Edit sessions keep decoded images in memory: a keyframe every
+# IMAGE_KEYFRAME_INTERVAL versions, with the versions in between rebuilt from
+# the operation log. Sessions are evicted least-recently-used once their
+# images take more than IMAGE_SESSION_CACHE_MAX_BYTES.
+IMAGE_KEYFRAME_INTERVAL = _env_int("NEXUSKIT_IMAGE_KEYFRAME_INTERVAL", 5)
+IMAGE_SESSION_CACHE_MAX_BYTES = _env_int("NEXUSKIT_IMAGE_SESSION_CACHE_MAX_BYTES", 512 * 1024 ** 2)
+# Images larger than this on their longer side are edited through a downscaled
+# proxy; the edits are replayed on the original on export.
+IMAGE_PROXY_MAX_SIDE = _env_int("NEXUSKIT_IMAGE_PROXY_MAX_SIDE", 2048)
+# Batch jobs run on IMAGE_BATCH_WORKERS processes, with at most two images per
+# worker decoded or waiting to be zipped at any time. A batch takes at most
+# IMAGE_BATCH_MAX_FILES images and IMAGE_BATCH_MAX_UPLOAD_BYTES of input,
+# measured after unpacking zip uploads.
+IMAGE_BATCH_WORKERS = _env_int("NEXUSKIT_IMAGE_BATCH_WORKERS", max(1, _CPU_COUNT - 1))
+IMAGE_BATCH_MAX_FILES = _env_int("NEXUSKIT_IMAGE_BATCH_MAX_FILES", 1000)
+IMAGE_BATCH_MAX_UPLOAD_BYTES = _env_int("NEXUSKIT_IMAGE_BATCH_MAX_UPLOAD_BYTES", 2 * 1024 ** 3)
+# Edited versions are shown as AVIF, WebP or JPEG when the browser accepts them,
+# at this quality, and resized on request to the smallest of these widths that
+# is at least as wide as asked for.
+IMAGE_VIEW_QUALITY = _env_int("NEXUSKIT_IMAGE_VIEW_QUALITY", 80)
+IMAGE_VIEW_WIDTHS = (320, 640, 960, 1280, 1920, 2560)
@@ -2,6 +2,7 @@
 import sqlite3
 import threading
 from contextlib import contextmanager
+from .core import config
 
 DATABASE_FILE = "nexuskit_tasks.db"
 
@@ -16,10 +17,22 @@ def get_db_connection():
     if not hasattr(local, "connection"):
         # Using check_same_thread=False is suitable for FastAPI's multi-threaded nature.
         # The connection is managed per-thread via the `local` object.
-        local.connection = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+        local.connection = sqlite3.connect(DATABASE_FILE, check_same_thread=False, timeout=config.TASK_DB_BUSY_TIMEOUT_MS / 1000)
         local.connection.row_factory = sqlite3.Row  # Allows accessing columns by name
+        _configure(local.connection)
     return local.connection
 
+def _configure(conn):
+    # WAL lets readers run alongside the writer and turns every commit into an
+    # append to the log. With it, synchronous=NORMAL only syncs at checkpoints:
+    # a power loss may drop the last commits but never corrupts the database,
+    # which is fine for task state.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000")  # 16 MB
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+
 @contextmanager
 def get_db():
     """
@@ -35,7 +48,8 @@ def get_db():
 
 def init_db():
     """
-    Initializes the database by creating the 'tasks' table if it doesn't already exist.
+    Initializes the database by creating the 'tasks', result cache and media probe
+    tables if they don't already exist.
     This function should be called once at application startup.
     """
     print("Initializing database...")
@@ -49,12 +63,94 @@ def init_db():
                 progress INTEGER DEFAULT 0,
                 result_path TEXT,
                 error_message TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                queued_at REAL,
+                job_args TEXT,
+                input_path TEXT,
+                input_sha256 TEXT,
+                input_size INTEGER,
+                downloaded_bytes INTEGER,
+                total_bytes INTEGER,
+                speed REAL,
+                eta INTEGER,
+                expires_at REAL,
+                last_used_at REAL,
+                owner TEXT
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                cache_key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                namespace TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_probes (
+                input_sha256 TEXT PRIMARY KEY,
+                probe TEXT NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """)
+        # Databases created before these columns existed are migrated in place.
+        _add_missing_columns(cursor, "tasks", {
+            "queued_at": "REAL",
+            "job_args": "TEXT",
+            "input_path": "TEXT",
+            "input_sha256": "TEXT",
+            "input_size": "INTEGER",
+            "downloaded_bytes": "INTEGER",
+            "total_bytes": "INTEGER",
+            "speed": "REAL",
+            "eta": "INTEGER",
+            "expires_at": "REAL",
+            "last_used_at": "REAL",
+            "owner": "TEXT",
+        })
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at)")
+        # Serves the queue listing and queue positions in task_service.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks (tool_name, status, queued_at)")
+        # Serve the cleanup scheduler: expired tasks, and the least recently
+        # used ones under disk pressure.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_expires_at ON tasks (expires_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_last_used_at ON tasks (last_used_at)")
+        # Tasks from before cleanup was scheduled per task expire a day after
+        # they were created, as they did with the directory sweep.
+        cursor.execute(
+            """
+            UPDATE tasks SET expires_at = CAST(strftime('%s', created_at) AS REAL) + 86400
+            WHERE expires_at IS NULL
+            """
+        )
+        cursor.execute(
+            """
+            UPDATE tasks SET last_used_at = CAST(strftime('%s', created_at) AS REAL)
+            WHERE last_used_at IS NULL
+            """
+        )
         conn.commit()
     print("Database initialized successfully.")
 
+def _add_missing_columns(cursor, table: str, columns: dict):
+    """
+    Adds any of `columns` (name -> SQL type) that are missing from `table`.
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row["name"] for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
 def close_db_connection(exception=None):
     """
     Closes the database connection for the current thread, if it exists.
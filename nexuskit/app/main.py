@@ -3,8 +3,9 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from .apis import router_ytdl, router_pdf, router_ffmpeg, router_image_editor, router_formatter
-from .services import cleanup_service
+from .services import cleanup_service, job_scheduler, pdf_rasterizer, image_batch, result_serving, task_service, task_store, ytdl_info
 from . import database
+import asyncio
 import logging
 import os
 import uuid
@@ -46,9 +47,19 @@ async def generic_exception_handler(request: Request, exc: Exception):
 async def startup_event():
     cleanup_service.setup_temp_directory()
     database.init_db()
+    # Resuming the queues reads and writes the task store.
+    await asyncio.to_thread(job_scheduler.scheduler.start)
+    await cleanup_service.scheduler.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    job_scheduler.scheduler.shutdown()
+    await cleanup_service.scheduler.stop()
+    pdf_rasterizer.shutdown()
+    image_batch.shutdown()
+    ytdl_info.shutdown()
+    await asyncio.to_thread(task_service.flush_progress)
+    task_store.shutdown()
     database.close_db_connection()
 
 # Mount static files
@@ -61,6 +72,10 @@ app.include_router(router_ffmpeg.router, prefix="/api/v1/ffmpeg", tags=["ffmpeg-
 app.include_router(router_image_editor.router, prefix="/api/v1/image", tags=["image-editor"])
 app.include_router(router_formatter.router, prefix="/api/v1/formatter", tags=["formatter"])
 
+@app.get("/api/v1/downloads/stats", tags=["downloads"])
+async def download_stats():
+    return result_serving.accounting.stats()
+
 from fastapi.responses import RedirectResponse
 
 @app.get("/")
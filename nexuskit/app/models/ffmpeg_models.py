@@ -1,8 +1,30 @@
-from pydantic import BaseModel
+from typing import Literal
+from pydantic import BaseModel, Field
+
+FFmpegPreset = Literal["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
 
 class FFmpegUploadResponse(BaseModel):
     task_id: str
     filename: str
+    duration: float | None = None
+
+class FFmpegStreamInfo(BaseModel):
+    index: int
+    codec_type: str | None = None
+    codec_name: str | None = None
+    width: int | None = None
+    height: int | None = None
+    sample_rate: str | None = None
+    channels: int | None = None
+    bit_rate: str | None = None
+
+class FFmpegProbeResponse(BaseModel):
+    task_id: str
+    format_name: str | None = None
+    duration: float | None = None
+    size: int | None = None
+    bit_rate: int | None = None
+    streams: list[FFmpegStreamInfo]
 
 class FFmpegConvertRequest(BaseModel):
     task_id: str
@@ -11,6 +33,15 @@ class FFmpegConvertRequest(BaseModel):
     resolution: str | None = None
     quality: str | None = None
     bitrate: str | None = None
+    # Encoder threads for this job (0 lets ffmpeg decide); defaults to the server's per-job share of the CPU.
+    threads: int | None = Field(None, ge=0, le=64)
+    # x264/x265 speed preset; faster presets use less CPU at the cost of larger files.
+    preset: FFmpegPreset | None = None
+    # Encode long inputs as parallel segments; None decides from the input duration.
+    segmented: bool | None = None
+    # Write streamable outputs (fragmented MP4, WebM, MP3, ...) through a pipe, so
+    # that /download can send them while ffmpeg is still encoding.
+    streaming: bool = False
 
 class TaskStatus(BaseModel):
     task_id: str
@@ -4,6 +4,9 @@ class ImageUploadResponse(BaseModel):
     task_id: str
     filename: str
     image_url: str
+    export_url: str
+    width: int
+    height: int
 
 class ImageEditRequest(BaseModel):
     task_id: str
@@ -13,3 +16,10 @@ class ImageEditRequest(BaseModel):
 class ImageEditResponse(BaseModel):
     task_id: str
     image_url: str
+    export_url: str
+    width: int
+    height: int
+
+class ImageBatchOperation(BaseModel):
+    action: str
+    params: dict = {}
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from typing import Annotated, Literal, Union
+from pydantic import BaseModel, Field
 
 class PDFUploadResponse(BaseModel):
     task_id: str
@@ -17,3 +18,28 @@ class AddSignatureRequest(BaseModel):
     y: float
     width: float
     signature_data_url: str
+
+class DeletePagesOperation(BaseModel):
+    op: Literal["delete"]
+    pages: list[int]
+
+class ReorderPagesOperation(BaseModel):
+    op: Literal["reorder"]
+    page_order: list[int]
+
+class MovePageOperation(BaseModel):
+    op: Literal["move"]
+    page: int
+    to: int
+
+class AddBlankPageOperation(BaseModel):
+    op: Literal["add_blank"]
+    at: int | None = None
+
+PageOperation = Annotated[
+    Union[DeletePagesOperation, ReorderPagesOperation, MovePageOperation, AddBlankPageOperation],
+    Field(discriminator="op"),
+]
+
+class PageOperationsRequest(BaseModel):
+    operations: list[PageOperation] = Field(min_length=1)
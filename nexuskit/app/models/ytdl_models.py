@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+from ..core import config
 
 class YTdlRequest(BaseModel):
     url: str
@@ -8,6 +9,27 @@ class YTdlInfo(BaseModel):
     thumbnail: str
     formats: list
 
+class YTdlBatchInfoRequest(BaseModel):
+    urls: list[str] = Field(default=[], max_length=config.YTDL_INFO_BATCH_MAX_URLS)
+    playlist_url: str | None = None
+    limit: int = Field(default=config.YTDL_INFO_BATCH_MAX_URLS, ge=1, le=config.YTDL_INFO_BATCH_MAX_URLS)
+
+    @model_validator(mode="after")
+    def check_source(self):
+        if bool(self.urls) == bool(self.playlist_url):
+            raise ValueError("Give either urls or playlist_url")
+        return self
+
+class YTdlBatchInfoItem(BaseModel):
+    url: str
+    info: YTdlInfo | None = None
+    error: str | None = None
+
+class YTdlBatchInfoResponse(BaseModel):
+    title: str | None = None
+    entries: int
+    items: list[YTdlBatchInfoItem]
+
 class YTdlDownloadRequest(BaseModel):
     url: str
     format_id: str
@@ -1,10 +1,17 @@
+import asyncio
+import contextlib
+import heapq
 import os
 import shutil
+import threading
 import time
 import logging
+from ..core import config
+from . import result_cache
+from .progress_bus import bus
+from .task_store import get_store
 
 TEMP_DIR = "/var/tmp/nexuskit_data"
-GRACE_PERIOD_SECONDS = 3600  # 1 hour
 
 logger = logging.getLogger(__name__)
 
@@ -12,13 +19,227 @@ def setup_temp_directory():
     os.makedirs(TEMP_DIR, exist_ok=True)
     logger.info(f"Ensured temporary directory exists: {TEMP_DIR}")
 
-def schedule_cleanup(task_id: str):
-    task_dir = os.path.join(TEMP_DIR, task_id)
-    if os.path.exists(task_dir):
-        logger.info(f"Scheduling cleanup for task {task_id} in {GRACE_PERIOD_SECONDS} seconds.")
-        # In a real-world scenario, this would use a proper task queue/scheduler
-        # For now, we'll just log and rely on the cron job for robustness.
-        # The actual deletion will be handled by the cron job.
+def ttl_for(tool_name: str) -> int:
+    """Returns how long the results of a tool are kept, in seconds."""
+    return config.CLEANUP_TTLS.get(tool_name, config.CLEANUP_DEFAULT_TTL)
+
+def _remove_directories(task_ids: list[str]):
+    for task_id in task_ids:
+        cleanup_task_directory(task_id)
+
+
+class CleanupScheduler:
+    """
+    Deletes the directories and records of tasks once they expire.
+
+    Expiry times are stored with the tasks, where they are indexed. This
+    process also keeps them in a min-heap so that it can sleep until exactly
+    the next one is due. The heap is only a timer: what gets deleted is always
+    looked up in the index, so expiry times that were moved, or set by worker
+    processes that have no scheduler, are honoured. A periodic pass picks up
+    the latter, fails the active tasks that were abandoned (see
+    `config.CLEANUP_STALE_TASK_SECONDS`) so that they expire as well, and the
+    disk is kept below its high-water mark by deleting the least recently used
+    results. Deletions run in batches, off the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: list[tuple[float, str]] = []
+        self._loop = None
+        self._wakeup = None
+        self._check_disk = False
+        self._task = None
+
+    async def start(self):
+        """Loads the expiry times and starts deleting on the running event loop."""
+        runner = get_store()
+        times = await runner.acall(runner.store.get_expiry_times())
+        heapq.heapify(times)
+        with self._lock:
+            self._heap = times
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+        logger.info(f"Cleanup scheduler tracking {len(times)} task(s).")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        with self._lock:
+            self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def push(self, expires_at: float, task_id: str):
+        """Wakes the scheduler at `expires_at`. Safe to call from any thread."""
+        with self._lock:
+            if self._loop is None:
+                return
+            earliest = not self._heap or expires_at < self._heap[0][0]
+            heapq.heappush(self._heap, (expires_at, task_id))
+        if earliest:
+            self._wake()
+
+    def check_disk(self):
+        """Has the scheduler check the disk usage soon, e.g. after a new result."""
+        self._check_disk = True
+        self._wake()
+
+    def _wake(self):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # The loop has been closed.
+            pass
+
+    async def _run(self):
+        next_pass = 0.0
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            try:
+                if now >= next_pass:
+                    await self.run_once()
+                    next_pass = now + config.CLEANUP_INTERVAL_SECONDS
+                else:
+                    if self._pop_due(now):
+                        await self._expire(now)
+                    if self._check_disk:
+                        self._check_disk = False
+                        await self._relieve_disk_pressure()
+            except Exception as e:
+                logger.error(f"Cleanup failed: {e}", exc_info=True)
+            with self._lock:
+                next_expiry = self._heap[0][0] if self._heap else float("inf")
+            timeout = min(next_expiry, next_pass) - time.time()
+            if timeout > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    def _pop_due(self, now: float) -> bool:
+        with self._lock:
+            due = False
+            while self._heap and self._heap[0][0] <= now:
+                heapq.heappop(self._heap)
+                due = True
+            return due
+
+    async def run_once(self):
+        """
+        Fails abandoned tasks, deletes every expired task, then relieves disk
+        pressure if needed.
+        """
+        now = time.time()
+        self._pop_due(now)
+        await self._fail_stale(now)
+        await self._expire(now)
+        self._check_disk = False
+        await self._relieve_disk_pressure()
+
+    async def _expire(self, now: float):
+        runner = get_store()
+        while True:
+            task_ids = await runner.acall(runner.store.get_expired(now, config.CLEANUP_BATCH_SIZE))
+            if task_ids:
+                logger.info(f"Deleted {await self._delete(task_ids)} expired task(s).")
+            if len(task_ids) < config.CLEANUP_BATCH_SIZE:
+                return
+
+    async def _fail_stale(self, now: float):
+        runner = get_store()
+        before = now - config.CLEANUP_STALE_TASK_SECONDS
+        while True:
+            task_ids = await runner.acall(runner.store.get_stale(before, config.CLEANUP_BATCH_SIZE))
+            error_message = f"Abandoned after {config.CLEANUP_STALE_TASK_SECONDS} seconds without an update"
+            for task_id in task_ids:
+                # Failing also takes the task out of the next batch.
+                await runner.acall(runner.store.update_task(task_id, {"status": "failed", "error_message": error_message}))
+                bus.publish(task_id, status="failed", error_message=error_message)
+            if task_ids:
+                logger.warning(f"Failed {len(task_ids)} abandoned task(s).")
+            if len(task_ids) < config.CLEANUP_BATCH_SIZE:
+                return
+
+    async def _relieve_disk_pressure(self):
+        usage = await asyncio.to_thread(shutil.disk_usage, TEMP_DIR)
+        if usage.used * 100 < usage.total * config.CLEANUP_DISK_HIGH_PERCENT:
+            return
+        logger.warning(f"{TEMP_DIR} is {usage.used * 100 // usage.total}% full; deleting the least recently used results.")
+        runner = get_store()
+        deleted = 0
+        while usage.used * 100 >= usage.total * config.CLEANUP_DISK_LOW_PERCENT:
+            task_ids = await runner.acall(runner.store.get_least_recently_used(config.CLEANUP_BATCH_SIZE))
+            if not task_ids:
+                logger.warning(f"No more results to delete, {TEMP_DIR} is still {usage.used * 100 // usage.total}% full.")
+                break
+            deleted += await self._delete(task_ids)
+            usage = await asyncio.to_thread(shutil.disk_usage, TEMP_DIR)
+        logger.info(f"Deleted {deleted} result(s) under disk pressure.")
+
+    async def _delete(self, task_ids: list[str]) -> int:
+        # Records go first, and only those still inactive: a task submitted
+        # again since it was picked keeps its record and its directory.
+        runner = get_store()
+        deleted = await runner.acall(runner.store.delete_tasks(task_ids))
+        await asyncio.to_thread(_remove_directories, deleted)
+        return len(deleted)
+
+
+scheduler = CleanupScheduler()
+
+
+def schedule_cleanup(task_id: str, ttl: int | None = None):
+    """
+    Sets when a task's directory and record are deleted. Safe to call from
+    any thread or worker process.
+
+    Args:
+        task_id: The ID of the task.
+        ttl: Seconds from now; by default the TTL of the task's tool, see
+            `ttl_for`.
+    """
+    runner = get_store()
+    runner.call(_schedule_cleanup(runner.store, task_id, ttl))
+
+async def schedule_cleanup_async(task_id: str, ttl: int | None = None):
+    """Like `schedule_cleanup`, without blocking the calling event loop."""
+    runner = get_store()
+    await runner.acall(_schedule_cleanup(runner.store, task_id, ttl))
+
+async def _schedule_cleanup(store, task_id: str, ttl: int | None):
+    # Runs on the store's loop, so looking up the tool takes no extra hop.
+    if ttl is None:
+        task = await store.get_task(task_id)
+        if task is None:
+            return
+        ttl = ttl_for(task['tool_name'])
+    now = time.time()
+    await store.update_task(task_id, {"expires_at": now + ttl, "last_used_at": now})
+    scheduler.push(now + ttl, task_id)
+    scheduler.check_disk()
+
+async def record_download(task: dict):
+    """
+    Notes that a task's result was downloaded. The results of the one-off
+    tools in `config.CLEANUP_EXPIRE_ON_DOWNLOAD` then expire after
+    `config.CLEANUP_AFTER_DOWNLOAD_SECONDS`, which leaves time to resume an
+    interrupted download; other results only count as recently used.
+    """
+    now = time.time()
+    fields = {"last_used_at": now}
+    if task['tool_name'] in config.CLEANUP_EXPIRE_ON_DOWNLOAD:
+        expires_at = now + config.CLEANUP_AFTER_DOWNLOAD_SECONDS
+        if task.get('expires_at') is None or expires_at < task['expires_at']:
+            fields["expires_at"] = expires_at
+    runner = get_store()
+    await runner.acall(runner.store.update_task(task['task_id'], fields))
+    if "expires_at" in fields:
+        scheduler.push(fields["expires_at"], task['task_id'])
 
 def cleanup_task_directory(task_id: str):
     task_dir = os.path.join(TEMP_DIR, task_id)
@@ -29,18 +250,16 @@ def cleanup_task_directory(task_id: str):
         except Exception as e:
             logger.error(f"Error cleaning up task directory {task_dir}: {e}")
 
-def periodic_cleanup_script(age_seconds: int = 86400):  # 24 hours
+def periodic_cleanup_script():
+    """
+    One cleanup pass for when the server is not running: deletes the expired
+    tasks and relieves disk pressure, as the server's scheduler does
+    continuously, and enforces the result cache size limits.
+    """
     setup_temp_directory()
-    now = time.time()
-    for item in os.listdir(TEMP_DIR):
-        item_path = os.path.join(TEMP_DIR, item)
-        if os.path.isdir(item_path):
-            try:
-                # Check modification time of the directory
-                mod_time = os.path.getmtime(item_path)
-                if (now - mod_time) > age_seconds:
-                    shutil.rmtree(item_path)
-                    logger.info(f"Cron job cleaned up old task directory: {item_path}")
-            except Exception as e:
-                logger.error(f"Cron job error cleaning up {item_path}: {e}")
+    asyncio.run(scheduler.run_once())
 
+    # Cached results are hard-linked into task directories, so removing those
+    # directories above does not free the cached copies; keep the caches
+    # within their size limits here as well.
+    result_cache.evict_all()
@@ -0,0 +1,318 @@
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import posixpath
+import shutil
+import threading
+import time
+import zipfile
+from PIL import Image, UnidentifiedImageError
+from ..core import config
+from . import cleanup_service, task_service, upload_ingest, image_ops
+from .progress_bus import bus
+
+logger = logging.getLogger(__name__)
+
+# Output format -> (Pillow format, file extension).
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+
+RESULT_FILE = "results.zip"
+_ERRORS_FILE = "errors.txt"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> concurrent.futures.ProcessPoolExecutor:
+    """Returns the pool of image batch worker processes, starting it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.IMAGE_BATCH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def shutdown(wait: bool = False):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
+
+
+def _process_image(input_path: str, output_path: str, operations: list[tuple[str, dict]], image_format: str, quality: int) -> int:
+    # Runs in a worker process. Only paths cross the process boundary, never
+    # pixels.
+    pil_format, _ = OUTPUT_FORMATS[image_format]
+    with Image.open(input_path) as img:
+        if operations and operations[0][0] == "resize":
+            # Lets JPEGs decode straight at a reduced size when shrinking.
+            params = operations[0][1]
+            img.draft("RGB", (params["width"], params["height"]))
+        img.load()
+        result = image_ops.apply_operations(img, operations)
+    if pil_format == "JPEG" and result.mode not in ("RGB", "L"):
+        result = result.convert("RGB")
+    save_args = {} if pil_format == "PNG" else {"quality": quality}
+    result.save(output_path, format=pil_format, **save_args)
+    return os.path.getsize(output_path)
+
+
+def _safe_name(name: str) -> str | None:
+    # Keeps the folder structure of zip uploads, minus anything escaping it.
+    name = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if name in (".", "") or name.startswith("../") or name == "..":
+        return None
+    return name
+
+
+def _extract_zip(source, inputs_dir: str, first_index: int, budget: int) -> list[tuple[str, str, int]]:
+    """
+    Unpacks the files of a zip upload into `inputs_dir`, counting the bytes
+    actually written rather than trusting the sizes in the archive. Stops as
+    soon as the batch would exceed `config.IMAGE_BATCH_MAX_FILES`.
+
+    Returns:
+        `(path, name, size)` for every file, `name` being its path in the zip.
+
+    Raises:
+        UploadTooLargeError: If the files exceed `budget` bytes.
+        ValueError: If the batch would have too many files.
+    """
+    extracted = []
+    source.seek(0)
+    with zipfile.ZipFile(source) as archive:
+        for member in archive.infolist():
+            name = _safe_name(member.filename)
+            if member.is_dir() or name is None or name.startswith("__MACOSX/"):
+                continue
+            if first_index + len(extracted) >= config.IMAGE_BATCH_MAX_FILES:
+                raise ValueError(f"A batch can contain at most {config.IMAGE_BATCH_MAX_FILES} images")
+            extension = os.path.splitext(name)[1].lower()
+            path = os.path.join(inputs_dir, f"{first_index + len(extracted):05d}{extension}")
+            size = 0
+            with archive.open(member) as entry, open(path, "wb") as destination:
+                while chunk := entry.read(upload_ingest.CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > budget:
+                        raise upload_ingest.UploadTooLargeError(config.IMAGE_BATCH_MAX_UPLOAD_BYTES)
+                    destination.write(chunk)
+            budget -= size
+            extracted.append((path, name, size))
+    return extracted
+
+
+async def ingest_batch(files, task_dir: str) -> list[dict]:
+    """
+    Stores the uploads of a batch in `task_dir/inputs`. Zip uploads are
+    unpacked and every file in them becomes part of the batch.
+
+    Returns:
+        One `{"path", "name"}` dictionary per input, `name` being the upload's
+        file name or its path inside the zip.
+
+    Raises:
+        UploadTooLargeError: If the inputs exceed `config.IMAGE_BATCH_MAX_UPLOAD_BYTES`.
+        ValueError: If there are no inputs, too many, or a zip is corrupt.
+    """
+    inputs_dir = os.path.join(task_dir, "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+    budget = config.IMAGE_BATCH_MAX_UPLOAD_BYTES
+    inputs = []
+    for file in files:
+        filename = os.path.basename(file.filename or "upload")
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == ".zip":
+            try:
+                extracted = await asyncio.to_thread(_extract_zip, file.file, inputs_dir, len(inputs), budget)
+            except zipfile.BadZipFile:
+                raise ValueError(f"{filename} is not a valid zip file")
+            for path, name, size in extracted:
+                inputs.append({"path": path, "name": name})
+                budget -= size
+        else:
+            upload = await upload_ingest.ingest_upload(file, inputs_dir, min(budget, config.IMAGE_MAX_UPLOAD_BYTES), filename=f"{len(inputs):05d}{extension}")
+            inputs.append({"path": upload['path'], "name": filename})
+            budget -= upload['size']
+        if len(inputs) > config.IMAGE_BATCH_MAX_FILES:
+            raise ValueError(f"A batch can contain at most {config.IMAGE_BATCH_MAX_FILES} images")
+    if not inputs:
+        raise ValueError("The batch contains no files")
+    return inputs
+
+
+def _output_names(inputs: list[dict], extension: str) -> list[str]:
+    # Same name with the new extension, made unique where two inputs collide.
+    names = []
+    taken = set()
+    for item in inputs:
+        stem = os.path.splitext(item["name"])[0]
+        name = stem + extension
+        counter = 1
+        while name in taken:
+            name = f"{stem}_{counter}{extension}"
+            counter += 1
+        taken.add(name)
+        names.append(name)
+    return names
+
+
+class _ZipSink:
+    """
+    Write-only file object for `zipfile`, which buffers what is written until
+    the response takes it, and tees everything to the result file on disk.
+    Having no `seek`, it makes `zipfile` write in streaming mode.
+    """
+
+    def __init__(self, tee):
+        self._tee = tee
+        self._chunks = []
+
+    def write(self, data) -> int:
+        if self._tee.closed:
+            # Abandoned; `zipfile` still writes its end record on collection.
+            return len(data)
+        data = bytes(data)
+        self._chunks.append(data)
+        self._tee.write(data)
+        return len(data)
+
+    def flush(self):
+        if not self._tee.closed:
+            self._tee.flush()
+
+    def close(self):
+        self._tee.close()
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _add_file(archive: zipfile.ZipFile, path: str, name: str):
+    info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    # The outputs are compressed images already; deflating them again gains
+    # nothing.
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = os.path.getsize(path)
+    with open(path, "rb") as source, archive.open(info, "w") as entry:
+        shutil.copyfileobj(source, entry, upload_ingest.CHUNK_SIZE)
+
+
+async def stream_batch(task_id: str, inputs: list[dict], operations: list[tuple[str, dict]], image_format: str, quality: int):
+    """
+    Runs a batch and yields a zip of the results, adding each image as soon as
+    it is done. Images that fail are listed in an `errors.txt` entry instead.
+
+    The images are processed on the batch worker pool with at most two per
+    worker in flight, and inputs and outputs are deleted once zipped, so
+    memory and disk use do not grow with the batch. Progress is published per
+    image; the zip is also written to the task directory as its result.
+    """
+    task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
+    outputs_dir = os.path.join(task_dir, "outputs")
+    os.makedirs(outputs_dir, exist_ok=True)
+    result_path = os.path.join(task_dir, RESULT_FILE)
+    part_path = result_path + ".part"
+    names = _output_names(inputs, OUTPUT_FORMATS[image_format][1])
+
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    max_in_flight = config.IMAGE_BATCH_WORKERS * 2
+    jobs = iter(enumerate(inputs))
+    in_flight = {}
+    errors = []
+    done = 0
+
+    def submit_next():
+        for index, item in jobs:
+            output_path = os.path.join(outputs_dir, f"{index:05d}{OUTPUT_FORMATS[image_format][1]}")
+            future = loop.run_in_executor(executor, _process_image, item["path"], output_path, operations, image_format, quality)
+            in_flight[future] = (index, output_path)
+            return
+
+    sink = _ZipSink(open(part_path, "wb"))
+    archive = zipfile.ZipFile(sink, "w")
+    try:
+        for _ in range(max_in_flight):
+            submit_next()
+        while in_flight:
+            completed, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in completed:
+                index, output_path = in_flight.pop(future)
+                submit_next()
+                try:
+                    future.result()
+                    await asyncio.to_thread(_add_file, archive, output_path, names[index])
+                    error = None
+                except UnidentifiedImageError:
+                    error = f"{inputs[index]['name']}: not a supported image"
+                    errors.append(error)
+                except Exception as e:
+                    logger.warning(f"Batch {task_id}: {inputs[index]['name']} failed: {e}")
+                    error = f"{inputs[index]['name']}: {e}"
+                    errors.append(error)
+                for path in (inputs[index]["path"], output_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                done += 1
+                bus.publish(task_id, files_done=done, files_total=len(inputs), file=inputs[index]["name"], file_error=error)
+                await task_service.update_task_progress_async(task_id, done * 100 // len(inputs))
+                chunk = sink.take()
+                if chunk:
+                    yield chunk
+
+        if errors:
+            archive.writestr(_ERRORS_FILE, "\n".join(errors) + "\n")
+        await asyncio.to_thread(archive.close)
+        sink.close()
+        os.replace(part_path, result_path)
+        await task_service.complete_task_async(task_id, result_path)
+        # The zip has just been downloaded, by this very response.
+        await cleanup_service.schedule_cleanup_async(task_id, ttl=config.CLEANUP_AFTER_DOWNLOAD_SECONDS)
+        yield sink.take()
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away; nobody is left to receive the rest. Not
+        # awaited: the response's cancel scope would cancel any await here.
+        task_service.cancel_task(task_id)
+        _discard(task_id, in_flight, sink)
+        raise
+    except Exception as e:
+        await task_service.fail_task_async(task_id, str(e))
+        _discard(task_id, in_flight, sink)
+        raise
+
+
+def _discard(task_id: str, in_flight: dict, sink: _ZipSink):
+    for future in in_flight:
+        future.cancel()
+    sink.close()
+    cleanup_service.cleanup_task_directory(task_id)
+
+
+async def create_batch(files) -> tuple[str, list[dict]]:
+    """
+    Creates an 'image-batch' task and stores its inputs.
+
+    Returns:
+        The task ID and the inputs, as returned by `ingest_batch`.
+    """
+    task_id = await task_service.create_task_async(tool_name='image-batch')
+    task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
+    try:
+        inputs = await ingest_batch(files, task_dir)
+    except (upload_ingest.UploadTooLargeError, ValueError) as e:
+        await task_service.fail_task_async(task_id, str(e))
+        cleanup_service.cleanup_task_directory(task_id)
+        raise
+    return task_id, inputs
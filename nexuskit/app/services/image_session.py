@@ -0,0 +1,229 @@
+import collections
+import json
+import os
+import threading
+from PIL import Image
+from ..core import config
+
+# The operation log of a session, stored next to the original image so that an
+# evicted session can be rebuilt.
+HISTORY_FILE = "edits.json"
+
+
+def _image_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+def _open_proxy(path: str) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Decodes an image at no more than `config.IMAGE_PROXY_MAX_SIDE` pixels on
+    its longer side. Returns the image and the original's size.
+    """
+    max_side = config.IMAGE_PROXY_MAX_SIDE
+    with Image.open(path) as img:
+        original_size = img.size
+        # thumbnail() lets JPEGs decode straight at a reduced size, which is
+        # much faster than decoding everything and downscaling afterwards.
+        img.thumbnail((max_side, max_side), reducing_gap=2.0)
+        img.load()
+        proxy = img
+    return proxy, original_size
+
+
+class ImageSession:
+    """
+    Edit history of one image, held in memory.
+
+    Version 0 is the original image and every entry of the operation log
+    produces the next version. Each entry has an ID that is never reused, so a
+    version can be addressed (and its encoded file cached) by the ID of the
+    entry that produced it. The decoded image is kept for every
+    `config.IMAGE_KEYFRAME_INTERVAL`-th version; any other version is rebuilt
+    from the nearest keyframe before it. Undo and redo only move the current
+    position.
+
+    Large originals are edited through a proxy: a copy downscaled to at most
+    `config.IMAGE_PROXY_MAX_SIDE` pixels, which is what the versions show.
+    The log keeps parameters in full-resolution pixels and `apply_operations`
+    receives the proxy's `scale` to convert them; `export` replays the log on
+    the original. Replays hand whole runs of entries to `apply_operations`, so
+    that adjacent point operations are applied in one pass.
+    """
+
+    def __init__(self, task_dir: str, original_path: str, proxy: Image.Image, original_size: tuple[int, int], apply_operations, entries=None, position: int = 0, next_id: int = 1):
+        self.task_dir = task_dir
+        self.original_path = original_path
+        self.original_size = original_size
+        # Proxy pixels per full-resolution pixel.
+        self.scale = proxy.width / original_size[0]
+        self.apply_operations = apply_operations
+        self.entries: list[dict] = entries or []
+        self.position = position
+        self.next_id = next_id
+        self.keyframes: dict[int, Image.Image] = {0: proxy}
+        # The most recently built version, usually the current one.
+        self._latest: tuple[int, Image.Image] = (0, proxy)
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls, task_dir: str, original_path: str, apply_operations) -> "ImageSession":
+        """
+        Opens the session of a task, building its proxy and restoring its saved
+        operation log if it has one.
+        """
+        proxy, original_size = _open_proxy(original_path)
+        history_path = os.path.join(task_dir, HISTORY_FILE)
+        if not os.path.exists(history_path):
+            return cls(task_dir, original_path, proxy, original_size, apply_operations)
+        with open(history_path) as f:
+            history = json.load(f)
+        return cls(task_dir, original_path, proxy, original_size, apply_operations, history["entries"], history["position"], history["next_id"])
+
+    def save(self):
+        history_path = os.path.join(self.task_dir, HISTORY_FILE)
+        tmp_path = history_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries, "position": self.position, "next_id": self.next_id}, f)
+        os.replace(tmp_path, history_path)
+
+    @property
+    def size(self) -> int:
+        """Approximate memory held by the session's decoded images, in bytes."""
+        images = {id(img): img for img in self.keyframes.values()}
+        images[id(self._latest[1])] = self._latest[1]
+        return sum(_image_bytes(img) for img in images.values())
+
+    def version_id(self, position: int | None = None) -> int:
+        position = self.position if position is None else position
+        return self.entries[position - 1]["id"] if position else 0
+
+    def position_of(self, version_id: int) -> int | None:
+        """Returns the position of a version in the log, or None if it was discarded."""
+        if version_id == 0:
+            return 0
+        for position, entry in enumerate(self.entries, start=1):
+            if entry["id"] == version_id:
+                return position
+        return None
+
+    def image_at(self, position: int) -> Image.Image:
+        latest_position, img = self._latest
+        if latest_position == position:
+            return img
+        start = max(k for k in self.keyframes if k <= position)
+        if start < latest_position < position:
+            start = latest_position
+        else:
+            img = self.keyframes[start]
+        interval = config.IMAGE_KEYFRAME_INTERVAL
+        version = start
+        while version < position:
+            # Replay up to the next keyframe at most, which must be kept.
+            stop = min(position, (version // interval + 1) * interval)
+            img = self._replay(img, self.entries[version:stop], self.keyframes[0], self.scale)
+            version = stop
+            if version % interval == 0:
+                self.keyframes[version] = img
+        self._latest = (position, img)
+        return img
+
+    def _replay(self, img: Image.Image, entries: list[dict], original: Image.Image, scale: float) -> Image.Image:
+        """Applies log entries to `img`; a "reset" entry goes back to `original`."""
+        for i in range(len(entries) - 1, -1, -1):
+            if entries[i]["action"] == "reset":
+                img, entries = original, entries[i + 1:]
+                break
+        if not entries:
+            return img
+        return self.apply_operations(img, [(entry["action"], entry["params"]) for entry in entries], scale=scale)
+
+    def size_at(self, position: int | None = None) -> tuple[int, int]:
+        """Returns the full-resolution size of a version."""
+        position = self.position if position is None else position
+        return tuple(self.entries[position - 1]["size"]) if position else self.original_size
+
+    def export(self, position: int) -> Image.Image:
+        """Replays the log up to `position` on the full-resolution original."""
+        with Image.open(self.original_path) as img:
+            img.load()
+            original = img
+        return self._replay(original, self.entries[:position], original, 1.0)
+
+    def apply(self, action: str, params: dict) -> int:
+        """
+        Applies an edit to the current version. Like in any editor, this
+        discards the versions that could have been redone.
+
+        Returns:
+            The ID of the new version.
+        """
+        entry = {"id": self.next_id, "action": action, "params": params}
+        img = self._replay(self.image_at(self.position), [entry], self.keyframes[0], self.scale)
+        if self.scale == 1.0:
+            entry["size"] = img.size
+        else:
+            entry["size"] = (round(img.width / self.scale), round(img.height / self.scale))
+
+        del self.entries[self.position:]
+        for position in [k for k in self.keyframes if k > self.position]:
+            del self.keyframes[position]
+        self.entries.append(entry)
+        self.next_id += 1
+        self.position += 1
+        if self.position % config.IMAGE_KEYFRAME_INTERVAL == 0:
+            self.keyframes[self.position] = img
+        self._latest = (self.position, img)
+        self.save()
+        return entry["id"]
+
+    def undo(self) -> int:
+        """Moves back one version, if possible, and returns the current version's ID."""
+        if self.position > 0:
+            self.position -= 1
+            self.save()
+        return self.version_id()
+
+    def redo(self) -> int:
+        """Moves forward one version, if possible, and returns the current version's ID."""
+        if self.position < len(self.entries):
+            self.position += 1
+            self.save()
+        return self.version_id()
+
+
+class SessionCache:
+    """
+    LRU cache of image sessions by task ID, bounded by the memory their
+    decoded images take. The most recently used session is never evicted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sessions: collections.OrderedDict[str, ImageSession] = collections.OrderedDict()
+
+    def get(self, task_id: str, load) -> ImageSession:
+        """Returns the session of a task, calling `load()` to open it if it is not cached."""
+        with self._lock:
+            session = self._sessions.get(task_id)
+            if session is not None:
+                self._sessions.move_to_end(task_id)
+                return session
+        # Decode outside the lock; if another thread won the race, use its session.
+        session = load()
+        with self._lock:
+            session = self._sessions.setdefault(task_id, session)
+            self._sessions.move_to_end(task_id)
+        return session
+
+    def trim(self):
+        """Evicts least-recently-used sessions until the cache fits in `max_bytes`."""
+        with self._lock:
+            total = sum(session.size for session in self._sessions.values())
+            while total > self.max_bytes and len(self._sessions) > 1:
+                _, evicted = self._sessions.popitem(last=False)
+                total -= evicted.size
+
+    def discard(self, task_id: str):
+        with self._lock:
+            self._sessions.pop(task_id, None)
@@ -0,0 +1,292 @@
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from .. import database
+from ..core import config
+from . import task_service, service_ffmpeg, service_pdf, service_ytdl
+from .progress_bus import bus
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a tool's queue has reached its configured maximum length."""
+
+
+class TaskAlreadyQueuedError(Exception):
+    """Raised when submitting a job for a task that is already queued or running."""
+
+
+class TaskNotCancellableError(Exception):
+    """Raised when cancelling a job that has already started running."""
+
+
+def _init_process_worker(progress_queue, database_file):
+    # Worker processes have no SSE subscribers; hand their progress back to
+    # the parent process, which relays it onto its own bus.
+    bus.forward_to(progress_queue)
+    database.DATABASE_FILE = database_file
+
+
+class _Pool:
+    """
+    The queue and executor of a single tool. Jobs wait in `pending` (in
+    submission order) until one of `max_workers` slots frees up; only then are
+    they handed to the executor, so the executor never holds more than
+    `max_workers` jobs and queued jobs can be cancelled without racing it.
+    """
+
+    def __init__(self, tool_name, func, executor, max_workers, max_queued, resume_interrupted):
+        self.tool_name = tool_name
+        self.func = func
+        self.executor = executor
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.resume_interrupted = resume_interrupted
+        self.pending = collections.OrderedDict()  # task_id -> job_args
+        self.running = {}  # task_id -> Future
+
+
+class JobScheduler:
+    """
+    Bounded worker pools for long-running jobs, one pool per tool.
+
+    The queue is persisted in the `tasks` table: a submitted job is stored with
+    status 'queued' and its arguments, and queued jobs are resubmitted by
+    `start()` after a restart. Several server processes may share the store
+    and resume the same queue; a job only runs in the process that claims it,
+    which keeps it alive with a heartbeat. Tools that can resume their jobs
+    take over those whose process stopped its heartbeat, e.g. by crashing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: dict[str, _Pool] = {}
+        self._progress_queue = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopping = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        # Spawn rather than fork: the server process has an event loop and
+        # several threads running, which forked children would inherit.
+        mp_context = multiprocessing.get_context("spawn")
+        self._progress_queue = mp_context.Queue()
+        bus.relay_from(self._progress_queue)
+
+        self._add_pool(
+            'ffmpeg',
+            service_ffmpeg.run_ffmpeg_conversion,
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.FFMPEG_MAX_WORKERS,
+                mp_context=mp_context,
+                initializer=_init_process_worker,
+                initargs=(self._progress_queue, database.DATABASE_FILE),
+            ),
+            config.FFMPEG_MAX_WORKERS,
+            config.FFMPEG_MAX_QUEUED,
+        )
+        self._add_pool(
+            'ytdl',
+            service_ytdl.run_download_task,
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.YTDL_MAX_WORKERS,
+                thread_name_prefix="ytdl-worker",
+            ),
+            config.YTDL_MAX_WORKERS,
+            config.YTDL_MAX_QUEUED,
+            # Downloads keep their partial files in the task directory, so
+            # those cut off by a restart can be run again and resume.
+            resume_interrupted=True,
+        )
+        self._add_pool(
+            'pdf-compress',
+            service_pdf.run_compression,
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.PDF_COMPRESS_MAX_CONCURRENCY,
+                thread_name_prefix="pdf-compress-worker",
+            ),
+            config.PDF_COMPRESS_MAX_CONCURRENCY,
+            config.PDF_COMPRESS_MAX_QUEUED,
+            # The input stays in the task directory; an interrupted
+            # compression simply starts over.
+            resume_interrupted=True,
+        )
+
+        self._stopping.clear()
+        self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _add_pool(self, tool_name, func, executor, max_workers, max_queued, resume_interrupted=False):
+        pool = _Pool(tool_name, func, executor, max_workers, max_queued, resume_interrupted)
+        self._pools[tool_name] = pool
+        if resume_interrupted:
+            self._requeue_interrupted(pool, dispatch=False)
+        queued = task_service.get_queued_tasks(tool_name)
+        if queued:
+            logger.info(f"Resuming {len(queued)} queued {tool_name} job(s).")
+        with self._lock:
+            for task_id, job_args in queued:
+                pool.pending[task_id] = job_args
+        self._dispatch(pool)
+
+    def shutdown(self):
+        """
+        Stops the pools. Jobs still waiting keep their 'queued' status in the
+        database and are picked up again by the next `start()`.
+        """
+        self._stopping.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        for pool in self._pools.values():
+            with self._lock:
+                pool.pending.clear()
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
+
+    def submit(self, tool_name: str, task_id: str, **job_args):
+        """
+        Queues a job for `tool_name`. `job_args` are passed to the tool's job
+        function as keyword arguments and must be JSON-serializable.
+
+        Raises:
+            TaskAlreadyQueuedError: If the task already has a job queued or
+                running in this process.
+            QueueFullError: If the tool already has `max_queued` jobs waiting.
+        """
+        pool = self._pools[tool_name]
+        with self._lock:
+            # A second job would reset the task while the first still writes
+            # its result, and its arguments would be lost.
+            if self._has_job(pool, task_id):
+                raise TaskAlreadyQueuedError(f"Task {task_id} already has a {tool_name} job queued or running.")
+            if len(pool.pending) >= pool.max_queued:
+                raise QueueFullError(f"The {tool_name} queue is full, please try again later.")
+            # Reserve the slot before releasing the lock so concurrent
+            # submissions cannot overshoot `max_queued`.
+            pool.pending[task_id] = job_args
+        task_service.queue_task(task_id, job_args)
+        self._dispatch(pool)
+
+    @staticmethod
+    def _has_job(pool: _Pool, task_id: str) -> bool:
+        return task_id in pool.pending or task_id in pool.running
+
+    def has_job(self, tool_name: str, task_id: str) -> bool:
+        """Returns True if the task has a job queued or running in this process."""
+        with self._lock:
+            return self._has_job(self._pools[tool_name], task_id)
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a queued job.
+
+        Returns:
+            True if the job was queued and is now cancelled, False if the
+            scheduler does not know the task.
+
+        Raises:
+            TaskNotCancellableError: If the job is already running.
+        """
+        for pool in self._pools.values():
+            with self._lock:
+                if task_id in pool.running:
+                    raise TaskNotCancellableError("The job is already running.")
+                if task_id not in pool.pending:
+                    continue
+                del pool.pending[task_id]
+                waiting = list(pool.pending)
+            self._publish_queue_positions(waiting)
+            if not task_service.cancel_queued_task(task_id):
+                # Another server process has claimed it.
+                raise TaskNotCancellableError("The job is already running.")
+            return True
+        return False
+
+    def _dispatch(self, pool: _Pool):
+        while True:
+            started = []
+            with self._lock:
+                while pool.pending and len(pool.running) < pool.max_workers:
+                    task_id, job_args = pool.pending.popitem(last=False)
+                    pool.running[task_id] = None
+                    started.append((task_id, job_args))
+                waiting = list(pool.pending)
+
+            lost = False
+            for task_id, job_args in started:
+                if not task_service.claim_task(task_id, self.owner):
+                    # Run by another server process, or cancelled; its slot
+                    # goes to the next job.
+                    with self._lock:
+                        pool.running.pop(task_id, None)
+                    lost = True
+                    continue
+                try:
+                    future = pool.executor.submit(pool.func, task_id, **job_args)
+                except RuntimeError as e:
+                    # The executor has been shut down.
+                    with self._lock:
+                        pool.running.pop(task_id, None)
+                    task_service.fail_task(task_id, str(e))
+                    continue
+                with self._lock:
+                    pool.running[task_id] = future
+                future.add_done_callback(lambda f, task_id=task_id: self._on_done(pool, task_id, f))
+
+            if started:
+                self._publish_queue_positions(waiting)
+            if not lost:
+                return
+
+    def _on_done(self, pool: _Pool, task_id: str, future: concurrent.futures.Future):
+        with self._lock:
+            pool.running.pop(task_id, None)
+        if not future.cancelled() and future.exception() is not None:
+            # Job functions record their own failures; this only catches
+            # crashes outside of them, such as a worker process dying.
+            logger.error(f"{pool.tool_name} job {task_id} crashed: {future.exception()}")
+            task_service.fail_task(task_id, str(future.exception()))
+        self._dispatch(pool)
+
+    def _beat(self):
+        while not self._stopping.wait(config.JOB_HEARTBEAT_SECONDS):
+            for pool in list(self._pools.values()):
+                try:
+                    with self._lock:
+                        running = list(pool.running)
+                    if running:
+                        task_service.touch_tasks(running, self.owner)
+                    if pool.resume_interrupted:
+                        self._requeue_interrupted(pool, dispatch=True)
+                except Exception as e:
+                    logger.error(f"{pool.tool_name} job heartbeat failed: {e}")
+
+    def _requeue_interrupted(self, pool: _Pool, dispatch: bool):
+        stale_before = time.time() - config.JOB_HEARTBEAT_TIMEOUT
+        requeued = task_service.requeue_interrupted_tasks(pool.tool_name, stale_before)
+        if not requeued:
+            return
+        logger.info(f"Requeued {len(requeued)} interrupted {pool.tool_name} job(s).")
+        if dispatch:
+            with self._lock:
+                for task_id, job_args in requeued:
+                    pool.pending[task_id] = job_args
+            self._dispatch(pool)
+
+    def _publish_queue_positions(self, waiting: list[str]):
+        for position, task_id in enumerate(waiting, start=1):
+            bus.publish(task_id, queue_position=position)
+
+
+scheduler = JobScheduler()
@@ -0,0 +1,157 @@
+import contextlib
+import os
+import shutil
+import fitz  # PyMuPDF
+
+# Marker for a blank page in a page plan; every other entry is the index of a
+# page of the original document.
+_BLANK = None
+
+
+def _check_index(index: int, page_count: int, what: str = "Page"):
+    if not 0 <= index < page_count:
+        raise ValueError(f"{what} {index} is out of range for a document with {page_count} pages")
+
+
+def build_page_plan(page_count: int, operations: list[dict]) -> list[int | None]:
+    """
+    Folds a batch of page operations into the final page sequence without
+    touching the document. Every operation addresses pages by their position
+    after the operations before it.
+
+    Supported operations:
+        {"op": "delete", "pages": [...]}
+        {"op": "reorder", "page_order": [...]}
+        {"op": "move", "page": i, "to": j}
+        {"op": "add_blank", "at": i}  (`at` is optional and defaults to the end)
+
+    Returns:
+        A list with, for each page of the result, the index of the original
+        page it shows or None for a new blank page.
+
+    Raises:
+        ValueError: If an operation is unknown or refers to a missing page.
+    """
+    plan = list(range(page_count))
+    for operation in operations:
+        op = operation.get("op")
+        if op == "delete":
+            to_delete = set(operation["pages"])
+            for index in to_delete:
+                _check_index(index, len(plan))
+            plan = [entry for i, entry in enumerate(plan) if i not in to_delete]
+        elif op == "reorder":
+            for index in operation["page_order"]:
+                _check_index(index, len(plan))
+            plan = [plan[i] for i in operation["page_order"]]
+        elif op == "move":
+            _check_index(operation["page"], len(plan))
+            _check_index(operation["to"], len(plan), "Target position")
+            plan.insert(operation["to"], plan.pop(operation["page"]))
+        elif op == "add_blank":
+            at = operation.get("at")
+            if at is None:
+                at = len(plan)
+            elif not 0 <= at <= len(plan):
+                raise ValueError(f"Cannot insert a page at position {at} in a document with {len(plan)} pages")
+            plan.insert(at, _BLANK)
+        else:
+            raise ValueError(f"Unknown page operation '{op}'")
+    return plan
+
+
+def _single_move(sources: list[int]) -> tuple[int, int] | None:
+    """
+    Returns `(from, to)` if `sources` is the identity permutation with one page
+    moved, so that the page tree can be patched with a single `move_page`.
+    """
+    n = len(sources)
+    start = 0
+    while start < n and sources[start] == start:
+        start += 1
+    end = n - 1
+    while end > start and sources[end] == end:
+        end -= 1
+    if start >= end:
+        return None
+    window = sources[start:end + 1]
+    # Moved backwards: the last page of the window now comes first.
+    if window[0] == end and window[1:] == list(range(start, end)):
+        return end, start
+    # Moved forwards: the first page of the window now comes last.
+    if window[-1] == start and window[:-1] == list(range(start + 1, end + 1)):
+        return start, end
+    return None
+
+
+def _rearrange(doc, plan: list[int | None]):
+    page_count = len(doc)
+    sources = [entry for entry in plan if entry is not _BLANK]
+
+    # New pages get the size of the last page, like PyPDF2's add_blank_page.
+    blank_rect = doc[sources[-1] if sources else page_count - 1].rect
+
+    if not sources:
+        # Every original page is gone; `select` needs at least one page to keep.
+        for _ in plan:
+            doc.new_page(width=blank_rect.width, height=blank_rect.height)
+        doc.select(list(range(page_count, page_count + len(plan))))
+        return
+    if sources != list(range(page_count)):
+        move = _single_move(sources) if len(sources) == page_count else None
+        if move is not None:
+            from_page, to_page = move
+            # move_page inserts before `to`; -1 means after the last page.
+            doc.move_page(from_page, to_page if to_page < from_page else (to_page + 1 if to_page + 1 < page_count else -1))
+        else:
+            doc.select(sources)
+    for position, entry in enumerate(plan):
+        if entry is _BLANK:
+            doc.new_page(pno=position, width=blank_rect.width, height=blank_rect.height)
+
+
+def apply_page_operations(pdf_path: str, operations: list[dict]) -> int:
+    """
+    Applies a batch of page operations to a PDF, in one pass.
+
+    The operations are first folded into the final page sequence, which is
+    then applied with a single `select` (or `move_page` when one page moved)
+    followed by `new_page` for the blank pages; page objects are shared rather
+    than copied. The changes are appended to a copy of the file with an
+    incremental save, unless pages were dropped, in which case the file is
+    rewritten so that their content does not linger in it. Either way the
+    result replaces the file in one step, so readers see one version or the
+    other, never a half-written file.
+
+    Returns:
+        The number of pages of the result.
+
+    Raises:
+        ValueError: If an operation is unknown or refers to a missing page.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    plan = build_page_plan(page_count, operations)
+    if not plan:
+        raise ValueError("A PDF must keep at least one page")
+    drops_pages = len({entry for entry in plan if entry is not _BLANK}) < page_count
+
+    copy_path = pdf_path + ".tmp"
+    rewrite_path = pdf_path + ".new"
+    if not drops_pages:
+        shutil.copyfile(pdf_path, copy_path)
+    try:
+        with fitz.open(pdf_path if drops_pages else copy_path) as doc:
+            _rearrange(doc, plan)
+            if not drops_pages and doc.can_save_incrementally():
+                doc.save(copy_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                saved_path = copy_path
+            else:
+                doc.save(rewrite_path, garbage=1)
+                saved_path = rewrite_path
+        os.replace(saved_path, pdf_path)
+    finally:
+        for path in (copy_path, rewrite_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+    return len(plan)
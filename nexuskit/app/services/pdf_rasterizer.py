@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import math
+import multiprocessing
+import threading
+import fitz  # PyMuPDF
+from PIL import Image
+from ..core import config
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def page_content_hash(doc, page) -> str:
+    """
+    Hashes what a page renders from: its geometry, content streams, the raw
+    streams of the images and form XObjects it draws and the fonts it uses.
+    The hash survives reordering and deleting other pages.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.rect), page.rotation)).encode())
+    for xref in page.get_contents():
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    xobjects = {image[0] for image in page.get_images(full=True)} | {xobject[0] for xobject in page.get_xobjects()}
+    for xref in sorted(xobjects):
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    for font in page.get_fonts(full=True):
+        digest.update(font[3].encode())
+    for annot in page.annots() or []:
+        digest.update(doc.xref_object(annot.xref, compressed=True).encode())
+    return digest.hexdigest()
+
+
+def encode_pixmap(pix, image_format: str, quality: int) -> bytes:
+    """
+    Encodes a rendered page as PNG, JPEG or WebP. `quality` (1-100) applies to
+    the lossy formats only.
+    """
+    if image_format == "png":
+        return pix.tobytes("png")
+    if image_format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if image_format == "webp":
+        mode = "RGBA" if pix.alpha else "RGB"
+        # Wrap the pixmap's samples instead of decoding an intermediate PNG.
+        img = Image.frombuffer(mode, (pix.width, pix.height), pix.samples, "raw", mode, pix.stride, 1)
+        output = io.BytesIO()
+        img.save(output, "WEBP", quality=quality)
+        return output.getvalue()
+    raise ValueError(f"Unsupported image format '{image_format}'")
+
+
+def render_page(page, dpi: int, image_format: str, quality: int) -> bytes:
+    return encode_pixmap(page.get_pixmap(dpi=dpi), image_format, quality)
+
+
+def _render_chunk(pdf_path: str, page_indexes: list[int], dpi: int, image_format: str, quality: int) -> list[tuple[int, bytes]]:
+    # Runs in a worker process, which opens its own copy of the document.
+    with fitz.open(pdf_path) as doc:
+        return [(index, render_page(doc[index], dpi, image_format, quality)) for index in page_indexes]
+
+
+def get_executor() -> concurrent.futures.ProcessPoolExecutor:
+    """Returns the shared pool of PDF worker processes, starting it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.PDF_RASTER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def shutdown(wait: bool = False):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
+
+
+def _chunk(page_indexes: list[int], workers: int) -> list[list[int]]:
+    # Small enough that every worker gets several chunks and results come
+    # back steadily, large enough to amortize opening the document.
+    size = max(1, min(config.PDF_RASTER_CHUNK_PAGES, math.ceil(len(page_indexes) / workers)))
+    return [page_indexes[i:i + size] for i in range(0, len(page_indexes), size)]
+
+
+async def render_pages(pdf_path: str, page_indexes: list[int], dpi: int, image_format: str = "png", quality: int = config.PDF_PREVIEW_QUALITY, executor=None, workers: int | None = None):
+    """
+    Renders pages of a PDF in parallel across a process pool, yielding
+    `(page_index, image_bytes)` as soon as each range of pages is done, in
+    completion order rather than page order.
+
+    Args:
+        pdf_path: The document to render.
+        page_indexes: The pages to render.
+        dpi: The render resolution.
+        image_format: "png", "jpeg" or "webp".
+        quality: Quality of the lossy formats, 1-100.
+        executor: The process pool to use; defaults to the shared rasterizer pool.
+        workers: The number of workers in `executor`, used to size the page ranges.
+    """
+    if image_format not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported image format '{image_format}'")
+    if not page_indexes:
+        return
+    executor = executor or get_executor()
+    workers = workers or config.PDF_RASTER_WORKERS
+    loop = asyncio.get_running_loop()
+    futures = [
+        loop.run_in_executor(executor, _render_chunk, pdf_path, chunk, dpi, image_format, quality)
+        for chunk in _chunk(page_indexes, workers)
+    ]
+    try:
+        for next_done in asyncio.as_completed(futures):
+            for page_index, image in await next_done:
+                yield page_index, image
+    finally:
+        for future in futures:
+            future.cancel()
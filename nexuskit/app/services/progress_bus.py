@@ -0,0 +1,217 @@
+import asyncio
+import inspect
+import json
+import threading
+from ..core import config
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class _Channel:
+    """
+    Per-task fan-out point. Holds the latest known task state and the set of
+    subscribers waiting on it. Updates published from worker threads are merged
+    into `state` and delivered to the event loop at most once per loop iteration,
+    so a burst of progress updates wakes each subscriber only once.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.state = {}
+        self.version = 0
+        self.subscribers = set()
+        self.flush_scheduled = False
+
+
+class Subscription:
+    """
+    A single consumer of a task's updates. Use `wait()` to block until the
+    task state has changed since the last call.
+    """
+
+    def __init__(self, bus: "ProgressBus", task_id: str, channel: _Channel):
+        self._bus = bus
+        self._channel = channel
+        self._event = asyncio.Event()
+        self._seen_version = -1
+        self.task_id = task_id
+
+    def seed(self, snapshot: dict | None):
+        """
+        Fills in the channel state from a database snapshot. Fields already
+        published since the subscription was opened take precedence, as they
+        are at least as recent as the snapshot.
+        """
+        if snapshot:
+            with self._bus._lock:
+                self._channel.state = {**snapshot, **self._channel.state}
+                self._channel.version += 1
+        self._event.set()
+
+    def refresh(self, snapshot: dict | None):
+        """
+        Merges a database snapshot taken after the latest update into the
+        channel state; unlike with `seed`, its fields take precedence.
+        Subscribers are only woken if something changed.
+        """
+        if not snapshot:
+            return
+        with self._bus._lock:
+            # The snapshot only has a queue position while the task is queued.
+            state = {**self._channel.state, 'queue_position': None, **snapshot}
+            if state == self._channel.state:
+                return
+            self._channel.state = state
+            self._channel.version += 1
+            subscribers = list(self._channel.subscribers)
+        for subscription in subscribers:
+            subscription._event.set()
+
+    async def wait(self) -> dict:
+        """
+        Waits until the task state changes and returns a copy of it.
+        """
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            with self._bus._lock:
+                if self._channel.version != self._seen_version and self._channel.state:
+                    self._seen_version = self._channel.version
+                    return dict(self._channel.state)
+
+    def close(self):
+        self._bus._unsubscribe(self.task_id, self)
+
+
+class ProgressBus:
+    """
+    In-process publish/subscribe bus for task progress.
+
+    Publishers (task_service, possibly running in worker threads) push partial
+    task updates; SSE endpoints subscribe per task and are woken up with the
+    merged task state. Publishing to a task nobody is watching is a no-op.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: dict[str, _Channel] = {}
+        self._forward_queue = None
+
+    def forward_to(self, queue):
+        """
+        Sends every publish to `queue` instead of delivering it locally. Used in
+        worker processes, which have no subscribers of their own; the parent
+        process relays the queue back onto its bus with `relay_from`.
+        """
+        self._forward_queue = queue
+
+    def relay_from(self, queue) -> threading.Thread:
+        """
+        Starts a daemon thread that publishes every (task_id, fields) item read
+        from `queue`. A `None` item stops the thread.
+        """
+        def relay():
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                task_id, fields = item
+                self.publish(task_id, **fields)
+
+        thread = threading.Thread(target=relay, name="progress-bus-relay", daemon=True)
+        thread.start()
+        return thread
+
+    def subscribe(self, task_id: str) -> Subscription:
+        """
+        Opens a subscription for a task. Must be called from the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            channel = self._channels.get(task_id)
+            if channel is None:
+                channel = _Channel(loop)
+                self._channels[task_id] = channel
+            subscription = Subscription(self, task_id, channel)
+            channel.subscribers.add(subscription)
+        return subscription
+
+    def publish(self, task_id: str, **fields):
+        """
+        Merges `fields` into the task's state and notifies its subscribers.
+        Safe to call from any thread.
+        """
+        if self._forward_queue is not None:
+            self._forward_queue.put((task_id, fields))
+            return
+        with self._lock:
+            channel = self._channels.get(task_id)
+            if channel is None:
+                return
+            channel.state.update(fields)
+            channel.version += 1
+            if channel.flush_scheduled:
+                return
+            channel.flush_scheduled = True
+        try:
+            channel.loop.call_soon_threadsafe(self._flush, channel)
+        except RuntimeError:
+            # The loop has been closed; there is nobody left to notify.
+            pass
+
+    def _flush(self, channel: _Channel):
+        with self._lock:
+            channel.flush_scheduled = False
+            subscribers = list(channel.subscribers)
+        for subscription in subscribers:
+            subscription._event.set()
+
+    def _unsubscribe(self, task_id: str, subscription: Subscription):
+        with self._lock:
+            channel = self._channels.get(task_id)
+            if channel is None:
+                return
+            channel.subscribers.discard(subscription)
+            if not channel.subscribers:
+                del self._channels[task_id]
+
+
+bus = ProgressBus()
+
+
+async def task_event_stream(task_id: str, load_snapshot):
+    """
+    Async generator of SSE events for a task. The database is read through
+    `load_snapshot` (a function or coroutine function) to seed the initial
+    state; following events come from the bus, and from the database again
+    whenever the bus has been quiet for `config.TASK_STORE_POLL_MS`, as jobs
+    run by other server processes do not publish here. Events are emitted
+    when the progress, status or queue position changes and the stream ends
+    once the task reaches a terminal status.
+    """
+    poll = config.TASK_STORE_POLL_MS / 1000
+    subscription = bus.subscribe(task_id)
+    try:
+        subscription.seed(await _load(load_snapshot, task_id))
+        last_seen = None
+        while True:
+            try:
+                task = await asyncio.wait_for(subscription.wait(), poll)
+            except asyncio.TimeoutError:
+                subscription.refresh(await _load(load_snapshot, task_id))
+                continue
+            seen = (task.get('progress'), task.get('status'), task.get('queue_position'))
+            if seen != last_seen:
+                yield {"data": json.dumps(task, default=str)}
+                last_seen = seen
+            if task.get('status') in TERMINAL_STATUSES:
+                break
+    finally:
+        subscription.close()
+
+
+async def _load(load_snapshot, task_id: str) -> dict | None:
+    snapshot = load_snapshot(task_id)
+    if inspect.isawaitable(snapshot):
+        snapshot = await snapshot
+    return snapshot
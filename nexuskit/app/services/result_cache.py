@@ -0,0 +1,192 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from .. import database
+from ..core import config
+
+logger = logging.getLogger(__name__)
+
+# ioctl request number for FICLONE (copy-on-write clone) on Linux.
+_FICLONE = 0x40049409
+
+
+def link_or_copy(source_path: str, destination_path: str):
+    """
+    Makes `destination_path` a hard link to `source_path`, falling back to a
+    reflink (on filesystems that support it) and finally to a plain copy when
+    the two paths are on different filesystems.
+    """
+    if os.path.exists(destination_path):
+        os.remove(destination_path)
+    try:
+        os.link(source_path, destination_path)
+        return
+    except OSError:
+        pass
+    try:
+        with open(source_path, "rb") as src, open(destination_path, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        return
+    except OSError:
+        pass
+    shutil.copyfile(source_path, destination_path)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of finished outputs.
+
+    Entries are keyed on the hash of the input plus the parameters that
+    produced the output. Files live under `config.RESULT_CACHE_DIR/<namespace>`
+    and are linked into task directories rather than copied; the index, LRU
+    order and hit/miss counters are kept in SQLite so that every worker
+    process shares them. The namespace is evicted least-recently-used first
+    once it grows past `max_bytes`.
+    """
+
+    def __init__(self, namespace: str, max_bytes: int):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.directory = os.path.join(config.RESULT_CACHE_DIR, namespace)
+
+    def make_key(self, input_sha256: str, params: dict) -> str:
+        """
+        Builds the cache key for an input hash and its (already normalized)
+        parameters.
+        """
+        payload = json.dumps({"input": input_sha256, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def fetch(self, key: str, destination_path: str, record_miss: bool = True) -> bool:
+        """
+        Links the cached output for `key` to `destination_path`.
+
+        Returns:
+            True on a cache hit, False otherwise.
+        """
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT path FROM result_cache WHERE cache_key = ?", (key,))
+            row = cursor.fetchone()
+
+        if row and os.path.exists(row["path"]):
+            try:
+                link_or_copy(row["path"], destination_path)
+            except OSError as e:
+                logger.warning(f"Could not link cached result {row['path']}: {e}")
+            else:
+                with database.get_db() as conn:
+                    conn.execute("UPDATE result_cache SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+                    self._count(conn, "hits")
+                    conn.commit()
+                return True
+
+        with database.get_db() as conn:
+            if row:
+                # The file was removed behind our back; forget about it.
+                conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+            if record_miss:
+                self._count(conn, "misses")
+            conn.commit()
+        return False
+
+    def store(self, key: str, source_path: str):
+        """
+        Adds `source_path` to the cache under `key`, then evicts old entries if
+        the namespace is over its size limit.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        cached_path = os.path.join(self.directory, key + os.path.splitext(source_path)[1])
+        # Link under a temporary name first so readers never see a partial file.
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        try:
+            link_or_copy(source_path, tmp_path)
+            os.replace(tmp_path, cached_path)
+        except OSError as e:
+            logger.warning(f"Could not add {source_path} to the {self.namespace} cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with database.get_db() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (cache_key, namespace, path, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, self.namespace, cached_path, os.path.getsize(cached_path), time.time())
+            )
+            conn.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least-recently-used entries until the namespace fits in
+        `max_bytes`, and drops index rows whose files no longer exist.
+        """
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT cache_key, path, size FROM result_cache WHERE namespace = ? ORDER BY last_used",
+                (self.namespace,)
+            )
+            rows = cursor.fetchall()
+
+            total = sum(row["size"] for row in rows)
+            evicted = []
+            for row in rows:
+                if not os.path.exists(row["path"]):
+                    total -= row["size"]
+                    evicted.append(row["cache_key"])
+                    continue
+                if total <= self.max_bytes:
+                    continue
+                try:
+                    os.remove(row["path"])
+                except OSError as e:
+                    logger.error(f"Error evicting cached result {row['path']}: {e}")
+                    continue
+                total -= row["size"]
+                evicted.append(row["cache_key"])
+
+            if evicted:
+                cursor.executemany("DELETE FROM result_cache WHERE cache_key = ?", [(key,) for key in evicted])
+                conn.commit()
+                logger.info(f"Evicted {len(evicted)} entries from the {self.namespace} cache.")
+
+    def stats(self) -> dict:
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT hits, misses FROM cache_stats WHERE namespace = ?", (self.namespace,))
+            counters = cursor.fetchone()
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache WHERE namespace = ?",
+                (self.namespace,)
+            )
+            entries, size = cursor.fetchone()
+        return {
+            "namespace": self.namespace,
+            "hits": counters["hits"] if counters else 0,
+            "misses": counters["misses"] if counters else 0,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _count(self, conn, column: str):
+        conn.execute("INSERT OR IGNORE INTO cache_stats (namespace) VALUES (?)", (self.namespace,))
+        conn.execute(f"UPDATE cache_stats SET {column} = {column} + 1 WHERE namespace = ?", (self.namespace,))
+
+
+ffmpeg_cache = ResultCache("ffmpeg", config.FFMPEG_CACHE_MAX_BYTES)
+pdf_compress_cache = ResultCache("pdf-compress", config.PDF_COMPRESS_CACHE_MAX_BYTES)
+
+CACHES = [ffmpeg_cache, pdf_compress_cache]
+
+
+def evict_all():
+    """Enforces the size limit of every result cache."""
+    for cache in CACHES:
+        cache.evict()
@@ -0,0 +1,477 @@
+import asyncio
+import email.utils
+import logging
+import os
+import re
+import secrets
+import time
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from ..core import config
+from . import cleanup_service, task_service
+from .progress_bus import bus
+
+logger = logging.getLogger(__name__)
+
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$", re.ASCII)
+
+
+class ResultStreamAborted(Exception):
+    """Raised to cut off the download of a result whose job did not complete it."""
+
+
+class DownloadAccounting:
+    """
+    Bytes and time spent serving results, per tool, since the server started.
+    Every download is also logged with its own figures. The counts are kept
+    per server process and only touched from its event loop.
+    """
+
+    def __init__(self):
+        self._tools: dict[str, dict] = {}
+
+    def record(self, task: dict, status: int, mode: str, sent: int, seconds: float, interrupted: bool = False):
+        totals = self._tools.setdefault(task['tool_name'], {
+            "downloads": 0,
+            "partial": 0,
+            "not_modified": 0,
+            "interrupted": 0,
+            "bytes_sent": 0,
+            "seconds": 0.0,
+        })
+        totals["downloads"] += 1
+        if status == 206:
+            totals["partial"] += 1
+        elif status == 304:
+            totals["not_modified"] += 1
+        if interrupted:
+            totals["interrupted"] += 1
+        totals["bytes_sent"] += sent
+        totals["seconds"] += seconds
+        rate = sent / seconds / 1024 ** 2 if seconds > 0 else 0.0
+        logger.info(
+            f"Served {sent} bytes of task {task['task_id']} ({status}, {mode}"
+            f"{', interrupted' if interrupted else ''}) in {seconds:.3f} s, {rate:.1f} MB/s"
+        )
+
+    def stats(self) -> dict:
+        return {
+            tool_name: {
+                **totals,
+                "mb_per_second": totals["bytes_sent"] / totals["seconds"] / 1024 ** 2 if totals["seconds"] else 0.0,
+            }
+            for tool_name, totals in self._tools.items()
+        }
+
+
+accounting = DownloadAccounting()
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """
+    A strong validator for a result file. Results are never rewritten in
+    place, so the inode, size and modification time identify the content.
+    """
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def parse_ranges(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parses a Range header into the [start, end) byte ranges it asks for,
+    sorted, with overlapping and adjacent ranges merged.
+
+    Returns:
+        The ranges; an empty list if none of them can be satisfied; or None if
+        the header is to be ignored and the whole file sent: it is malformed,
+        not in bytes, asks for more than `config.DOWNLOAD_MAX_RANGES` ranges
+        or the file is empty.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or size == 0:
+        return None
+    specs = [spec for spec in specs.split(",") if spec.strip()]
+    if not specs or len(specs) > config.DOWNLOAD_MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        match = _RANGE_SPEC.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            # A suffix: the last `last` bytes.
+            if int(last) > 0:
+                ranges.append((max(0, size - int(last)), size))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(last) + 1, size) if last else size))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _etag_listed(header: str, etag: str, weak: bool) -> bool:
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak:
+            candidate = candidate.removeprefix("W/")
+        if candidate == etag:
+            return True
+    return False
+
+def _parse_http_date(value: str) -> float | None:
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def _not_modified(headers, etag: str, mtime: int) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_listed(if_none_match, etag, weak=True)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and mtime <= since
+    return False
+
+def _range_applies(headers, etag: str, mtime: int) -> bool:
+    if_range = headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+        # If-Range only takes strong validators.
+        return if_range == etag
+    return _parse_http_date(if_range) == mtime
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+async def serve_result(request: Request, task: dict, media_type: str) -> Response:
+    """
+    Answers a download request for a task's result file.
+
+    Conditional requests are honoured: If-None-Match and If-Modified-Since are
+    answered with 304, and If-Range decides whether a Range header applies.
+    Single ranges are sent as 206 with Content-Range, several as
+    multipart/byteranges, and unsatisfiable ones get 416. See
+    `ResultFileResponse` for how the bytes are transmitted; each download is
+    recorded in `accounting`.
+
+    Args:
+        request: The download request.
+        task: The completed task.
+        media_type: The media type of the result.
+
+    Returns:
+        The response to send.
+    """
+    path = task['result_path']
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        return JSONResponse({"error": "Result file no longer exists"}, status_code=404)
+
+    size = stat_result.st_size
+    mtime = int(stat_result.st_mtime)
+    etag = make_etag(stat_result)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": email.utils.formatdate(mtime, usegmt=True),
+    }
+
+    if _not_modified(request.headers, etag, mtime):
+        accounting.record(task, 304, "none", 0, 0.0)
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = _content_disposition(os.path.basename(path))
+    ranges = None
+    http_range = request.headers.get("range")
+    if http_range is not None and _range_applies(request.headers, etag, mtime):
+        ranges = parse_ranges(http_range, size)
+    if ranges == []:
+        accounting.record(task, 416, "none", 0, 0.0)
+        return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+
+    if config.DOWNLOAD_ACCEL_REDIRECT_PREFIX:
+        uri = _accel_redirect_uri(path)
+        if uri is not None:
+            # The proxy serves the file, ranges and all, with sendfile; only
+            # the bytes it was asked for can be counted here.
+            planned = sum(end - start for start, end in ranges or [(0, size)])
+            accounting.record(task, 206 if ranges else 200, "offload", planned, 0.0)
+            return Response(headers={**headers, "x-accel-redirect": uri}, media_type=media_type)
+
+    if not ranges:
+        status_code, segments = 200, [(0, size)]
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        status_code, segments = 206, [(start, end)]
+        headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+    else:
+        boundary = secrets.token_hex(13)
+        status_code, segments = 206, []
+        for start, end in ranges:
+            segments.append((
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+            ).encode("latin-1"))
+            segments.append((start, end))
+            segments.append(b"\r\n")
+        segments.append(f"--{boundary}--\r\n".encode("latin-1"))
+        media_type = f"multipart/byteranges; boundary={boundary}"
+
+    return ResultFileResponse(task, path, status_code, segments, headers, media_type)
+
+async def follow_result(request: Request, task: dict, media_type: str) -> Response:
+    """
+    Answers a download request for a result that a running job is still
+    writing, see `task_service.stream_task_result`. The file is sent from the
+    start as it grows until the task completes; ranges and validators do not
+    apply to it before that, when `serve_result` takes over.
+
+    Args:
+        request: The download request.
+        task: The processing task.
+        media_type: The media type of the result.
+
+    Returns:
+        The response to send.
+    """
+    path = task['result_path']
+    if not await asyncio.to_thread(os.path.exists, path):
+        return JSONResponse({"error": "Result file no longer exists"}, status_code=404)
+    headers = {
+        "accept-ranges": "none",
+        "cache-control": "no-store",
+        "content-disposition": _content_disposition(os.path.basename(path)),
+    }
+    return GrowingFileResponse(task, path, headers, media_type)
+
+def _accel_redirect_uri(path: str) -> str | None:
+    relative = os.path.relpath(path, cleanup_service.TEMP_DIR)
+    if relative.startswith(os.pardir):
+        return None
+    return config.DOWNLOAD_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative)
+
+
+class ResultFileResponse(Response):
+    """
+    Sends a result file, or parts of it, as a sequence of segments: byte
+    strings, such as multipart headers, and (start, end) spans of the file.
+
+    Spans are sent without copying them through Python where the server
+    allows it: with the `http.response.zerocopysend` ASGI extension, which has
+    the server `os.sendfile` them to the socket, or, for a whole file, with
+    `http.response.pathsend`. Otherwise they are read with `os.pread` in
+    `config.DOWNLOAD_CHUNK_BYTES` chunks off the event loop, the next chunk
+    being read while the previous one is sent. In production the file is best
+    handed to the reverse proxy instead, see
+    `config.DOWNLOAD_ACCEL_REDIRECT_PREFIX`.
+    """
+
+    def __init__(self, task: dict, path: str, status_code: int, segments: list, headers: dict, media_type: str):
+        self.task = task
+        self.path = path
+        self.status_code = status_code
+        self.segments = segments
+        self.media_type = media_type
+        self.background = None
+        self.content_length = sum(
+            len(segment) if isinstance(segment, bytes) else segment[1] - segment[0] for segment in segments
+        )
+        self.init_headers({**headers, "content-length": str(self.content_length)})
+        self.sent = 0
+        self.finished = False
+
+    def _mode(self, scope) -> str:
+        extensions = scope.get("extensions") or {}
+        if scope["method"] == "HEAD":
+            return "head"
+        if "http.response.zerocopysend" in extensions:
+            return "zerocopysend"
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            return "pathsend"
+        return "read"
+
+    async def __call__(self, scope, receive, send):
+        mode = self._mode(scope)
+        started = time.perf_counter()
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if mode == "head":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                self.finished = True
+                return
+            spec_version = tuple(map(int, scope.get("asgi", {}).get("spec_version", "2.0").split(".")))
+            if spec_version >= (2, 4):
+                # Sends raise OSError once the client is gone.
+                await self._send_body(send, mode)
+            else:
+                await self._send_body_until_disconnect(receive, send, mode)
+        except OSError:
+            pass
+        finally:
+            seconds = time.perf_counter() - started
+            accounting.record(self.task, self.status_code, mode, self.sent, seconds, interrupted=not self.finished)
+
+    async def _send_body_until_disconnect(self, receive, send, mode: str):
+        # Older servers drop what is sent after a disconnect without telling,
+        # so the disconnect is watched for to stop reading the file.
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        body = asyncio.ensure_future(self._send_body(send, mode))
+        listener = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait((body, listener), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for future in (body, listener):
+                future.cancel()
+            await asyncio.gather(body, listener, return_exceptions=True)
+        if body.done() and not body.cancelled() and body.exception() is not None:
+            raise body.exception()
+
+    async def _send_body(self, send, mode: str):
+        if mode == "pathsend":
+            await send({"type": "http.response.pathsend", "path": self.path})
+            self.sent = self.content_length
+            self.finished = True
+            return
+
+        file = await asyncio.to_thread(open, self.path, "rb", buffering=0)
+        try:
+            last = len(self.segments) - 1
+            for index, segment in enumerate(self.segments):
+                more_body = index < last
+                if isinstance(segment, bytes):
+                    await send({"type": "http.response.body", "body": segment, "more_body": more_body})
+                    self.sent += len(segment)
+                else:
+                    await self._send_span(send, mode, file, *segment, more_body)
+            self.finished = True
+        finally:
+            await asyncio.to_thread(file.close)
+
+    async def _send_span(self, send, mode: str, file, start: int, end: int, more_body: bool):
+        if mode == "zerocopysend":
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": start,
+                "count": end - start,
+                "more_body": more_body,
+            })
+            self.sent += end - start
+            return
+
+        fd = file.fileno()
+        chunk_size = config.DOWNLOAD_CHUNK_BYTES
+        position = start
+        pending = asyncio.ensure_future(asyncio.to_thread(os.pread, fd, min(chunk_size, end - position), position))
+        try:
+            while position < end:
+                chunk = await pending
+                if not chunk:
+                    raise RuntimeError(f"{self.path} is shorter than expected.")
+                position += len(chunk)
+                if position < end:
+                    pending = asyncio.ensure_future(
+                        asyncio.to_thread(os.pread, fd, min(chunk_size, end - position), position)
+                    )
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body or position < end})
+                self.sent += len(chunk)
+        finally:
+            # A read in flight cannot be interrupted; let it finish before the
+            # file is closed.
+            await asyncio.gather(pending, return_exceptions=True)
+
+
+class GrowingFileResponse(ResultFileResponse):
+    """
+    Sends a result file that a job is still appending to, from the start, as
+    it grows, without a Content-Length. At the end of what has been written,
+    it waits for the task's next update on the progress bus, or
+    `config.DOWNLOAD_FOLLOW_POLL_MS` at most, and looks again, reloading the
+    task every `config.TASK_STORE_POLL_MS` in case another server process
+    runs it; once the task is completed, the rest of the file is sent and the response ends. If the
+    task fails, or neither the file nor the task changes for
+    `config.DOWNLOAD_FOLLOW_IDLE_TIMEOUT` seconds, the transfer is cut off
+    with `ResultStreamAborted`, so the client cannot take the part it
+    received for the whole file.
+    """
+
+    def __init__(self, task: dict, path: str, headers: dict, media_type: str):
+        self.task = task
+        self.path = path
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+        self.sent = 0
+        self.finished = False
+
+    def _mode(self, scope) -> str:
+        mode = super()._mode(scope)
+        return "read" if mode == "pathsend" else mode
+
+    async def _send_body(self, send, mode: str):
+        task_id = self.task['task_id']
+        poll = config.DOWNLOAD_FOLLOW_POLL_MS / 1000
+        subscription = bus.subscribe(task_id)
+        file = await asyncio.to_thread(open, self.path, "rb", buffering=0)
+        try:
+            # The task may have changed since the route looked it up, before
+            # there was a subscription to hear of it.
+            subscription.seed(await task_service.get_task_status_async(task_id))
+            status = 'processing'
+            position = 0
+            last_change = last_reload = time.monotonic()
+            while True:
+                size = os.fstat(file.fileno()).st_size
+                if size > position:
+                    await self._send_span(send, mode, file, position, size, True)
+                    position = size
+                    last_change = time.monotonic()
+                    continue
+                if status == 'completed':
+                    break
+                if status in ('failed', 'cancelled'):
+                    raise ResultStreamAborted(f"Task {task_id} {status} while its result was being sent")
+                if time.monotonic() - last_change > config.DOWNLOAD_FOLLOW_IDLE_TIMEOUT:
+                    raise ResultStreamAborted(f"Task {task_id} stopped writing its result")
+                try:
+                    state = await asyncio.wait_for(subscription.wait(), poll)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - last_reload < config.TASK_STORE_POLL_MS / 1000:
+                        continue
+                    last_reload = time.monotonic()
+                    state = await task_service.get_task_status_async(task_id) or {}
+                    if state.get('status', status) == status:
+                        continue
+                status = state.get('status', status)
+                last_change = time.monotonic()
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            self.finished = True
+        finally:
+            subscription.close()
+            await asyncio.to_thread(file.close)
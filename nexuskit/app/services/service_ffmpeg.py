@@ -1,57 +1,541 @@
+import asyncio
+import collections
+import csv
+import json
 import os
+import re
+import shutil
+import tempfile
 import ffmpeg
-from . import cleanup_service, task_service
+from .. import database
+from ..core import config
+from . import cleanup_service, task_service, upload_ingest
+from .result_cache import ffmpeg_cache
 
-def handle_ffmpeg_upload(file):
-    task_id = task_service.create_task(tool_name='ffmpeg')
+async def handle_ffmpeg_upload(file):
+    task_id = await task_service.create_task_async(tool_name='ffmpeg')
     task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
     os.makedirs(task_dir, exist_ok=True)
 
-    original_file_path = os.path.join(task_dir, file.filename)
-    with open(original_file_path, "wb") as buffer:
-        buffer.write(file.file.read())
+    try:
+        upload = await upload_ingest.ingest_upload(file, task_dir, config.FFMPEG_MAX_UPLOAD_BYTES)
+    except upload_ingest.UploadTooLargeError as e:
+        await task_service.fail_task_async(task_id, str(e))
+        cleanup_service.cleanup_task_directory(task_id)
+        raise
+    await task_service.set_task_input_async(task_id, upload['path'], upload['sha256'], upload['size'])
+    original_file_path = upload['path']
+
+    # Probe once now; the result is cached by content hash for the conversion
+    # and the probe endpoint.
+    probe = await asyncio.to_thread(load_media_probe, original_file_path, upload['sha256'])
 
-    task_service.update_task_progress(task_id, 0) # Mark as uploaded
-    cleanup_service.schedule_cleanup(task_id)
+    await task_service.update_task_progress_async(task_id, 0) # Mark as uploaded
+    await cleanup_service.schedule_cleanup_async(task_id)
 
-    return {"task_id": task_id, "filename": file.filename, "original_file_path": original_file_path}
+    return {
+        "task_id": task_id,
+        "filename": upload['filename'],
+        "original_file_path": original_file_path,
+        "duration": _probe_duration(probe),
+    }
 
-def run_ffmpeg_conversion(task_id: str, original_file_path: str, output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None):
+def _output_path(original_file_path: str, output_format: str) -> str:
     task_dir = os.path.dirname(original_file_path)
-    output_filename = f"{os.path.splitext(os.path.basename(original_file_path))[0]}.{output_format}"
-    output_file_path = os.path.join(task_dir, output_filename)
+    stem = os.path.splitext(os.path.basename(original_file_path))[0]
+    output_file_path = os.path.join(task_dir, f"{stem}.{output_format}")
+    if output_file_path == original_file_path:
+        # Never write over the input, e.g. when re-encoding mp4 to mp4.
+        output_file_path = os.path.join(task_dir, f"{stem}_converted.{output_format}")
+    return output_file_path
+
+def normalize_conversion_params(output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None, preset: str | None = None) -> dict:
+    """
+    Returns the conversion parameters in one canonical form, so that
+    equivalent requests (e.g. "MP4" and "mp4", "720" and " 720 ") are both
+    converted and cached alike. Resolution, quality, bitrate and preset are
+    ignored by the audio-only path and cleared for it.
+    """
+    extract_audio = bool(extract_audio)
+    return {
+        "output_format": output_format.strip().lower(),
+        "extract_audio": extract_audio,
+        "resolution": None if extract_audio or not resolution else str(resolution).strip().lower(),
+        "quality": None if extract_audio or not quality else quality.strip().capitalize(),
+        "bitrate": None if extract_audio or not bitrate else bitrate.strip().lower(),
+        "preset": None if extract_audio or not preset else preset,
+    }
+
+def _cache_key(task_id: str, output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None, preset: str | None = None, streaming: bool = False) -> str | None:
+    """
+    Returns the result cache key for a conversion, or None if the task has no
+    recorded input hash. The parameters must come from
+    `normalize_conversion_params`. The thread count only changes how fast the
+    output is produced, so it is not part of the key. Streamed outputs are
+    muxed differently, e.g. as fragmented MP4, so they are kept apart from
+    the others.
+    """
+    task = task_service.get_task_status(task_id)
+    if not task or not task.get('input_sha256'):
+        return None
+    params = {
+        "output_format": output_format,
+        "extract_audio": extract_audio,
+        "resolution": resolution,
+        "quality": quality,
+        "bitrate": bitrate,
+        "preset": preset,
+    }
+    if _streaming_muxer(output_format, streaming) is not None:
+        # Only added when set, so that the keys of existing entries still match.
+        params["streaming"] = True
+    return ffmpeg_cache.make_key(task['input_sha256'], params)
+
+def complete_from_cache(task_id: str, original_file_path: str, output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None, preset: str | None = None, streaming: bool = False, record_miss: bool = True) -> bool:
+    """
+    Completes the task from the result cache if the same input was already
+    converted with the same parameters, as normalized by
+    `normalize_conversion_params`.
+
+    Returns:
+        True if the task was completed from the cache.
+    """
+    key = _cache_key(task_id, output_format, extract_audio, resolution, quality, bitrate, preset, streaming)
+    if key is None:
+        return False
+    output_file_path = _output_path(original_file_path, output_format)
+    if not ffmpeg_cache.fetch(key, output_file_path, record_miss=record_miss):
+        return False
+    task_service.complete_task(task_id, output_file_path)
+    return True
+
+def probe_media(path: str) -> dict | None:
+    """
+    Runs ffprobe on a media file and returns its parsed output, or None if
+    the file cannot be probed.
+    """
+    try:
+        return ffmpeg.probe(path)
+    except (ffmpeg.Error, OSError, ValueError):
+        return None
+
+def load_media_probe(path: str, input_sha256: str | None) -> dict | None:
+    """
+    Returns the ffprobe output for a file, probing it only if no probe is
+    cached for its content hash yet.
+    """
+    if input_sha256:
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT probe FROM media_probes WHERE input_sha256 = ?", (input_sha256,))
+            row = cursor.fetchone()
+        if row:
+            return json.loads(row['probe'])
+
+    probe = probe_media(path)
+    if probe is not None and input_sha256:
+        with database.get_db() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_probes (input_sha256, probe) VALUES (?, ?)",
+                (input_sha256, json.dumps(probe))
+            )
+            conn.commit()
+    return probe
+
+def get_task_probe(task_id: str) -> dict | None:
+    """
+    Returns the cached probe of a task's uploaded input, or None if the task
+    does not exist or its input could not be probed.
+    """
+    task = task_service.get_task_status(task_id)
+    if not task or not task.get('input_path'):
+        return None
+    return load_media_probe(task['input_path'], task.get('input_sha256'))
+
+def _probe_duration(probe: dict | None) -> float | None:
+    try:
+        return float(probe['format']['duration'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def _has_audio(probe: dict | None) -> bool:
+    return bool(probe) and any(stream.get('codec_type') == 'audio' for stream in probe.get('streams', []))
+
+def _parse_out_time(value: str) -> float | None:
+    # `out_time` is reported as HH:MM:SS.microseconds, or N/A before the first frame.
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+# What `-progress` writes: key=value lines such as "out_time=00:01:02.500000".
+_PROGRESS_LINE = re.compile(r"^[a-z0-9_]+=\S*$")
+
+async def run_ffmpeg_with_progress(args: list[str], on_out_time, output=None):
+    """
+    Runs an ffmpeg command line asynchronously. ffmpeg must have been given
+    `-progress pipe:1`; every reported `out_time` is passed to `on_out_time`
+    in seconds. stderr is kept in a bounded ring buffer of its last lines,
+    which becomes the error message if ffmpeg fails.
+
+    With `output`, a binary file open for writing, ffmpeg must write its
+    output to `pipe:1` and its progress to `pipe:2` instead; the output is
+    appended to `output` chunk by chunk as ffmpeg produces it, and the
+    progress lines are picked out of stderr.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stderr_tail = collections.deque(maxlen=config.FFMPEG_STDERR_TAIL_LINES)
+
+    def read_progress_line(line: str) -> bool:
+        if not _PROGRESS_LINE.match(line):
+            return False
+        key, _, value = line.partition('=')
+        if key == 'out_time':
+            out_time = _parse_out_time(value)
+            if out_time is not None:
+                on_out_time(out_time)
+        return True
+
+    async def read_progress():
+        async for line in process.stdout:
+            read_progress_line(line.decode('utf8', errors='replace').strip())
+
+    async def read_output():
+        while chunk := await process.stdout.read(config.FFMPEG_STREAM_CHUNK_BYTES):
+            output.write(chunk)
+            # Downloads follow the file; hand each chunk over right away.
+            output.flush()
+
+    async def read_stderr():
+        async for line in process.stderr:
+            line = line.decode('utf8', errors='replace').rstrip()
+            if output is None or not read_progress_line(line):
+                stderr_tail.append(line)
+
+    try:
+        await asyncio.gather(read_progress() if output is None else read_output(), read_stderr())
+        returncode = await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if returncode != 0:
+        raise RuntimeError("\n".join(stderr_tail) or f"ffmpeg exited with code {returncode}")
+
+def _encoder_kwargs(quality: str | None, bitrate: str | None, threads: int | None, preset: str | None) -> dict:
+    kwargs = {}
+    if quality:
+        if quality == "High":
+            kwargs['crf'] = 18
+        elif quality == "Medium":
+            kwargs['crf'] = 23
+        elif quality == "Low":
+            kwargs['crf'] = 28
+    if bitrate:
+        kwargs['audio_bitrate'] = bitrate
+    if preset:
+        kwargs['preset'] = preset
+    kwargs['threads'] = threads
+    return kwargs
+
+def _progress_reporter(task_id: str, duration: float | None):
+    """
+    Returns an `on_out_time` callback that turns ffmpeg's position into a task
+    percentage. Updates are only written when the whole percentage moves, and
+    stop at 99 so that 100 always means the output is complete.
+    """
+    last_progress = 0
+
+    def report(out_time: float):
+        nonlocal last_progress
+        if not duration:
+            return
+        progress = min(99, int(out_time * 100 / duration))
+        if progress > last_progress:
+            last_progress = progress
+            task_service.update_task_progress(task_id, progress)
+
+    return report
+
+def _finish_conversion(task_id: str, output_file_path: str, output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None, preset: str | None, streaming: bool = False):
+    key = _cache_key(task_id, output_format, extract_audio, resolution, quality, bitrate, preset, streaming)
+    if key is not None:
+        ffmpeg_cache.store(key, output_file_path)
+    task_service.complete_task(task_id, output_file_path)
+
+# Codecs each output container accepts as-is, for (video, audio) streams.
+# None means any codec.
+_COPY_COMPATIBLE_CODECS = {
+    'mp4': ({'h264', 'hevc', 'mpeg4', 'av1'}, {'aac', 'mp3', 'ac3', 'eac3', 'alac'}),
+    'm4v': ({'h264', 'hevc', 'mpeg4'}, {'aac', 'mp3', 'ac3', 'eac3', 'alac'}),
+    'mov': ({'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'}, {'aac', 'mp3', 'ac3', 'alac', 'pcm_s16le'}),
+    'mkv': (None, None),
+    'webm': ({'vp8', 'vp9', 'av1'}, {'opus', 'vorbis'}),
+    'ts': ({'h264', 'hevc', 'mpeg2video'}, {'aac', 'mp3', 'ac3'}),
+}
+
+# Audio codec expected for each audio-only output format.
+_AUDIO_FORMAT_CODECS = {
+    'mp3': 'mp3',
+    'aac': 'aac',
+    'm4a': 'aac',
+    'opus': 'opus',
+    'ogg': 'vorbis',
+    'flac': 'flac',
+    'wav': 'pcm_s16le',
+}
+
+def _can_stream_copy(probe: dict | None, output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None) -> bool:
+    """
+    Decides whether a conversion is a pure remux: the requested container can
+    hold the input's codecs unchanged and nothing asks for a re-encode (a
+    different resolution, a quality level or an audio bitrate).
+    """
+    if not probe or quality or bitrate:
+        return False
+    output_format = output_format.strip().lower()
+    streams = probe.get('streams', [])
+    video_codecs = {s.get('codec_name') for s in streams if s.get('codec_type') == 'video'}
+    audio_codecs = {s.get('codec_name') for s in streams if s.get('codec_type') == 'audio'}
+
+    if extract_audio:
+        return len(audio_codecs) == 1 and _AUDIO_FORMAT_CODECS.get(output_format) in audio_codecs
+
+    if output_format not in _COPY_COMPATIBLE_CODECS or not video_codecs:
+        return False
+    if resolution:
+        heights = {s.get('height') for s in streams if s.get('codec_type') == 'video'}
+        if not str(resolution).strip().isdigit() or heights != {int(resolution)}:
+            return False
+    allowed_video, allowed_audio = _COPY_COMPATIBLE_CODECS[output_format]
+    if allowed_video is not None and not video_codecs <= allowed_video:
+        return False
+    if allowed_audio is not None and not audio_codecs <= allowed_audio:
+        return False
+    return True
+
+# Muxer options for the output formats that can be written to a pipe, front
+# to back, and played while they are still being written. MP4 and MOV are
+# fragmented, with an empty moov up front, as their index would otherwise be
+# written last.
+_FRAGMENTED_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+_STREAMING_MUXERS = {
+    'mp4': {'format': 'mp4', 'movflags': _FRAGMENTED_MOVFLAGS},
+    'mov': {'format': 'mov', 'movflags': _FRAGMENTED_MOVFLAGS},
+    'm4a': {'format': 'ipod', 'movflags': _FRAGMENTED_MOVFLAGS},
+    'webm': {'format': 'webm'},
+    'mkv': {'format': 'matroska'},
+    'ts': {'format': 'mpegts'},
+    'mp3': {'format': 'mp3'},
+    'aac': {'format': 'adts'},
+    'ogg': {'format': 'ogg'},
+    'opus': {'format': 'opus'},
+    'flac': {'format': 'flac'},
+}
+
+def _streaming_muxer(output_format: str, streaming: bool) -> dict | None:
+    """Returns the muxer options to stream a conversion with, or None if it is not streamed."""
+    if not streaming:
+        return None
+    return _STREAMING_MUXERS.get(output_format.strip().lower())
+
+def _should_segment(segmented: bool | None, extract_audio: bool, duration: float | None) -> bool:
+    if extract_audio or not duration:
+        return False
+    if segmented is not None:
+        return segmented
+    return duration >= config.FFMPEG_SEGMENTED_MIN_DURATION
+
+async def _run_concurrently(coroutines):
+    # Like gather(), but a failure cancels the siblings, which kills their ffmpeg processes.
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def _transcode_segmented(task_id: str, original_file_path: str, output_file_path: str, duration: float, has_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None, threads: int, preset: str | None):
+    """
+    Transcodes a long input as several ffmpeg processes running side by side.
+
+    The video stream is cut at keyframes into segments by stream copy, the
+    segments are encoded concurrently (at most FFMPEG_SEGMENT_WORKERS at a
+    time, sharing the job's thread budget) while the audio is encoded in one
+    piece, and everything is joined with the concat demuxer without another
+    re-encode. Encoding audio separately avoids the gaps that concatenating
+    independently encoded audio chunks would introduce.
+    """
+    base_args = ('-hide_banner', '-nostats')
+    progress_args = base_args + ('-progress', 'pipe:1')
+    extension = os.path.splitext(output_file_path)[1]
+    workers = config.FFMPEG_SEGMENT_WORKERS
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(output_file_path))
+    try:
+        # 1. Split the video at keyframes. Matroska takes any codec as-is.
+        segment_list_path = os.path.join(work_dir, "segments.csv")
+        split = ffmpeg.input(original_file_path).video.output(
+            os.path.join(work_dir, "source_%04d.mkv"),
+            c='copy',
+            f='segment',
+            segment_time=max(config.FFMPEG_MIN_SEGMENT_SECONDS, duration / workers),
+            reset_timestamps=1,
+            segment_list=segment_list_path,
+            segment_list_type='csv',
+        )
+        await run_ffmpeg_with_progress(split.global_args(*base_args).compile(overwrite_output=True), lambda out_time: None)
+        with open(segment_list_path, newline='') as f:
+            segments = [os.path.join(work_dir, row[0]) for row in csv.reader(f) if row]
+
+        # 2. Encode the segments in parallel, aggregating their positions
+        # into the task's progress.
+        report = _progress_reporter(task_id, duration)
+        encoded_time = [0.0] * len(segments)
+        semaphore = asyncio.Semaphore(workers)
+        # Share the job's thread budget between concurrent segments; 0 leaves it to ffmpeg.
+        segment_threads = max(1, threads // min(workers, len(segments))) if threads else 0
+        video_kwargs = _encoder_kwargs(quality, None, segment_threads, preset)
+
+        async def encode_segment(index: int, segment_path: str) -> str:
+            encoded_path = os.path.join(work_dir, f"encoded_{index:04d}{extension}")
+            video = ffmpeg.input(segment_path).video
+            if resolution:
+                video = video.filter('scale', -1, resolution)
+            args = video.output(encoded_path, **video_kwargs).global_args(*progress_args).compile(overwrite_output=True)
+
+            def on_out_time(out_time: float):
+                encoded_time[index] = out_time
+                report(sum(encoded_time))
+
+            async with semaphore:
+                await run_ffmpeg_with_progress(args, on_out_time)
+            return encoded_path
+
+        async def encode_audio() -> str:
+            audio_path = os.path.join(work_dir, f"audio{extension}")
+            kwargs = {'audio_bitrate': bitrate} if bitrate else {}
+            args = ffmpeg.input(original_file_path).audio.output(audio_path, **kwargs).global_args(*base_args).compile(overwrite_output=True)
+            await run_ffmpeg_with_progress(args, lambda out_time: None)
+            return audio_path
+
+        jobs = [encode_segment(index, path) for index, path in enumerate(segments)]
+        if has_audio:
+            jobs.append(encode_audio())
+        results = await _run_concurrently(jobs)
+        encoded_segments = results[:len(segments)]
+
+        # 3. Join the encoded segments and mux in the audio.
+        concat_list_path = os.path.join(work_dir, "concat.txt")
+        with open(concat_list_path, "w") as f:
+            for path in encoded_segments:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        streams = [ffmpeg.input(concat_list_path, f='concat', safe=0).video]
+        if has_audio:
+            streams.append(ffmpeg.input(results[-1]).audio)
+        join = ffmpeg.output(*streams, output_file_path, c='copy')
+        await run_ffmpeg_with_progress(join.global_args(*base_args).compile(overwrite_output=True), lambda out_time: None)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _run_conversion(task_id: str, args: list[str], duration: float | None, output_file_path: str, streaming: bool):
+    report = _progress_reporter(task_id, duration)
+    if not streaming:
+        asyncio.run(run_ffmpeg_with_progress(args, report))
+        return
+    try:
+        with open(output_file_path, 'wb') as output:
+            # From here on, downloads of the task follow the file as it grows.
+            task_service.stream_task_result(task_id, output_file_path)
+            asyncio.run(run_ffmpeg_with_progress(args, report, output=output))
+    except BaseException:
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        raise
+
+def run_ffmpeg_conversion(task_id: str, original_file_path: str, output_format: str, extract_audio: bool, resolution: str | None, quality: str | None, bitrate: str | None, threads: int | None = None, preset: str | None = None, segmented: bool | None = None, streaming: bool = False):
+    """
+    Converts a task's uploaded media with ffmpeg. The parameters are
+    normalized first, as jobs queued before they were normalized on
+    submission may still carry raw values.
+
+    With `streaming`, outputs in `_STREAMING_MUXERS` are written by ffmpeg to
+    a pipe and from there to the output file, which /download sends while it
+    grows; that rules out segmented transcoding. Other formats are converted
+    as usual.
+    """
+    params = normalize_conversion_params(output_format, extract_audio, resolution, quality, bitrate, preset)
+    output_format, extract_audio = params["output_format"], params["extract_audio"]
+    resolution, quality, bitrate, preset = params["resolution"], params["quality"], params["bitrate"], params["preset"]
+    output_file_path = _output_path(original_file_path, output_format)
+    if threads is None:
+        threads = config.FFMPEG_DEFAULT_THREADS
+    muxer = _streaming_muxer(output_format, streaming)
+    streaming = muxer is not None
+    # A streamed output goes to stdout, so the progress goes to stderr.
+    target = 'pipe:1' if streaming else output_file_path
+    global_args = ('-hide_banner', '-nostats', '-progress', 'pipe:2' if streaming else 'pipe:1')
+    muxer = muxer or {}
 
     try:
-        task_service.update_task_progress(task_id, 10) # Mark as starting
+        # An identical conversion may have finished while this one was queued.
+        # The miss was already counted when the job was submitted.
+        if complete_from_cache(task_id, original_file_path, output_format, extract_audio, resolution, quality, bitrate, preset, streaming, record_miss=False):
+            return
+
+        # A previous output may be hard-linked into the result cache; unlink it
+        # instead of letting ffmpeg truncate the shared file in place.
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+
+        probe = get_task_probe(task_id) or probe_media(original_file_path)
+        duration = _probe_duration(probe)
+
+        if _can_stream_copy(probe, output_format, extract_audio, resolution, quality, bitrate):
+            # Remuxing copies packets without decoding, orders of magnitude
+            # faster than a re-encode.
+            input_stream = ffmpeg.input(original_file_path)
+            if extract_audio:
+                output_stream = input_stream.audio.output(target, acodec='copy', **muxer)
+            else:
+                streams = [input_stream.video] + ([input_stream.audio] if _has_audio(probe) else [])
+                output_stream = ffmpeg.output(*streams, target, c='copy', **muxer)
+            args = output_stream.global_args(*global_args).compile(overwrite_output=True)
+            _run_conversion(task_id, args, duration, output_file_path, streaming)
+            _finish_conversion(task_id, output_file_path, output_format, extract_audio, resolution, quality, bitrate, preset, streaming)
+            return
+
+        if not streaming and _should_segment(segmented, extract_audio, duration):
+            asyncio.run(_transcode_segmented(task_id, original_file_path, output_file_path, duration, _has_audio(probe), resolution, quality, bitrate, threads, preset))
+            _finish_conversion(task_id, output_file_path, output_format, extract_audio, resolution, quality, bitrate, preset)
+            return
+
         input_stream = ffmpeg.input(original_file_path)
         output_stream = None
 
         if extract_audio:
-            output_stream = input_stream.audio.output(output_file_path, acodec=output_format)
+            output_stream = input_stream.audio.output(target, acodec=output_format, threads=threads, **muxer)
         else:
             video = input_stream.video
             audio = input_stream.audio
             if resolution:
                 video = video.filter('scale', -1, resolution)
-            
-            kwargs = {}
-            if quality:
-                if quality == "High":
-                    kwargs['crf'] = 18
-                elif quality == "Medium":
-                    kwargs['crf'] = 23
-                elif quality == "Low":
-                    kwargs['crf'] = 28
-            if bitrate:
-                kwargs['audio_bitrate'] = bitrate
-
-            output_stream = ffmpeg.output(video, audio, output_file_path, **kwargs)
-
-        task_service.update_task_progress(task_id, 50) # Mark as processing
-        output_stream.run(overwrite_output=True)
-        task_service.complete_task(task_id, output_file_path)
-
-    except ffmpeg.Error as e:
-        task_service.fail_task(task_id, e.stderr.decode('utf8'))
+
+            kwargs = _encoder_kwargs(quality, bitrate, threads, preset)
+            output_stream = ffmpeg.output(video, audio, target, **kwargs, **muxer)
+
+        args = output_stream.global_args(*global_args).compile(overwrite_output=True)
+        _run_conversion(task_id, args, duration, output_file_path, streaming)
+        _finish_conversion(task_id, output_file_path, output_format, extract_audio, resolution, quality, bitrate, preset, streaming)
+
     except Exception as e:
         task_service.fail_task(task_id, str(e))
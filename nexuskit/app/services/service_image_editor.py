@@ -1,105 +1,261 @@
+import asyncio
+import logging
 import os
-from PIL import Image, ImageFilter, ImageOps, ImageEnhance
+import re
+import threading
+import time
+from PIL import Image, UnidentifiedImageError, features
 import base64
 import io
-import glob
-from . import cleanup_service, task_service
+from ..core import config
+from . import cleanup_service, task_service, upload_ingest, image_session, image_ops
 
-def handle_image_upload(file):
-    task_id = task_service.create_task(tool_name='image-editor')
+_sessions = image_session.SessionCache(config.IMAGE_SESSION_CACHE_MAX_BYTES)
+_VERSION_NAME_RE = re.compile(r"^version_(\d+)\.png$")
+logger = logging.getLogger(__name__)
+
+# Formats versions can be viewed in, in order of preference, as
+# (Pillow format, media type, file extension).
+VIEW_FORMATS = {
+    "avif": ("AVIF", "image/avif", ".avif"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "png": ("PNG", "image/png", ".png"),
+}
+_VIEW_SAVE_ARGS = {
+    # AVIF's default speed takes seconds per megapixel; 8 is interactive.
+    "avif": {"quality": config.IMAGE_VIEW_QUALITY, "speed": 8},
+    "webp": {"quality": config.IMAGE_VIEW_QUALITY},
+    "jpeg": {"quality": config.IMAGE_VIEW_QUALITY},
+    "png": {},
+}
+
+async def handle_image_upload(file):
+    task_id = await task_service.create_task_async(tool_name='image-editor')
     task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
     os.makedirs(task_dir, exist_ok=True)
 
-    original_image_path = os.path.join(task_dir, file.filename)
-    with open(original_image_path, "wb") as buffer:
-        buffer.write(file.file.read())
+    # Stored under a fixed name so it cannot clash with the encoded versions.
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    try:
+        upload = await upload_ingest.ingest_upload(file, task_dir, config.IMAGE_MAX_UPLOAD_BYTES, filename=f"original{extension}")
+        # Build the editing proxy right away, which also checks the image.
+        session = await asyncio.to_thread(_open_session, task_id, upload['path'])
+    except (upload_ingest.UploadTooLargeError, ValueError) as e:
+        await task_service.fail_task_async(task_id, str(e))
+        cleanup_service.cleanup_task_directory(task_id)
+        raise
+    await task_service.set_task_input_async(task_id, upload['path'], upload['sha256'], upload['size'])
 
-    img = Image.open(original_image_path)
-    # Save initial state as version 0
-    version_path = os.path.join(task_dir, f"version_0.png")
-    img.save(version_path)
+    # Versions are only encoded when they are viewed, starting with this one.
+    await task_service.complete_task_async(task_id, upload['path'])
+    await cleanup_service.schedule_cleanup_async(task_id)
 
-    task_service.update_task(task_id, status='completed', result_path=version_path)
-    cleanup_service.schedule_cleanup(task_id)
+    return {
+        "filename": os.path.basename(file.filename or upload['filename']),
+        **_session_response(task_id, session),
+    }
 
+def _open_session(task_id: str, original_path: str) -> image_session.ImageSession:
+    def load():
+        try:
+            return image_session.ImageSession.load(os.path.dirname(original_path), original_path, image_ops.apply_operations)
+        except (UnidentifiedImageError, OSError):
+            raise ValueError("The file is not a supported image")
+    session = _sessions.get(task_id, load)
+    _sessions.trim()
+    return session
+
+def _get_session(task_id: str) -> image_session.ImageSession:
+    task = task_service.get_task_status(task_id)
+    if not task or not task['input_path']:
+        raise ValueError("Task not found")
+    return _open_session(task_id, task['input_path'])
+
+def _session_response(task_id: str, session: image_session.ImageSession) -> dict:
+    """Describes the current version of a session. Sizes are in full-resolution pixels."""
+    version_id = session.version_id()
+    width, height = session.size_at()
     return {
         "task_id": task_id,
-        "filename": file.filename,
-        "image_url": f"/api/v1/image/view/{task_id}/version_0.png"
+        "image_url": f"/api/v1/image/view/{task_id}/version_{version_id}.png",
+        "export_url": f"/api/v1/image/export/{task_id}/version_{version_id}.png",
+        "width": width,
+        "height": height,
     }
 
 def apply_image_edit(task_id: str, action: str, params: dict):
-    task = task_service.get_task_status(task_id)
-    if not task:
-        raise ValueError("Task not found")
+    """
+    Applies an edit to the current version of the image. Coordinates and sizes
+    in `params` are in full-resolution pixels; the edit itself runs on the
+    editing proxy.
 
-    task_dir = os.path.dirname(task['result_path'])
-    # Find the latest version
-    versions = sorted(glob.glob(os.path.join(task_dir, "version_*.png")))
-    latest_version_path = versions[-1]
-    img = Image.open(latest_version_path)
+    Raises:
+        image_ops.InvalidOperationError: If the action is unknown or its
+            parameters are invalid.
+    """
+    if action != "reset":
+        image_ops.validate(action)
+    session = _get_session(task_id)
+    with session.lock:
+        session.apply(action, params)
+        response = _session_response(task_id, session)
+    _sessions.trim()
+    return response
 
-    # Apply the edit
-    img = _apply_action(img, action, params)
+def undo_last_edit(task_id: str):
+    session = _get_session(task_id)
+    with session.lock:
+        session.undo()
+        return _session_response(task_id, session)
 
-    # Save the new version
-    new_version_num = len(versions)
-    new_version_path = os.path.join(task_dir, f"version_{new_version_num}.png")
-    img.save(new_version_path)
+def redo_last_edit(task_id: str):
+    session = _get_session(task_id)
+    with session.lock:
+        session.redo()
+        return _session_response(task_id, session)
 
-    task_service.update_task_result_path(task_id, new_version_path)
+def _tmp_path(path: str) -> str:
+    # Unique, as two requests (possibly in different server processes) may
+    # encode the same file at once.
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
 
-    return {
-        "task_id": task_id,
-        "image_url": f"/api/v1/image/view/{task_id}/{os.path.basename(new_version_path)}"
-    }
+def _encoded_version_path(task_id: str, filename: str, prefix: str, render) -> str | None:
+    # Versions never change once created, so their encoded files are reused
+    # for as long as the task lives.
+    match = _VERSION_NAME_RE.match(filename)
+    if not match:
+        return None
+    try:
+        session = _get_session(task_id)
+    except ValueError:
+        return None
+    path = os.path.join(session.task_dir, prefix + filename)
+    if os.path.exists(path):
+        return path
 
-def undo_last_edit(task_id: str):
-    task = task_service.get_task_status(task_id)
-    if not task:
-        raise ValueError("Task not found")
+    with session.lock:
+        position = session.position_of(int(match.group(1)))
+        if position is None:
+            return None
+        img = render(session, position)
+    tmp_path = _tmp_path(path)
+    img.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+    return path
 
-    task_dir = os.path.dirname(task['result_path'])
-    versions = sorted(glob.glob(os.path.join(task_dir, "version_*.png")))
-    
-    if len(versions) > 1:
-        # Remove the latest version to undo
-        os.remove(versions[-1])
-        new_latest_version_path = versions[-2]
-        task_service.update_task_result_path(task_id, new_latest_version_path)
-        return {
-            "task_id": task_id,
-            "image_url": f"/api/v1/image/view/{task_id}/{os.path.basename(new_latest_version_path)}"
-        }
-    else:
-        # Already at the original image
-        return {
-            "task_id": task_id,
-            "image_url": f"/api/v1/image/view/{task_id}/{os.path.basename(versions[0])}"
-        }
+def _parse_accept(accept: str | None) -> dict[str, float]:
+    """Maps the media ranges of an Accept header to their q-values."""
+    ranges = {}
+    for part in (accept or "").split(","):
+        media_range, *params = [item.strip() for item in part.split(";")]
+        if not media_range:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        ranges[media_range.lower()] = q
+    return ranges
 
-def redo_last_edit(task_id: str):
-    # Redo is more complex and would require storing undone versions.
-    # This is a placeholder for a more complete implementation.
-    pass
+def accepted_view_formats(accept: str | None) -> list[str]:
+    """
+    Returns the view formats a client accepts, best first. AVIF and WebP must
+    be listed explicitly, as `image/*` says nothing about which decoders a
+    browser has; JPEG is also accepted through `image/*`. PNG is always
+    acceptable, and the only format for clients that send no Accept header.
+    """
+    ranges = _parse_accept(accept)
+    preference = list(VIEW_FORMATS)
+    scored = []
+    for image_format, (_, media_type, _) in VIEW_FORMATS.items():
+        if image_format == "avif" and not features.check("avif"):
+            continue
+        q = ranges.get(media_type)
+        if q is None and image_format == "jpeg":
+            q = ranges.get("image/*")
+        if q is None and image_format == "png":
+            q = 0.001
+        if q:
+            scored.append((-q, preference.index(image_format), image_format))
+    return [image_format for _, _, image_format in sorted(scored)] or ["png"]
 
-def get_image_path(task_id: str, filename: str):
-    task = task_service.get_task_status(task_id)
-    if task:
-        requested_path = os.path.join(os.path.dirname(task['result_path']), filename)
-        if os.path.exists(requested_path):
-            return requested_path
+def _view_width(width: int | None, version_width: int) -> int | None:
+    # Snapped to a fixed set of widths, so that arbitrary values cannot fill
+    # the disk with variants; None means the version's own size.
+    if width is None:
+        return None
+    for tier in config.IMAGE_VIEW_WIDTHS:
+        if tier >= width:
+            return tier if tier < version_width else None
     return None
 
-def _apply_action(img: Image.Image, action: str, params: dict) -> Image.Image:
-    if action == "crop":
-        img = img.crop((params['left'], params['top'], params['right'], params['bottom']))
-    elif action == "resize":
-        img = img.resize((params['width'], params['height']))
-    elif action == "grayscale":
-        img = ImageOps.grayscale(img)
-    # ... (add all other image editing actions here in the same pattern)
-    elif action == "reset":
-        # This would now be handled by undoing all actions
-        pass
-    return img
\ No newline at end of file
+def _encode_view(img: Image.Image, path: str, image_format: str, width: int | None):
+    if width is not None:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if image_format == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+    started = time.perf_counter()
+    tmp_path = _tmp_path(path)
+    img.save(tmp_path, format=VIEW_FORMATS[image_format][0], **_VIEW_SAVE_ARGS[image_format])
+    os.replace(tmp_path, path)
+    logger.info(f"Encoded {os.path.basename(path)} ({img.width}x{img.height}) in "
+                f"{(time.perf_counter() - started) * 1000:.0f} ms, {os.path.getsize(path)} bytes")
+
+def get_view_variant(task_id: str, filename: str, accept: str | None = None, width: int | None = None) -> dict | None:
+    """
+    Returns a version of the image as shown in the editor (the proxy), in the
+    best format the client accepts and optionally scaled down to `width`.
+    Encoded variants are kept on disk per version, width and format; versions
+    never change, so they are valid for as long as the task lives.
+
+    Returns:
+        A dictionary with the variant's `path`, `media_type` and `etag`, or
+        None if the version does not exist.
+    """
+    match = _VERSION_NAME_RE.match(filename)
+    if not match:
+        return None
+    try:
+        session = _get_session(task_id)
+    except ValueError:
+        return None
+    version_id = int(match.group(1))
+    formats = accepted_view_formats(accept)
+
+    with session.lock:
+        position = session.position_of(version_id)
+        if position is None:
+            return None
+        full_width = session.size_at(position)[0]
+        view_width = _view_width(width, max(1, round(full_width * session.scale)))
+        stem = os.path.join(session.task_dir, f"view_{version_id}_{view_width or 'full'}")
+        image_format = formats[0]
+        img = None
+        if not os.path.exists(stem + VIEW_FORMATS[image_format][2]):
+            img = session.image_at(position)
+    # Encode outside the lock, so that edits do not wait for it.
+    if img is not None:
+        if image_format == "jpeg" and img.has_transparency_data:
+            image_format = next((f for f in formats if f != "jpeg"), "png")
+        if not os.path.exists(stem + VIEW_FORMATS[image_format][2]):
+            _encode_view(img, stem + VIEW_FORMATS[image_format][2], image_format, view_width)
+    _sessions.trim()
+    return {
+        "path": stem + VIEW_FORMATS[image_format][2],
+        "media_type": VIEW_FORMATS[image_format][1],
+        "etag": f'"{version_id}-{view_width or "full"}-{image_format}"',
+    }
+
+def get_export_path(task_id: str, filename: str):
+    """
+    Returns the path of a version of the image at full resolution, replaying
+    its edits on the original first if it has not been exported before.
+    """
+    return _encoded_version_path(task_id, filename, "export_", lambda session, position: session.export(position))
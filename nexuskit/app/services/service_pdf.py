@@ -1,89 +1,89 @@
+import asyncio
+import collections
+import contextlib
+import logging
 import os
+import re
+import shutil
+import tempfile
+import threading
 import fitz  # PyMuPDF
-from PyPDF2 import PdfReader, PdfWriter
 import base64
 import io
 from PIL import Image
-import subprocess
-import tempfile
-from . import cleanup_service, task_service
-
-def handle_pdf_upload(file):
-    task_id = task_service.create_task(tool_name='pdf-editor')
+from ..core import config
+from . import cleanup_service, task_service, upload_ingest, pdf_rasterizer, pdf_page_ops, result_cache
+from .preview_cache import BytesLRUCache
+
+# Rendered page previews, shared by all tasks and keyed by page content hash,
+# size tier, image format and quality.
+_preview_cache = BytesLRUCache(config.PDF_PREVIEW_CACHE_MAX_BYTES)
+_PAGE_NAME_RE = re.compile(r"^page_(\d+)\.png$")
+
+logger = logging.getLogger(__name__)
+
+_COMPRESSION_SETTINGS = {
+    "Low": "/screen",
+    "Medium": "/ebook",
+    "High": "/printer"
+}
+# Ghostscript prints "Page <n>" as it starts on each page.
+_GS_PAGE_RE = re.compile(rb"^Page (\d+)")
+# Edits rewrite a task's document in place, so they run one at a time per
+# task, and readers take a copy under the same lock rather than parse a
+# half-written file. Maps task IDs to [lock, number of holders and waiters].
+_document_locks: dict[str, list] = {}
+_document_locks_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _document_lock(task_id: str):
+    """Serializes access to one task's document; the lock is dropped once unused."""
+    with _document_locks_lock:
+        entry = _document_locks.setdefault(task_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _document_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _document_locks[task_id]
+
+async def handle_pdf_upload(file):
+    task_id = await task_service.create_task_async(tool_name='pdf-editor')
     task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
     os.makedirs(task_dir, exist_ok=True)
 
-    original_pdf_path = os.path.join(task_dir, file.filename)
-    with open(original_pdf_path, "wb") as buffer:
-        buffer.write(file.file.read())
-
-    task_service.update_task_progress(task_id, 50) # Mark as processing
-
-    # Generate previews
-    preview_paths = []
-    doc = fitz.open(original_pdf_path)
-    for i, page in enumerate(doc):
-        pix = page.get_pixmap()
-        preview_path = os.path.join(task_dir, f"page_{i}.png")
-        pix.save(preview_path)
-        preview_paths.append(f"/api/v1/pdf/preview/{task_id}/page_{i}.png")
-
-    task_service.complete_task(task_id, original_pdf_path)
-    cleanup_service.schedule_cleanup(task_id)
-
-    return {
-        "task_id": task_id,
-        "num_pages": len(doc),
-        "pages": preview_paths
-    }
-
-def add_blank_page(task_id: str):
-    task = task_service.get_task_status(task_id)
-    pdf_path = task['result_path']
-
-    reader = PdfReader(pdf_path)
-    writer = PdfWriter()
-
-    for page in reader.pages:
-        writer.add_page(page)
-
-    writer.add_blank_page()
-
-    with open(pdf_path, "wb") as f:
-        writer.write(f)
-
-    return get_pdf_previews(task_id, pdf_path)
-
-def delete_pages(task_id: str, pages_to_delete: list[int]):
-    task = task_service.get_task_status(task_id)
-    pdf_path = task['result_path']
-
-    reader = PdfReader(pdf_path)
-    writer = PdfWriter()
-
-    for i in range(len(reader.pages)):
-        if i not in pages_to_delete:
-            writer.add_page(reader.pages[i])
-
-    with open(pdf_path, "wb") as f:
-        writer.write(f)
-
-    return get_pdf_previews(task_id, pdf_path)
-
-def reorder_pages(task_id: str, page_order: list[int]):
+    try:
+        upload = await upload_ingest.ingest_upload(file, task_dir, config.PDF_MAX_UPLOAD_BYTES)
+    except upload_ingest.UploadTooLargeError as e:
+        await task_service.fail_task_async(task_id, str(e))
+        cleanup_service.cleanup_task_directory(task_id)
+        raise
+    await task_service.set_task_input_async(task_id, upload['path'], upload['sha256'], upload['size'])
+    original_pdf_path = upload['path']
+
+    await task_service.complete_task_async(task_id, original_pdf_path)
+    await cleanup_service.schedule_cleanup_async(task_id)
+
+    # Previews are rendered on demand by the preview endpoint.
+    return await asyncio.to_thread(get_pdf_previews, task_id, original_pdf_path)
+
+def apply_page_operations(task_id: str, operations: list[dict]):
+    """
+    Applies a batch of page operations (see `pdf_page_ops.build_page_plan`) to
+    the task's document in a single pass.
+
+    Raises:
+        ValueError: If an operation refers to a page that does not exist.
+    """
     task = task_service.get_task_status(task_id)
     pdf_path = task['result_path']
 
-    reader = PdfReader(pdf_path)
-    writer = PdfWriter()
-
-    for page_index in page_order:
-        writer.add_page(reader.pages[page_index])
-
-    with open(pdf_path, "wb") as f:
-        writer.write(f)
-
-    return get_pdf_previews(task_id, pdf_path)
+    with _document_lock(task_id):
+        pdf_page_ops.apply_page_operations(pdf_path, operations)
+        return get_pdf_previews(task_id, pdf_path)
 
 def add_signature(task_id: str, page_index: int, x: float, y: float, width: float, signature_data_url: str):
     task = task_service.get_task_status(task_id)
@@ -94,93 +94,358 @@ def add_signature(task_id: str, page_index: int, x: float, y: float, width: floa
     data = base64.b64decode(encoded)
     img = Image.open(io.BytesIO(data))
 
-    # Save signature temporarily as PNG
-    signature_temp_path = os.path.join(os.path.dirname(pdf_path), "signature_temp.png")
-    img.save(signature_temp_path)
-
-    doc = fitz.open(pdf_path)
-    page = doc[page_index]
-
-    # Calculate height based on aspect ratio and desired width
-    img_width, img_height = img.size
-    height = (img_height / img_width) * width
-
-    rect = fitz.Rect(x, y, x + width, y + height)
-    page.insert_image(rect, filename=signature_temp_path)
-
-    doc.save(pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
-    doc.close()
-
-    os.remove(signature_temp_path)
-
-    return get_pdf_previews(task_id, pdf_path)
-
-def merge_pdfs(files):
-    writer = PdfWriter()
-    for file in files:
-        reader = PdfReader(file.file)
-        for page in reader.pages:
-            writer.add_page(page)
-    
-    output = io.BytesIO()
-    writer.write(output)
-    output.seek(0)
-    return output
-
-def compress_pdf(file, level):
-    settings_map = {
-        "Low": "/screen",
-        "Medium": "/ebook",
-        "High": "/printer"
-    }
-    gs_setting = settings_map.get(level, "/ebook")
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_in:
-        tmp_in.write(file.file.read())
-        tmp_in_path = tmp_in.name
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_out:
-        tmp_out_path = tmp_out.name
+    with _document_lock(task_id):
+        # Save signature temporarily as PNG
+        signature_temp_path = os.path.join(os.path.dirname(pdf_path), "signature_temp.png")
+        img.save(signature_temp_path)
+
+        # Edit a copy and swap it in, so that readers that do not take the
+        # lock, such as downloads, never see a half-written file.
+        work_path = pdf_path + ".tmp"
+        shutil.copyfile(pdf_path, work_path)
+        doc = fitz.open(work_path)
+        page = doc[page_index]
+
+        # Calculate height based on aspect ratio and desired width
+        img_width, img_height = img.size
+        height = (img_height / img_width) * width
+
+        rect = fitz.Rect(x, y, x + width, y + height)
+        page.insert_image(rect, filename=signature_temp_path)
+
+        doc.save(work_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+        doc.close()
+        os.replace(work_path, pdf_path)
+
+        os.remove(signature_temp_path)
+
+        return get_pdf_previews(task_id, pdf_path)
+
+def _save_partial(merged, part_path: str):
+    if merged.name:
+        merged.save(part_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+    else:
+        merged.save(part_path)
+
+def _merge_files(input_paths: list[str], output_path: str):
+    # Runs in a PDF worker process. Pages copied by insert_pdf stay in memory
+    # until the document is saved, so the partial result is saved
+    # incrementally and reopened after every PDF_MERGE_FLUSH_BYTES of input.
+    # (Flushing after every input would rescan the growing file each time.)
+    part_path = output_path + ".part"
+    merged = fitz.open()
+    pending_bytes = 0
+    try:
+        for number, path in enumerate(input_paths, start=1):
+            try:
+                source = fitz.open(path, filetype="pdf")
+            except RuntimeError:
+                raise ValueError(f"File {number} is not a valid PDF")
+            with source:
+                if source.needs_pass:
+                    raise ValueError(f"File {number} is password protected")
+                merged.insert_pdf(source)
+            pending_bytes += os.path.getsize(path)
+            os.remove(path)
+            if pending_bytes >= config.PDF_MERGE_FLUSH_BYTES:
+                _save_partial(merged, part_path)
+                merged.close()
+                merged = fitz.open(part_path)
+                pending_bytes = 0
+
+        # Rewrite once at the end, merging the objects the inputs share.
+        merged.save(output_path, garbage=config.PDF_MERGE_GARBAGE_LEVEL, deflate=True)
+    finally:
+        merged.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+async def merge_pdfs(files) -> tuple[str, str]:
+    """
+    Merges uploaded PDFs, in order, into a new task's directory. The uploads
+    are spooled to disk and merged with PyMuPDF in a PDF worker process, so the
+    server never holds the documents in memory.
+
+    Returns:
+        The task ID and the path of the merged PDF.
+
+    Raises:
+        UploadTooLargeError: If one of the uploads is too large.
+        ValueError: If one of the uploads is not a PDF or is encrypted.
+    """
+    if not files:
+        raise ValueError("No files to merge")
+    task_id = await task_service.create_task_async(tool_name='pdf-merge')
+    task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
+    os.makedirs(task_dir, exist_ok=True)
+    output_path = os.path.join(task_dir, "merged.pdf")
 
-    command = [
+    try:
+        input_paths = []
+        for i, file in enumerate(files):
+            # Uploads often share a name, so number them instead.
+            upload = await upload_ingest.ingest_upload(file, task_dir, config.PDF_MAX_UPLOAD_BYTES, filename=f"input_{i:04d}.pdf")
+            input_paths.append(upload['path'])
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(pdf_rasterizer.get_executor(), _merge_files, input_paths, output_path)
+        except RuntimeError as e:
+            raise ValueError(f"Could not merge the PDFs: {e}")
+    except Exception as e:
+        await task_service.fail_task_async(task_id, str(e))
+        cleanup_service.cleanup_task_directory(task_id)
+        raise
+
+    await task_service.complete_task_async(task_id, output_path)
+    await cleanup_service.schedule_cleanup_async(task_id)
+    return task_id, output_path
+
+async def _run_ghostscript(input_path: str, output_path: str, gs_setting: str, on_page):
+    """
+    Runs Ghostscript as an asyncio subprocess, calling `on_page(page_number)`
+    as it reports each page it has written.
+
+    Raises:
+        RuntimeError: If Ghostscript fails, with the end of its output.
+    """
+    process = await asyncio.create_subprocess_exec(
         "gs",
         "-sDEVICE=pdfwrite",
         "-dCompatibilityLevel=1.4",
         f"-dPDFSETTINGS={gs_setting}",
         "-dNOPAUSE",
-        "-dQUIET",
         "-dBATCH",
-        f"-sOutputFile={tmp_out_path}",
-        tmp_in_path
-    ]
-
+        f"-sOutputFile={output_path}",
+        input_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    tail = collections.deque(maxlen=20)
     try:
-        subprocess.run(command, check=True)
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        # Handle error, e.g., Ghostscript not found or compression failed
-        raise RuntimeError(f"PDF compression failed: {e}")
-
-    with open(tmp_out_path, "rb") as f:
-        compressed_pdf = f.read()
-
-    os.remove(tmp_in_path)
-    os.remove(tmp_out_path)
+        async for line in process.stdout:
+            match = _GS_PAGE_RE.match(line)
+            if match:
+                on_page(int(match.group(1)))
+            else:
+                tail.append(line.decode(errors="replace").rstrip())
+        await process.wait()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"Ghostscript exited with code {process.returncode}: " + "\n".join(tail))
+
+def _count_pages(pdf_path: str) -> int:
+    try:
+        with fitz.open(pdf_path, filetype="pdf") as doc:
+            return len(doc)
+    except RuntimeError:
+        raise ValueError("The file is not a valid PDF")
+
+def run_compression(task_id: str, input_path: str, output_path: str, gs_setting: str, cache_key: str):
+    """
+    Compresses a task's PDF with Ghostscript, reporting progress per page.
+    Runs on a worker of the job scheduler's `pdf-compress` pool.
+    """
+    part_path = output_path + ".part"
+    try:
+        num_pages = _count_pages(input_path)
+
+        last_progress = 0
+        def on_page(page_number: int):
+            nonlocal last_progress
+            # 100 is reported by complete_task once the output is in place.
+            progress = min(99, page_number * 100 // max(num_pages, 1))
+            if progress > last_progress:
+                last_progress = progress
+                task_service.update_task_progress(task_id, progress)
+
+        asyncio.run(_run_ghostscript(input_path, part_path, gs_setting, on_page))
+        os.replace(part_path, output_path)
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        if isinstance(e, FileNotFoundError):
+            e = "Ghostscript is not installed"
+        logger.error(f"PDF compression failed for task {task_id}: {e}")
+        task_service.fail_task(task_id, f"PDF compression failed: {e}")
+        return
+
+    result_cache.pdf_compress_cache.store(cache_key, output_path)
+    task_service.complete_task(task_id, output_path)
+
+async def start_compression(file, level: str) -> dict:
+    """
+    Stores an uploaded PDF for compression with Ghostscript. Compressing a
+    file that was already compressed at the same level completes immediately
+    from the result cache; otherwise the caller queues `run_compression` with
+    the returned `job_args` on the job scheduler, which runs at most
+    `config.PDF_COMPRESS_MAX_CONCURRENCY` compressions at once and keeps the
+    queue across restarts. Progress is published on the task's progress
+    stream.
+
+    Args:
+        file: The uploaded PDF.
+        level: "Low", "Medium" or "High".
+
+    Returns:
+        A dictionary with the `task_id` and its current `status`, plus the
+        `job_args` of `run_compression` if the task still needs compressing.
+
+    Raises:
+        UploadTooLargeError: If the upload is too large.
+    """
+    gs_setting = _COMPRESSION_SETTINGS.get(level, "/ebook")
+    task_id = await task_service.create_task_async(tool_name='pdf-compress')
+    task_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
+    os.makedirs(task_dir, exist_ok=True)
 
-    return io.BytesIO(compressed_pdf)
+    try:
+        upload = await upload_ingest.ingest_upload(file, task_dir, config.PDF_MAX_UPLOAD_BYTES, filename="input.pdf")
+    except upload_ingest.UploadTooLargeError as e:
+        await task_service.fail_task_async(task_id, str(e))
+        cleanup_service.cleanup_task_directory(task_id)
+        raise
+    await task_service.set_task_input_async(task_id, upload['path'], upload['sha256'], upload['size'])
+    await cleanup_service.schedule_cleanup_async(task_id)
+
+    output_path = os.path.join(task_dir, "compressed.pdf")
+    cache_key = result_cache.pdf_compress_cache.make_key(upload['sha256'], {"setting": gs_setting})
+    # Fetching hard-links or copies the cached file; keep it off the event loop.
+    if await asyncio.to_thread(result_cache.pdf_compress_cache.fetch, cache_key, output_path):
+        await task_service.complete_task_async(task_id, output_path)
+        return {"task_id": task_id, "status": "completed"}
+
+    job_args = {
+        "input_path": upload['path'],
+        "output_path": output_path,
+        "gs_setting": gs_setting,
+        "cache_key": cache_key,
+    }
+    return {"task_id": task_id, "status": "pending", "job_args": job_args}
+
+def _file_revision(pdf_path: str) -> str:
+    stat = os.stat(pdf_path)
+    return f"{stat.st_mtime_ns:x}{stat.st_size:x}"
+
+def _read_document(task_id: str, pdf_path: str) -> bytes:
+    with _document_lock(task_id):
+        with open(pdf_path, "rb") as file:
+            return file.read()
+
+def _snapshot_document(task_id: str, pdf_path: str) -> tuple[str, str]:
+    # A copy next to the document for the rasterizer's worker processes,
+    # which open it by path, and the revision it was taken at.
+    fd, snapshot_path = tempfile.mkstemp(prefix="preview-", suffix=".pdf", dir=os.path.dirname(pdf_path))
+    os.close(fd)
+    try:
+        with _document_lock(task_id):
+            shutil.copyfile(pdf_path, snapshot_path)
+            revision = _file_revision(pdf_path)
+    except BaseException:
+        os.remove(snapshot_path)
+        raise
+    return snapshot_path, revision
 
 def get_pdf_previews(task_id: str, pdf_path: str):
-    task_dir = os.path.dirname(pdf_path)
-    preview_paths = []
-    doc = fitz.open(pdf_path)
-    for i, page in enumerate(doc):
-        pix = page.get_pixmap()
-        preview_path = os.path.join(task_dir, f"page_{i}.png")
-        pix.save(preview_path)
-        preview_paths.append(f"/api/v1/pdf/preview/{task_id}/page_{i}.png")
+    """
+    Lists the preview URLs of a document without rendering anything. The URLs
+    carry the file's revision so browsers refetch previews after an edit; the
+    preview endpoint then reuses any page whose content did not change.
+
+    Callers that may race an edit of the document hold its `_document_lock`.
+    """
+    revision = _file_revision(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        num_pages = len(doc)
+    preview_paths = [f"/api/v1/pdf/preview/{task_id}/page_{i}.png?rev={revision}" for i in range(num_pages)]
 
     return {
         "task_id": task_id,
-        "num_pages": len(doc),
+        "num_pages": num_pages,
         "pages": preview_paths
     }
 
+def _preview_cache_key(content_hash: str, size: str, image_format: str, quality: int) -> str:
+    return f"{content_hash}:{size}:{image_format}:{quality}"
+
+def _check_preview_options(size: str, image_format: str):
+    if size not in config.PDF_PREVIEW_TIERS:
+        raise ValueError(f"Unknown preview size '{size}'")
+    if image_format not in pdf_rasterizer.MEDIA_TYPES:
+        raise ValueError(f"Unsupported image format '{image_format}'")
+
+def render_page_preview(task_id: str, page_name: str, size: str = config.PDF_PREVIEW_DEFAULT_TIER, image_format: str = "png", quality: int = config.PDF_PREVIEW_QUALITY) -> bytes | None:
+    """
+    Returns the preview of a page, rendering it only if no page with the same
+    content has been rendered with the same options before.
+
+    Args:
+        task_id: The PDF editor task.
+        page_name: The preview file name, `page_<index>.png`.
+        size: One of the tiers in `config.PDF_PREVIEW_TIERS`.
+        image_format: "png", "jpeg" or "webp".
+        quality: Quality of the lossy formats, 1-100.
+
+    Returns:
+        The encoded image, or None if the task or page does not exist.
+    """
+    _check_preview_options(size, image_format)
+    match = _PAGE_NAME_RE.match(page_name)
+    task = task_service.get_task_status(task_id)
+    if not match or not task or not task['result_path'] or not os.path.exists(task['result_path']):
+        return None
+
+    page_index = int(match.group(1))
+    data = _read_document(task_id, task['result_path'])
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        if page_index >= len(doc):
+            return None
+        page = doc[page_index]
+        cache_key = _preview_cache_key(pdf_rasterizer.page_content_hash(doc, page), size, image_format, quality)
+        image = _preview_cache.get(cache_key)
+        if image is None:
+            image = pdf_rasterizer.render_page(page, config.PDF_PREVIEW_TIERS[size], image_format, quality)
+            _preview_cache.put(cache_key, image)
+    return image
+
+def _page_cache_keys(pdf_path: str, size: str, image_format: str, quality: int) -> list[str]:
+    with fitz.open(pdf_path) as doc:
+        return [
+            _preview_cache_key(pdf_rasterizer.page_content_hash(doc, page), size, image_format, quality)
+            for page in doc
+        ]
+
+async def render_all_previews(task_id: str, size: str = config.PDF_PREVIEW_DEFAULT_TIER, image_format: str = "png", quality: int = config.PDF_PREVIEW_QUALITY):
+    """
+    Renders every page of a task's document that is not in the preview cache
+    yet on the parallel rasterizer, and yields `{"page", "url"}` for each page
+    as soon as its preview is available. Already cached pages come first.
+    """
+    _check_preview_options(size, image_format)
+    task = await task_service.get_task_status_async(task_id)
+    if not task or not task['result_path'] or not os.path.exists(task['result_path']):
+        return
+    snapshot_path, revision = await asyncio.to_thread(_snapshot_document, task_id, task['result_path'])
+    query = f"rev={revision}&size={size}&format={image_format}&quality={quality}"
+    try:
+        # Hashing reads every page's content streams; keep it off the event loop.
+        cache_keys = await asyncio.to_thread(_page_cache_keys, snapshot_path, size, image_format, quality)
+
+        missing = []
+        for page_index, cache_key in enumerate(cache_keys):
+            if _preview_cache.get(cache_key) is None:
+                missing.append(page_index)
+            else:
+                yield {"page": page_index, "url": f"/api/v1/pdf/preview/{task_id}/page_{page_index}.png?{query}"}
+
+        dpi = config.PDF_PREVIEW_TIERS[size]
+        async for page_index, image in pdf_rasterizer.render_pages(snapshot_path, missing, dpi, image_format, quality):
+            _preview_cache.put(cache_keys[page_index], image)
+            yield {"page": page_index, "url": f"/api/v1/pdf/preview/{task_id}/page_{page_index}.png?{query}"}
+    finally:
+        # The task directory may have been cleaned up meanwhile.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(snapshot_path)
@@ -1,44 +1,137 @@
-
 import yt_dlp
+import logging
 import os
+import threading
+import time
+from ..core import config
 from . import cleanup_service, task_service
 
-def fetch_video_info(url: str):
-    """Fetches video information without downloading."""
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'skip_download': True,
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-        formats = [{'format_id': f['format_id'], 'ext': f['ext'], 'resolution': f.get('resolution') or f.get('acodec')} for f in info['formats']]
-        return {
-            'title': info.get('title', 'No title'),
-            'thumbnail': info.get('thumbnail', ''),
-            'formats': formats
-        }
-
-def create_download_task(url: str, format_id: str, audio_only: bool, audio_format: str | None):
+logger = logging.getLogger(__name__)
+
+
+class FragmentBudget:
+    """
+    Shares a global number of fragment download slots between the running
+    jobs. A job is granted up to what it asks for, but never less than one
+    slot, so a saturated budget slows new jobs down instead of blocking them.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self._lock = threading.Lock()
+        self._in_use = 0
+
+    def acquire(self, wanted: int) -> int:
+        with self._lock:
+            granted = max(1, min(wanted, self.total - self._in_use))
+            self._in_use += granted
+            return granted
+
+    def release(self, granted: int):
+        with self._lock:
+            self._in_use -= granted
+
+
+fragment_budget = FragmentBudget(config.YTDL_MAX_FRAGMENT_CONCURRENCY)
+
+
+class DownloadProgress:
+    """
+    yt-dlp progress hook of a task. The percentage is computed from the byte
+    counts yt-dlp passes in, never parsed from its display strings. Reports
+    are throttled: at most one per `interval` seconds, and only when the
+    percentage moved by `min_delta` or `heartbeat` seconds have passed.
+    Callbacks in between do no more than compare a few numbers.
+    """
+
+    __slots__ = ("task_id", "interval", "min_delta", "heartbeat", "report", "clock", "_last_time", "_last_progress")
+
+    def __init__(self, task_id: str, interval: float, min_delta: int, heartbeat: float,
+                 report=task_service.update_task_progress, clock=time.monotonic):
+        self.task_id = task_id
+        self.interval = interval
+        self.min_delta = min_delta
+        self.heartbeat = heartbeat
+        self.report = report
+        self.clock = clock
+        self._last_time = float("-inf")
+        self._last_progress = -1
+
+    def __call__(self, d: dict):
+        status = d['status']
+        if status == 'downloading':
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if not total:
+                return
+            downloaded = d.get('downloaded_bytes') or 0
+            # 100 is left for 'finished'; fragment estimates can overshoot.
+            progress = min(99, downloaded * 100 // int(total))
+            now = self.clock()
+            elapsed = now - self._last_time
+            if elapsed < self.interval:
+                return
+            if progress - self._last_progress < self.min_delta and elapsed < self.heartbeat:
+                return
+            self._last_time = now
+            self._last_progress = progress
+            eta = d.get('eta')
+            self.report(
+                self.task_id, progress,
+                downloaded_bytes=downloaded, total_bytes=int(total),
+                speed=d.get('speed'), eta=int(eta) if eta is not None else None,
+            )
+        elif status == 'finished':
+            # Every file of the download reports this, e.g. video and audio
+            # before they are merged; each starts over from 0.
+            self._last_time = float("-inf")
+            self._last_progress = -1
+            downloaded = d.get('downloaded_bytes') or d.get('total_bytes')
+            self.report(self.task_id, 100, downloaded_bytes=downloaded, total_bytes=downloaded, speed=None, eta=0)
+
+
+async def create_download_task(url: str, format_id: str, audio_only: bool, audio_format: str | None):
     """Creates a download task in the database."""
-    return task_service.create_task(tool_name='ytdl')
+    return await task_service.create_task_async(tool_name='ytdl')
+
+def _result_path(info: dict, output_dir: str) -> str:
+    # The final file, after any post-processing; not whatever else is left in
+    # the directory, such as the state of an earlier attempt.
+    downloads = info.get('requested_downloads') or []
+    if downloads and downloads[-1].get('filepath'):
+        return downloads[-1]['filepath']
+    files = [name for name in os.listdir(output_dir) if not name.endswith(('.part', '.ytdl'))]
+    return os.path.join(output_dir, files[0])
 
 def run_download_task(task_id: str, url: str, format_id: str, audio_only: bool, audio_format: str | None):
-    """Runs the download task, updating progress in the database."""
+    """
+    Runs the download task, updating progress in the database.
+
+    HLS and DASH formats are downloaded several fragments at a time. Partial
+    downloads are kept in the task directory, so a task interrupted by a
+    restart and run again continues where it stopped.
+    """
     output_dir = os.path.join(cleanup_service.TEMP_DIR, task_id)
     os.makedirs(output_dir, exist_ok=True)
+    if any(name.endswith(('.part', '.ytdl')) for name in os.listdir(output_dir)):
+        logger.info(f"Resuming download for task {task_id}")
 
-    def progress_hook(d):
-        if d['status'] == 'downloading':
-            progress = int(d['_percent_str'].strip().replace('%', ''))
-            task_service.update_task_progress(task_id, progress)
-        elif d['status'] == 'finished':
-            task_service.update_task_progress(task_id, 100)
-
+    progress_hook = DownloadProgress(
+        task_id,
+        config.YTDL_PROGRESS_INTERVAL_MS / 1000,
+        config.YTDL_PROGRESS_MIN_DELTA,
+        config.YTDL_PROGRESS_HEARTBEAT_MS / 1000,
+    )
+    fragments = fragment_budget.acquire(config.YTDL_FRAGMENT_CONCURRENCY)
     ydl_opts = {
         'outtmpl': f'{output_dir}/%(title)s.%(ext)s',
         'format': format_id,
         'progress_hooks': [progress_hook],
+        'concurrent_fragment_downloads': fragments,
+        # Resume from the .part file and, for fragmented formats, the .ytdl
+        # state file that yt-dlp keeps next to it.
+        'continuedl': True,
+        'nopart': False,
+        'keep_fragments': False,
     }
 
     if audio_only:
@@ -49,12 +142,10 @@ def run_download_task(task_id: str, url: str, format_id: str, audio_only: bool,
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-            result_file = os.listdir(output_dir)[0]
-            result_path = os.path.join(output_dir, result_file)
-            task_service.complete_task(task_id, result_path)
+            info = ydl.extract_info(url, download=True)
+            task_service.complete_task(task_id, _result_path(info, output_dir))
     except Exception as e:
         task_service.fail_task(task_id, str(e))
     finally:
+        fragment_budget.release(fragments)
         cleanup_service.schedule_cleanup(task_id)
-
@@ -1,9 +1,96 @@
-import uuid
-from .. import database
+import json
+import logging
+import threading
+import time
+from ..core import config
+from . import cleanup_service
+from .progress_bus import bus
+from .task_store import PROGRESS_FIELDS, get_store
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressCoalescer:
+    """
+    Write-behind buffer for task progress. Only the latest progress of each
+    task is kept, and a background thread writes all of them in one
+    transaction at most once per `interval` seconds, however often progress is
+    reported. The first report for a task is written straight away, as it
+    moves the task to 'processing'.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending: dict[str, dict] = {}
+        self._started: set[str] = set()
+        self._thread = None
+
+    def report(self, task_id: str, progress: dict) -> bool:
+        """
+        Records a task's progress fields. Returns True if the caller must
+        write them now, because it is the task's first report.
+        """
+        with self._lock:
+            if task_id not in self._started:
+                self._started.add(task_id)
+                self._pending.pop(task_id, None)
+                return True
+            self._pending[task_id] = progress
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="task-progress-writer", daemon=True)
+                self._thread.start()
+            return False
+
+    def pending(self, task_id: str) -> dict | None:
+        with self._lock:
+            return self._pending.get(task_id)
+
+    def discard(self, task_id: str):
+        """Forgets a task's unwritten progress, when its status changes."""
+        with self._lock:
+            self._pending.pop(task_id, None)
+            self._started.discard(task_id)
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        # The store never moves a task out of a status set since the progress
+        # was reported.
+        runner = get_store()
+        runner.call(runner.store.write_progress(batch))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write task progress: {e}")
+
+
+_progress = ProgressCoalescer(config.TASK_PROGRESS_FLUSH_MS / 1000)
+
+
+def flush_progress():
+    """Writes all buffered progress now, e.g. before shutting down."""
+    _progress.flush()
+
+def _update(task_id: str, **fields):
+    runner = get_store()
+    runner.call(runner.store.update_task(task_id, fields))
+
+async def _update_async(task_id: str, **fields):
+    runner = get_store()
+    await runner.acall(runner.store.update_task(task_id, fields))
 
 def create_task(tool_name: str) -> str:
     """
-    Creates a new task in the database with a 'pending' status.
+    Creates a new task in the database with a 'pending' status. It expires
+    after its tool's TTL like a finished task, so that it is cleaned up even
+    if it fails before its result is scheduled for cleanup.
 
     Args:
         tool_name: The name of the tool initiating the task.
@@ -11,31 +98,182 @@ def create_task(tool_name: str) -> str:
     Returns:
         The unique ID of the newly created task.
     """
-    task_id = str(uuid.uuid4())
-    with database.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO tasks (task_id, tool_name, status) VALUES (?, ?, ?)",
-            (task_id, tool_name, 'pending')
-        )
-        conn.commit()
+    runner = get_store()
+    return runner.call(_create_task(runner.store, tool_name))
+
+async def create_task_async(tool_name: str) -> str:
+    """
+    Like `create_task`, but awaits the store instead of blocking the calling
+    event loop. Use this, and the other `_async` functions, from route
+    handlers and other code running on the server's event loop.
+    """
+    runner = get_store()
+    return await runner.acall(_create_task(runner.store, tool_name))
+
+async def _create_task(store, tool_name: str) -> str:
+    expires_at = time.time() + cleanup_service.ttl_for(tool_name)
+    task_id = await store.create_task(tool_name, expires_at)
+    cleanup_service.scheduler.push(expires_at, task_id)
     return task_id
 
-def update_task_progress(task_id: str, progress: int):
+def update_task_progress(task_id: str, progress: int, **details):
     """
-    Updates the progress of a specific task.
+    Updates the progress of a specific task. Subscribers are notified at once,
+    but the database is only written behind, at a bounded rate; see
+    `ProgressCoalescer`.
 
     Args:
         task_id: The ID of the task to update.
         progress: The new progress percentage (0-100).
+        **details: Further progress fields of downloads: `downloaded_bytes`,
+            `total_bytes`, `speed` (bytes per second) and `eta` (seconds).
+            Those not given are cleared.
+    """
+    fields = {name: details.get(name) for name in PROGRESS_FIELDS}
+    fields['progress'] = progress
+    if _progress.report(task_id, fields):
+        _update(task_id, status='processing', last_used_at=time.time(), **fields)
+    bus.publish(task_id, status='processing', queue_position=None, progress=progress, **details)
+
+async def update_task_progress_async(task_id: str, progress: int, **details):
+    """Like `update_task_progress`, without blocking the calling event loop."""
+    fields = {name: details.get(name) for name in PROGRESS_FIELDS}
+    fields['progress'] = progress
+    if _progress.report(task_id, fields):
+        await _update_async(task_id, status='processing', last_used_at=time.time(), **fields)
+    bus.publish(task_id, status='processing', queue_position=None, progress=progress, **details)
+
+def queue_task(task_id: str, job_args: dict):
+    """
+    Marks a task as 'queued' and persists the arguments needed to run it, so
+    the job can be resubmitted if the server restarts before it runs.
+
+    Args:
+        task_id: The ID of the task to queue.
+        job_args: JSON-serializable keyword arguments for the job function.
+    """
+    _progress.discard(task_id)
+    # A result left by an earlier run is about to be replaced.
+    now = time.time()
+    _update(task_id, status='queued', progress=0, queued_at=now, last_used_at=now, job_args=json.dumps(job_args), result_path=None)
+    bus.publish(task_id, status='queued', progress=0)
+
+def get_queued_tasks(tool_name: str):
+    """
+    Returns the queued tasks of a tool in submission order, with their
+    decoded job arguments.
     """
-    with database.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE tasks SET progress = ?, status = ? WHERE task_id = ?",
-            (progress, 'processing', task_id)
-        )
-        conn.commit()
+    runner = get_store()
+    tasks = runner.call(runner.store.get_tasks(tool_name, 'queued'))
+    return [(task['task_id'], json.loads(task['job_args'] or '{}')) for task in tasks]
+
+def requeue_interrupted_tasks(tool_name: str, stale_before: float) -> list:
+    """
+    Puts the tasks of a tool left 'processing' by a server process that has
+    gone away back in the queue. A process refreshes the tasks it runs with
+    `touch_tasks`, so those not refreshed since `stale_before` have lost
+    theirs. They keep their original submission time, so they run before the
+    tasks queued after them.
+
+    Returns:
+        The requeued tasks, with their decoded job arguments.
+    """
+    runner = get_store()
+    requeued = runner.call(_requeue_interrupted_tasks(runner.store, tool_name, stale_before))
+    for task_id, _ in requeued:
+        bus.publish(task_id, status='queued')
+    return requeued
+
+async def _requeue_interrupted_tasks(store, tool_name: str, stale_before: float):
+    requeued = []
+    for task in await store.get_tasks(tool_name, 'processing'):
+        if (task['last_used_at'] or 0) >= stale_before:
+            continue
+        # Only if neither its owner nor another process has touched it since.
+        expected = {"status": ('processing',), "owner": (task['owner'],), "last_used_at": (task['last_used_at'],)}
+        now = time.time()
+        fields = {"status": "queued", "owner": None, "queued_at": task['queued_at'] or now, "last_used_at": now}
+        if await store.update_task_if(task['task_id'], expected, fields):
+            requeued.append((task['task_id'], json.loads(task['job_args'] or '{}')))
+    return requeued
+
+def claim_task(task_id: str, owner: str) -> bool:
+    """
+    Moves a queued task to 'processing' so that this server process runs it.
+    Every process resumes the whole queue when it starts, so the first one to
+    claim a task runs it and the others drop it.
+
+    Args:
+        task_id: The ID of the queued task.
+        owner: Identifies the claiming process, which keeps the task alive
+            with `touch_tasks` while it runs.
+
+    Returns:
+        False if the task is no longer queued, e.g. because another process
+        claimed it or it was cancelled.
+    """
+    runner = get_store()
+    fields = {"status": "processing", "progress": 0, "owner": owner, "last_used_at": time.time()}
+    if not runner.call(runner.store.update_task_if(task_id, {"status": ('queued',)}, fields)):
+        return False
+    bus.publish(task_id, status='processing', queue_position=None, progress=0)
+    return True
+
+def touch_tasks(task_ids: list[str], owner: str):
+    """
+    Records that `owner` is still running the given tasks, so that no other
+    process takes them for interrupted. Tasks that have finished or been
+    requeued meanwhile are left alone.
+    """
+    runner = get_store()
+    runner.call(_touch_tasks(runner.store, task_ids, owner))
+
+async def _touch_tasks(store, task_ids: list[str], owner: str):
+    expected = {"status": ('processing',), "owner": (owner,)}
+    for task_id in task_ids:
+        await store.update_task_if(task_id, expected, {"last_used_at": time.time()})
+
+def cancel_queued_task(task_id: str) -> bool:
+    """
+    Marks a task as 'cancelled' if it is still queued, in one atomic step.
+
+    Args:
+        task_id: The ID of the task to cancel.
+
+    Returns:
+        False if the task is no longer queued, e.g. because a server process
+        claimed it.
+    """
+    _progress.discard(task_id)
+    runner = get_store()
+    if not runner.call(runner.store.update_task_if(task_id, {"status": ('queued',)}, {"status": "cancelled"})):
+        return False
+    bus.publish(task_id, status='cancelled', queue_position=None)
+    return True
+
+def cancel_task(task_id: str):
+    """
+    Marks a task as 'cancelled'.
+
+    Args:
+        task_id: The ID of the task to cancel.
+    """
+    _progress.discard(task_id)
+    _update(task_id, status='cancelled')
+    bus.publish(task_id, status='cancelled', queue_position=None)
+
+def stream_task_result(task_id: str, result_path: str):
+    """
+    Records where a running task is writing its result, for jobs whose output
+    can be downloaded while it grows. A 'processing' task with a result_path
+    is one such; it stays 'processing' until `complete_task`.
+
+    Args:
+        task_id: The ID of the task.
+        result_path: The path of the result file being written.
+    """
+    _update(task_id, status='processing', result_path=result_path, last_used_at=time.time())
+    bus.publish(task_id, status='processing', result_path=result_path)
 
 def complete_task(task_id: str, result_path: str):
     """
@@ -45,13 +283,15 @@ def complete_task(task_id: str, result_path: str):
         task_id: The ID of the task to complete.
         result_path: The path to the generated result file.
     """
-    with database.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE tasks SET status = ?, progress = 100, result_path = ? WHERE task_id = ?",
-            ('completed', result_path, task_id)
-        )
-        conn.commit()
+    _progress.discard(task_id)
+    _update(task_id, status='completed', progress=100, result_path=result_path)
+    bus.publish(task_id, status='completed', progress=100, result_path=result_path)
+
+async def complete_task_async(task_id: str, result_path: str):
+    """Like `complete_task`, without blocking the calling event loop."""
+    _progress.discard(task_id)
+    await _update_async(task_id, status='completed', progress=100, result_path=result_path)
+    bus.publish(task_id, status='completed', progress=100, result_path=result_path)
 
 def fail_task(task_id: str, error_message: str):
     """
@@ -61,13 +301,15 @@ def fail_task(task_id: str, error_message: str):
         task_id: The ID of the task to fail.
         error_message: The reason for the failure.
     """
-    with database.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE tasks SET status = ?, error_message = ? WHERE task_id = ?",
-            ('failed', error_message, task_id)
-        )
-        conn.commit()
+    _progress.discard(task_id)
+    _update(task_id, status='failed', error_message=error_message)
+    bus.publish(task_id, status='failed', error_message=error_message)
+
+async def fail_task_async(task_id: str, error_message: str):
+    """Like `fail_task`, without blocking the calling event loop."""
+    _progress.discard(task_id)
+    await _update_async(task_id, status='failed', error_message=error_message)
+    bus.publish(task_id, status='failed', error_message=error_message)
 
 def get_task_status(task_id: str):
     """
@@ -79,23 +321,52 @@ def get_task_status(task_id: str):
     Returns:
         A dictionary containing the task's details, or None if not found.
     """
-    with database.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,))
-        task = cursor.fetchone()
-        if task:
-            return dict(task)
-        return None
+    runner = get_store()
+    return _with_pending_progress(runner.call(_load_task(runner.store, task_id)))
+
+async def get_task_status_async(task_id: str):
+    """
+    Like `get_task_status`, but awaits the store instead of blocking the
+    calling event loop. Use this from route handlers.
+    """
+    runner = get_store()
+    return _with_pending_progress(await runner.acall(_load_task(runner.store, task_id)))
+
+async def _load_task(store, task_id: str):
+    # Runs on the store's loop, so both lookups take a single hop.
+    task = await store.get_task(task_id)
+    if task and task['status'] == 'queued':
+        task['queue_position'] = await store.queue_position(task)
+    return task
+
+def _with_pending_progress(task):
+    # Progress not written yet is still the latest known to this process.
+    if task:
+        progress = _progress.pending(task['task_id'])
+        if progress is not None and task['status'] in ('pending', 'queued', 'processing'):
+            task.update(progress)
+            task['status'] = 'processing'
+    return task
+
+def set_task_input(task_id: str, path: str, sha256: str, size: int):
+    """
+    Records the location, content hash and size of a task's uploaded input.
+
+    Args:
+        task_id: The ID of the task.
+        path: The path of the stored input file.
+        sha256: The hex SHA-256 digest of the input file.
+        size: The size of the input file in bytes.
+    """
+    _update(task_id, input_path=path, input_sha256=sha256, input_size=size)
+
+async def set_task_input_async(task_id: str, path: str, sha256: str, size: int):
+    """Like `set_task_input`, without blocking the calling event loop."""
+    await _update_async(task_id, input_path=path, input_sha256=sha256, input_size=size)
 
 def update_task_result_path(task_id: str, result_path: str):
     """
     Updates the result_path of a specific task without changing its status.
     Useful for iterative processes like image editing.
     """
-    with database.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE tasks SET result_path = ? WHERE task_id = ?",
-            (result_path, task_id)
-        )
-        conn.commit()
\ No newline at end of file
+    _update(task_id, result_path=result_path)
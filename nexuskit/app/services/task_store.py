@@ -0,0 +1,649 @@
+import asyncio
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+from .. import database
+from ..core import config
+
+# Statuses a task can still leave; progress is only recorded in these.
+ACTIVE_STATUSES = ('pending', 'queued', 'processing')
+
+TASK_FIELDS = (
+    "task_id", "tool_name", "status", "progress", "result_path", "error_message", "created_at",
+    "queued_at", "job_args", "input_path", "input_sha256", "input_size",
+    "downloaded_bytes", "total_bytes", "speed", "eta", "expires_at", "last_used_at", "owner",
+)
+# What a progress report sets. Besides the percentage, downloads report their
+# byte counts, speed (bytes per second) and estimated seconds left.
+PROGRESS_FIELDS = ("progress", "downloaded_bytes", "total_bytes", "speed", "eta")
+_INT_FIELDS = {"progress", "input_size", "downloaded_bytes", "total_bytes", "eta"}
+_FLOAT_FIELDS = {"queued_at", "speed", "expires_at", "last_used_at"}
+
+
+def _check_fields(fields: dict):
+    unknown = set(fields) - set(TASK_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown task fields: {', '.join(sorted(unknown))}")
+
+
+class TaskStore:
+    """
+    Storage of task records. Every method is a coroutine and must run on the
+    store's own event loop; see `StoreThread`.
+    """
+
+    async def create_task(self, tool_name: str, expires_at: float) -> str:
+        """
+        Creates a 'pending' task that expires at `expires_at`, last used now,
+        and returns its ID.
+        """
+        raise NotImplementedError
+
+    async def get_task(self, task_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def update_task(self, task_id: str, fields: dict):
+        """Sets fields of a task; a None value clears the field."""
+        raise NotImplementedError
+
+    async def update_task_if(self, task_id: str, expected: dict[str, tuple], fields: dict) -> bool:
+        """
+        Like `update_task`, but only if each field in `expected` has one of
+        the values listed for it (None standing for no value), as one atomic
+        step. Several server processes can thus race to change a task, e.g.
+        to claim a queued job, and exactly one wins.
+
+        Returns:
+            True if the task was updated.
+        """
+        raise NotImplementedError
+
+    async def write_progress(self, progress: dict[str, dict]):
+        """
+        Stores the progress of several tasks, moving them to 'processing'
+        and setting their `last_used_at` to now. Each task maps to its
+        `PROGRESS_FIELDS`; missing ones are cleared. Tasks no longer in one
+        of `ACTIVE_STATUSES` are left alone.
+        """
+        raise NotImplementedError
+
+    async def get_tasks(self, tool_name: str, status: str) -> list[dict]:
+        """Returns the tasks of a tool with a status, ordered by (queued_at, task_id)."""
+        raise NotImplementedError
+
+    async def queue_position(self, task: dict) -> int:
+        """Returns the 1-based position of a queued task in its tool's queue."""
+        raise NotImplementedError
+
+    async def get_expiry_times(self) -> list[tuple[float, str]]:
+        """Returns `(expires_at, task_id)` of every task that has an expiry time."""
+        raise NotImplementedError
+
+    async def get_expired(self, now: float, limit: int) -> list[str]:
+        """
+        Returns the IDs of up to `limit` tasks that expired by `now`, earliest
+        first. Tasks still in one of `ACTIVE_STATUSES` are left out.
+        """
+        raise NotImplementedError
+
+    async def get_least_recently_used(self, limit: int) -> list[str]:
+        """
+        Returns the IDs of up to `limit` tasks by ascending `last_used_at`,
+        leaving out tasks that have none or are still active.
+        """
+        raise NotImplementedError
+
+    async def get_stale(self, before: float, limit: int) -> list[str]:
+        """
+        Returns the IDs of up to `limit` tasks still in one of
+        `ACTIVE_STATUSES` whose `last_used_at` is before `before`, least
+        recently used first.
+        """
+        raise NotImplementedError
+
+    async def delete_tasks(self, task_ids: list[str]) -> list[str]:
+        """
+        Deletes the tasks that are no longer in one of `ACTIVE_STATUSES`,
+        checking each one as it is deleted: a task picked for deletion may
+        have been submitted again since.
+
+        Returns:
+            The IDs of the tasks that were deleted.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    The `tasks` table of the application database. The queries run on the
+    store thread, which makes it the database's single task writer.
+    """
+
+    async def create_task(self, tool_name: str, expires_at: float) -> str:
+        task_id = str(uuid.uuid4())
+        with database.get_db() as conn:
+            conn.execute(
+                "INSERT INTO tasks (task_id, tool_name, status, expires_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (task_id, tool_name, 'pending', expires_at, time.time())
+            )
+            conn.commit()
+        return task_id
+
+    async def get_task(self, task_id: str) -> dict | None:
+        with database.get_db() as conn:
+            row = conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    async def update_task(self, task_id: str, fields: dict):
+        _check_fields(fields)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with database.get_db() as conn:
+            conn.execute(f"UPDATE tasks SET {assignments} WHERE task_id = ?", (*fields.values(), task_id))
+            conn.commit()
+
+    async def update_task_if(self, task_id: str, expected: dict[str, tuple], fields: dict) -> bool:
+        _check_fields(fields)
+        _check_fields(expected)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conditions = []
+        values = []
+        for name, allowed in expected.items():
+            present = [value for value in allowed if value is not None]
+            alternatives = [f"{name} IN ({', '.join('?' for _ in present)})"] if present else []
+            if None in allowed:
+                alternatives.append(f"{name} IS NULL")
+            conditions.append(f"({' OR '.join(alternatives)})")
+            values.extend(present)
+        with database.get_db() as conn:
+            cursor = conn.execute(
+                f"UPDATE tasks SET {assignments} WHERE task_id = ? AND {' AND '.join(conditions)}",
+                (*fields.values(), task_id, *values)
+            )
+            conn.commit()
+        return cursor.rowcount == 1
+
+    async def write_progress(self, progress: dict[str, dict]):
+        assignments = ", ".join(f"{name} = ?" for name in (*PROGRESS_FIELDS, "last_used_at"))
+        now = time.time()
+        with database.get_db() as conn:
+            conn.executemany(
+                f"UPDATE tasks SET {assignments}, status = 'processing' WHERE task_id = ? AND status IN ('pending', 'queued', 'processing')",
+                [(*(fields.get(name) for name in PROGRESS_FIELDS), now, task_id) for task_id, fields in progress.items()]
+            )
+            conn.commit()
+
+    async def get_tasks(self, tool_name: str, status: str) -> list[dict]:
+        with database.get_db() as conn:
+            rows = conn.execute(
+                "SELECT * FROM tasks WHERE tool_name = ? AND status = ? ORDER BY queued_at, task_id",
+                (tool_name, status)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def queue_position(self, task: dict) -> int:
+        with database.get_db() as conn:
+            return conn.execute(
+                """
+                SELECT COUNT(*) FROM tasks
+                WHERE tool_name = ? AND status = 'queued'
+                  AND (queued_at < ? OR (queued_at = ? AND task_id <= ?))
+                """,
+                (task['tool_name'], task['queued_at'], task['queued_at'], task['task_id'])
+            ).fetchone()[0]
+
+    async def get_expiry_times(self) -> list[tuple[float, str]]:
+        with database.get_db() as conn:
+            rows = conn.execute("SELECT expires_at, task_id FROM tasks WHERE expires_at IS NOT NULL").fetchall()
+        return [(row["expires_at"], row["task_id"]) for row in rows]
+
+    async def get_expired(self, now: float, limit: int) -> list[str]:
+        with database.get_db() as conn:
+            rows = conn.execute(
+                """
+                SELECT task_id FROM tasks
+                WHERE expires_at <= ? AND status NOT IN ('pending', 'queued', 'processing')
+                ORDER BY expires_at LIMIT ?
+                """,
+                (now, limit)
+            ).fetchall()
+        return [row["task_id"] for row in rows]
+
+    async def get_least_recently_used(self, limit: int) -> list[str]:
+        with database.get_db() as conn:
+            rows = conn.execute(
+                """
+                SELECT task_id FROM tasks
+                WHERE last_used_at IS NOT NULL AND status NOT IN ('pending', 'queued', 'processing')
+                ORDER BY last_used_at LIMIT ?
+                """,
+                (limit,)
+            ).fetchall()
+        return [row["task_id"] for row in rows]
+
+    async def get_stale(self, before: float, limit: int) -> list[str]:
+        with database.get_db() as conn:
+            rows = conn.execute(
+                """
+                SELECT task_id FROM tasks
+                WHERE last_used_at < ? AND status IN ('pending', 'queued', 'processing')
+                ORDER BY last_used_at LIMIT ?
+                """,
+                (before, limit)
+            ).fetchall()
+        return [row["task_id"] for row in rows]
+
+    async def delete_tasks(self, task_ids: list[str]) -> list[str]:
+        deleted = []
+        with database.get_db() as conn:
+            for task_id in task_ids:
+                cursor = conn.execute(
+                    "DELETE FROM tasks WHERE task_id = ? AND status NOT IN ('pending', 'queued', 'processing')",
+                    (task_id,)
+                )
+                if cursor.rowcount:
+                    deleted.append(task_id)
+            conn.commit()
+        return deleted
+
+    async def close(self):
+        database.close_db_connection()
+
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+
+class _Skip(Exception):
+    pass
+
+
+class RespConnection:
+    """
+    A minimal client for the Redis protocol (RESP2) over one connection,
+    which is all the task store needs. Commands are serialized; the
+    connection is reopened if it drops.
+    """
+
+    def __init__(self, host: str, port: int, db: int = 0, password: str | None = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self._reader = None
+        self._writer = None
+        self.lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip("AUTH", self.password)
+        if self.db:
+            await self._roundtrip("SELECT", self.db)
+
+    async def execute(self, *args):
+        async with self.lock:
+            return await self.execute_locked(*args)
+
+    async def execute_locked(self, *args):
+        """Runs a command while the caller holds `lock`, e.g. inside MULTI."""
+        if self._writer is None:
+            await self._connect()
+        try:
+            return await self._roundtrip(*args)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            raise
+
+    async def _roundtrip(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self):
+        line = await self._reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Task records in Redis, so that several server processes or hosts can share
+    them. Each task is a hash; a set per tool and status lists the tasks in
+    that status, and a sorted set per tool orders the queued ones by
+    (queued_at, task_id), which is what Redis does for equal scores. Two more
+    sorted sets order all tasks by `expires_at` and by `last_used_at`.
+    Status changes are made with WATCH/MULTI so that the indexes always agree
+    with the hashes.
+    """
+
+    def __init__(self, connection: RespConnection, prefix: str = "nexuskit:"):
+        self.connection = connection
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisTaskStore":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(RespConnection(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password))
+
+    def _task_key(self, task_id: str) -> str:
+        return f"{self.prefix}task:{task_id}"
+
+    def _status_key(self, tool_name: str, status: str) -> str:
+        return f"{self.prefix}status:{tool_name}:{status}"
+
+    def _queue_key(self, tool_name: str) -> str:
+        return f"{self.prefix}queue:{tool_name}"
+
+    def _time_key(self, field: str) -> str:
+        return f"{self.prefix}{field}"
+
+    @staticmethod
+    def _decode(values: list) -> dict:
+        task = dict.fromkeys(TASK_FIELDS)
+        for name, value in zip(values[::2], values[1::2]):
+            name, value = name.decode(), value.decode()
+            if name in _INT_FIELDS:
+                value = int(value)
+            elif name in _FLOAT_FIELDS:
+                value = float(value)
+            task[name] = value
+        return task
+
+    async def create_task(self, tool_name: str, expires_at: float) -> str:
+        task_id = str(uuid.uuid4())
+        now = time.time()
+        created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now))
+        async with self.connection.lock:
+            execute = self.connection.execute_locked
+            try:
+                await execute("MULTI")
+                await execute(
+                    "HSET", self._task_key(task_id),
+                    "task_id", task_id, "tool_name", tool_name, "status", "pending", "progress", 0, "created_at", created_at,
+                    "expires_at", expires_at, "last_used_at", now,
+                )
+                await execute("SADD", self._status_key(tool_name, "pending"), task_id)
+                await execute("ZADD", self._time_key("expires_at"), expires_at, task_id)
+                await execute("ZADD", self._time_key("last_used_at"), now, task_id)
+                await execute("EXEC")
+            except BaseException:
+                await self.connection.close()
+                raise
+        return task_id
+
+    async def get_task(self, task_id: str) -> dict | None:
+        values = await self.connection.execute("HGETALL", self._task_key(task_id))
+        return self._decode(values) if values else None
+
+    async def _change(self, task_id: str, fields: dict, expected: dict[str, tuple] | None = None) -> bool:
+        """
+        Applies `fields` to a task in one transaction, keeping the indexes in
+        step with its status. Retries if the task changes meanwhile.
+
+        Returns:
+            False if the task does not exist or, with `expected`, does not
+            have one of the values listed for each field there.
+        """
+        key = self._task_key(task_id)
+        while True:
+            async with self.connection.lock:
+                try:
+                    if await self._change_locked(key, task_id, fields, expected or {}) is not None:
+                        return True
+                except _Skip:
+                    return False
+                except BaseException:
+                    # A half-sent transaction leaves the connection in an
+                    # unknown state; start over with a new one.
+                    await self.connection.close()
+                    raise
+
+    async def _change_locked(self, key: str, task_id: str, fields: dict, expected: dict[str, tuple]):
+        execute = self.connection.execute_locked
+        await execute("WATCH", key)
+        current = await execute("HMGET", key, "tool_name", "status", "queued_at", *expected)
+        tool_name, old_status, queued_at, *values = [value.decode() if value is not None else None for value in current]
+        matches = all(
+            value in [str(option) if option is not None else None for option in allowed]
+            for value, allowed in zip(values, expected.values())
+        )
+        if tool_name is None or not matches:
+            await execute("UNWATCH")
+            raise _Skip()
+        await execute("MULTI")
+        to_set = [item for name, value in fields.items() if value is not None for item in (name, value)]
+        to_clear = [name for name, value in fields.items() if value is None]
+        if to_set:
+            await execute("HSET", key, *to_set)
+        if to_clear:
+            await execute("HDEL", key, *to_clear)
+        new_status = fields.get("status", old_status)
+        if new_status != old_status:
+            await execute("SREM", self._status_key(tool_name, old_status), task_id)
+            await execute("SADD", self._status_key(tool_name, new_status), task_id)
+        if new_status == "queued":
+            await execute("ZADD", self._queue_key(tool_name), fields.get("queued_at", queued_at) or 0, task_id)
+        elif old_status == "queued":
+            await execute("ZREM", self._queue_key(tool_name), task_id)
+        for field in ("expires_at", "last_used_at"):
+            if field in fields:
+                if fields[field] is None:
+                    await execute("ZREM", self._time_key(field), task_id)
+                else:
+                    await execute("ZADD", self._time_key(field), fields[field], task_id)
+        # None if the task changed since WATCH.
+        return await execute("EXEC")
+
+    async def update_task(self, task_id: str, fields: dict):
+        _check_fields(fields)
+        await self._change(task_id, fields)
+
+    async def update_task_if(self, task_id: str, expected: dict[str, tuple], fields: dict) -> bool:
+        _check_fields(fields)
+        _check_fields(expected)
+        return await self._change(task_id, fields, expected)
+
+    async def write_progress(self, progress: dict[str, dict]):
+        now = time.time()
+        for task_id, fields in progress.items():
+            values = {name: fields.get(name) for name in PROGRESS_FIELDS}
+            await self._change(task_id, dict(values, status="processing", last_used_at=now), {"status": ACTIVE_STATUSES})
+
+    async def get_tasks(self, tool_name: str, status: str) -> list[dict]:
+        if status == "queued":
+            members = await self.connection.execute("ZRANGE", self._queue_key(tool_name), 0, -1)
+        else:
+            members = await self.connection.execute("SMEMBERS", self._status_key(tool_name, status))
+        tasks = []
+        for member in members:
+            task = await self.get_task(member.decode())
+            if task is not None and task["status"] == status:
+                tasks.append(task)
+        tasks.sort(key=lambda task: (task["queued_at"] or 0, task["task_id"]))
+        return tasks
+
+    async def queue_position(self, task: dict) -> int:
+        rank = await self.connection.execute("ZRANK", self._queue_key(task["tool_name"]), task["task_id"])
+        return 0 if rank is None else rank + 1
+
+    async def get_expiry_times(self) -> list[tuple[float, str]]:
+        reply = await self.connection.execute("ZRANGE", self._time_key("expires_at"), 0, -1, "WITHSCORES")
+        return [(float(score), member.decode()) for member, score in zip(reply[::2], reply[1::2])]
+
+    async def _by_activity(self, members: list[bytes], active: bool) -> list[str]:
+        # The tasks that are (or, with `active` False, are no longer) in one
+        # of `ACTIVE_STATUSES`. Index entries whose hash is gone count as
+        # inactive, so that `delete_tasks` drops them.
+        task_ids = []
+        for member in members:
+            status = (await self.connection.execute("HMGET", self._task_key(member.decode()), "status"))[0]
+            is_active = status is not None and status.decode() in ACTIVE_STATUSES
+            if is_active == active:
+                task_ids.append(member.decode())
+        return task_ids
+
+    async def get_expired(self, now: float, limit: int) -> list[str]:
+        task_ids = []
+        offset = 0
+        while len(task_ids) < limit:
+            members = await self.connection.execute(
+                "ZRANGEBYSCORE", self._time_key("expires_at"), "-inf", now, "LIMIT", offset, limit
+            )
+            if not members:
+                break
+            offset += len(members)
+            task_ids.extend(await self._by_activity(members, active=False))
+        return task_ids[:limit]
+
+    async def get_least_recently_used(self, limit: int) -> list[str]:
+        task_ids = []
+        offset = 0
+        while len(task_ids) < limit:
+            members = await self.connection.execute("ZRANGE", self._time_key("last_used_at"), offset, offset + limit - 1)
+            if not members:
+                break
+            offset += len(members)
+            task_ids.extend(await self._by_activity(members, active=False))
+        return task_ids[:limit]
+
+    async def get_stale(self, before: float, limit: int) -> list[str]:
+        task_ids = []
+        offset = 0
+        while len(task_ids) < limit:
+            members = await self.connection.execute(
+                "ZRANGEBYSCORE", self._time_key("last_used_at"), "-inf", f"({before}", "LIMIT", offset, limit
+            )
+            if not members:
+                break
+            offset += len(members)
+            task_ids.extend(await self._by_activity(members, active=True))
+        return task_ids[:limit]
+
+    async def delete_tasks(self, task_ids: list[str]) -> list[str]:
+        deleted = []
+        for task_id in task_ids:
+            key = self._task_key(task_id)
+            while True:
+                async with self.connection.lock:
+                    try:
+                        outcome = await self._delete_locked(key, task_id)
+                    except BaseException:
+                        await self.connection.close()
+                        raise
+                # None if the task changed since WATCH.
+                if outcome is not None:
+                    break
+            if outcome:
+                deleted.append(task_id)
+        return deleted
+
+    async def _delete_locked(self, key: str, task_id: str) -> bool | None:
+        execute = self.connection.execute_locked
+        await execute("WATCH", key)
+        tool_name, status = await execute("HMGET", key, "tool_name", "status")
+        if status is not None and status.decode() in ACTIVE_STATUSES:
+            await execute("UNWATCH")
+            return False
+        await execute("MULTI")
+        await execute("DEL", key)
+        if tool_name is not None:
+            tool_name = tool_name.decode()
+            await execute("SREM", self._status_key(tool_name, status.decode()), task_id)
+            await execute("ZREM", self._queue_key(tool_name), task_id)
+        # Index entries whose hash is already gone are dropped as well.
+        await execute("ZREM", self._time_key("expires_at"), task_id)
+        await execute("ZREM", self._time_key("last_used_at"), task_id)
+        if await execute("EXEC") is None:
+            return None
+        return tool_name is not None
+
+    async def close(self):
+        await self.connection.close()
+
+
+def create_store(url: str) -> TaskStore:
+    """Builds the store for `config.TASK_STORE_URL`: "sqlite" or a redis:// URL."""
+    if url == "sqlite":
+        return SQLiteTaskStore()
+    if url.startswith("redis://"):
+        return RedisTaskStore.from_url(url)
+    raise ValueError(f"Unsupported task store '{url}'")
+
+
+class StoreThread:
+    """
+    Runs a `TaskStore` on an event loop of its own, in a daemon thread, so
+    that it can be used both from the server's event loop (`acall`) and from
+    worker threads and processes (`call`) without blocking either on I/O.
+    """
+
+    def __init__(self, store: TaskStore):
+        self.store = store
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="task-store", daemon=True)
+        self._thread.start()
+
+    def call(self, coro):
+        """Runs a store coroutine and waits for its result. Not for use on an event loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def acall(self, coro):
+        """Runs a store coroutine from another event loop without blocking it."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def stop(self):
+        self.call(self.store.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+_store_thread = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> StoreThread:
+    """Returns this process's task store, starting it on first use."""
+    global _store_thread
+    with _store_lock:
+        if _store_thread is None:
+            _store_thread = StoreThread(create_store(config.TASK_STORE_URL))
+        return _store_thread
+
+
+def shutdown():
+    global _store_thread
+    with _store_lock:
+        if _store_thread is not None:
+            _store_thread.stop()
+            _store_thread = None
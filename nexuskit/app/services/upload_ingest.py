@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import os
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the size limit of the tool receiving it."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes // (1024 * 1024)} MB.")
+        self.max_bytes = max_bytes
+
+
+def _copy_and_hash(source, destination_path: str, max_bytes: int) -> tuple[int, str]:
+    hasher = hashlib.sha256()
+    size = 0
+    source.seek(0)
+    try:
+        with open(destination_path, "wb") as destination:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                hasher.update(chunk)
+                destination.write(chunk)
+    except BaseException:
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        raise
+    return size, hasher.hexdigest()
+
+
+async def ingest_upload(file, task_dir: str, max_bytes: int, filename: str | None = None) -> dict:
+    """
+    Streams an `UploadFile` into `task_dir` in fixed-size chunks, computing its
+    SHA-256 digest and size on the way. The copy runs in a worker thread so
+    large uploads never block the event loop, and only one chunk is held in
+    memory at a time.
+
+    Args:
+        file: The uploaded file.
+        task_dir: The directory to write the file to.
+        max_bytes: The size limit for this tool.
+        filename: The name to store the file under; defaults to the uploaded
+            file's own name.
+
+    Returns:
+        A dictionary with the stored file's `path`, `filename`, `size` and `sha256`.
+
+    Raises:
+        UploadTooLargeError: If the upload is larger than `max_bytes`. Nothing
+            is left on disk in that case.
+    """
+    # Starlette records the size while spooling the request body, which lets
+    # oversized uploads be rejected before any copying; the running count in
+    # _copy_and_hash covers UploadFiles built without it.
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+
+    filename = os.path.basename(filename or file.filename or "upload")
+    path = os.path.join(task_dir, filename)
+    size, sha256 = await asyncio.to_thread(_copy_and_hash, file.file, path, max_bytes)
+    return {"path": path, "filename": filename, "size": size, "sha256": sha256}
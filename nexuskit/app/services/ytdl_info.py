@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import urllib.parse
+import yt_dlp
+from ..core import config
+
+logger = logging.getLogger(__name__)
+
+_INFO_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+}
+
+# Query parameters that only track where a link was shared from.
+_TRACKING_PARAMS = ("fbclid", "gclid", "igshid", "si")
+_YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Reduces the ways of writing one video's URL to a single form, to be used
+    as its cache key: lower-case scheme and host, no default port, fragment or
+    tracking parameters, sorted query, and youtu.be and mobile YouTube links
+    rewritten to youtube.com/watch.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path
+    query = [
+        (key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in _TRACKING_PARAMS
+    ]
+    if host == "youtu.be" and path.strip("/"):
+        host, path = "youtube.com", "/watch"
+        query = [("v", parts.path.strip("/"))] + [(key, value) for key, value in query if key == "list"]
+    elif host in _YOUTUBE_HOSTS:
+        host = "youtube.com"
+        if path == "/watch":
+            query = [(key, value) for key, value in query if key in ("v", "list")]
+    return urllib.parse.urlunsplit((scheme, host, path, urllib.parse.urlencode(sorted(query)), ""))
+
+
+class InfoCache:
+    """
+    Thread-safe cache of extracted metadata with a time-to-live and
+    least-recently-used eviction beyond `max_entries`. Loads are single-flight:
+    while a key is being extracted, further requests for it wait for that
+    extraction instead of starting their own. Failures are not cached.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict[str, tuple[float, dict]] = collections.OrderedDict()
+        self._loading: dict[str, concurrent.futures.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: str, load, executor: concurrent.futures.Executor) -> concurrent.futures.Future:
+        """
+        Returns a future for the value of `key`: already resolved on a hit,
+        otherwise the pending extraction, started on `executor` if there is
+        none yet.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    future = concurrent.futures.Future()
+                    future.set_result(value)
+                    return future
+                del self._entries[key]
+            future = self._loading.get(key)
+            if future is not None:
+                self.hits += 1
+                return future
+            self.misses += 1
+            future = executor.submit(load)
+            self._loading[key] = future
+        future.add_done_callback(lambda f: self._loaded(key, f))
+        return future
+
+    def _loaded(self, key: str, future: concurrent.futures.Future):
+        with self._lock:
+            self._loading.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, future.result())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "loading": len(self._loading),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+cache = InfoCache(config.YTDL_INFO_CACHE_TTL, config.YTDL_INFO_CACHE_MAX_ENTRIES)
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.YTDL_INFO_WORKERS,
+                thread_name_prefix="ytdl-info",
+            )
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _get_ydl(flat: bool) -> yt_dlp.YoutubeDL:
+    # Building a YoutubeDL sets up its extractors, cookie jar and HTTP
+    # handlers; each extraction thread keeps and reuses its own.
+    attribute = "flat_ydl" if flat else "ydl"
+    ydl = getattr(_local, attribute, None)
+    if ydl is None:
+        options = dict(_INFO_OPTIONS, extract_flat='in_playlist') if flat else _INFO_OPTIONS
+        ydl = yt_dlp.YoutubeDL(options)
+        setattr(_local, attribute, ydl)
+    return ydl
+
+
+def _summarize(info: dict) -> dict:
+    formats = [
+        {'format_id': f['format_id'], 'ext': f['ext'], 'resolution': f.get('resolution') or f.get('acodec')}
+        for f in info.get('formats') or []
+    ]
+    return {
+        'title': info.get('title', 'No title'),
+        'thumbnail': info.get('thumbnail') or '',
+        'formats': formats,
+    }
+
+
+def _extract_video(url: str) -> dict:
+    started = time.perf_counter()
+    info = _get_ydl(flat=False).extract_info(url, download=False)
+    logger.info(f"Extracted info for {url} in {time.perf_counter() - started:.2f} s")
+    return _summarize(info)
+
+
+def _extract_playlist(url: str) -> dict:
+    # Only lists the entries; each one is then resolved, and cached, on its own.
+    info = _get_ydl(flat=True).extract_info(url, download=False)
+    if info.get('_type') != 'playlist':
+        return {'title': info.get('title', 'No title'), 'urls': [url], 'video': _summarize(info)}
+    # An entry's `url` is its own page or media link; videos embedded in a
+    # page have that page as their `webpage_url`.
+    urls = [entry.get('url') or entry.get('webpage_url') for entry in info.get('entries') or [] if entry]
+    return {'title': info.get('title', 'No title'), 'urls': [url for url in urls if url]}
+
+
+async def _await(future: concurrent.futures.Future) -> dict:
+    # Shielded so a disconnecting client does not cancel an extraction that
+    # other requests may be waiting for.
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+async def fetch_video_info(url: str) -> dict:
+    """
+    Fetches video information without downloading, from the cache when the
+    same video was looked up within `config.YTDL_INFO_CACHE_TTL` seconds.
+
+    Returns:
+        A dictionary with the video's title, thumbnail and formats.
+
+    Raises:
+        yt_dlp.utils.DownloadError: If the URL cannot be extracted.
+    """
+    return await _await(cache.get_or_load(normalize_url(url), lambda: _extract_video(url), _get_executor()))
+
+
+async def fetch_many(urls: list[str]) -> list[dict]:
+    """
+    Fetches the information of several videos concurrently on the extraction
+    thread pool. Duplicate URLs are extracted once.
+
+    Returns:
+        One `{"url", "info", "error"}` dictionary per URL, in order, with
+        either `info` or `error` set.
+    """
+    async def fetch(url):
+        try:
+            return {"url": url, "info": await fetch_video_info(url), "error": None}
+        except yt_dlp.utils.DownloadError as e:
+            return {"url": url, "info": None, "error": str(e)}
+
+    return list(await asyncio.gather(*(fetch(url) for url in urls)))
+
+
+async def fetch_playlist(url: str, limit: int) -> dict:
+    """
+    Lists a playlist and fetches the information of its first `limit` videos
+    concurrently. A URL that is not a playlist is treated as a playlist of one.
+
+    Returns:
+        A dictionary with the playlist's `title`, its total number of
+        `entries`, and the `items` as returned by `fetch_many`.
+
+    Raises:
+        yt_dlp.utils.DownloadError: If the playlist cannot be extracted.
+    """
+    key = "playlist:" + normalize_url(url)
+    playlist = await _await(cache.get_or_load(key, lambda: _extract_playlist(url), _get_executor()))
+    if 'video' in playlist:
+        items = [{"url": url, "info": playlist['video'], "error": None}]
+    else:
+        items = await fetch_many(playlist['urls'][:limit])
+    return {"title": playlist['title'], "entries": len(playlist['urls']), "items": items}
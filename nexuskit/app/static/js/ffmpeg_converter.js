@@ -114,7 +114,11 @@ function ffmpegConverter() {
 
         eventSource.onmessage = (event) => {
             const data = JSON.parse(event.data);
-            statusMessages.innerHTML = `<div class="alert alert-info">${data.status}: ${data.progress}%</div>`;
+            if (data.status === 'queued') {
+                statusMessages.innerHTML = `<div class="alert alert-info">queued: position ${data.queue_position}</div>`;
+            } else {
+                statusMessages.innerHTML = `<div class="alert alert-info">${data.status}: ${data.progress}%</div>`;
+            }
 
             if (data.status === 'completed') {
                 eventSource.close();
@@ -122,6 +126,9 @@ function ffmpegConverter() {
             } else if (data.status === 'failed') {
                 eventSource.close();
                 statusMessages.innerHTML = `<div class="alert alert-danger">Conversion failed: ${data.error_message}</div>`;
+            } else if (data.status === 'cancelled') {
+                eventSource.close();
+                statusMessages.innerHTML = `<div class="alert alert-warning">Conversion cancelled.</div>`;
             }
         };
 
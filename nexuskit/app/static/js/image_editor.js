@@ -65,6 +65,10 @@ function imageEditor() {
         async undo() {
             return await this.editor.undoEdit();
         }
+
+        async redo() {
+            return await this.editor.redoEdit();
+        }
     }
 
     class ImageEditorManager {
@@ -72,11 +76,23 @@ function imageEditor() {
             this.undoStack = [];
             this.redoStack = [];
             this.currentImageUrl = null;
+            this.currentExportUrl = null;
+            // Full-resolution size; the editor shows a downscaled proxy of large images.
+            this.imageWidth = 0;
+            this.imageHeight = 0;
             this.mainImage = document.getElementById('main-image');
             this.statusMessages = document.getElementById('status-messages');
             this.currentTaskId = null;
         }
 
+        showVersion(data) {
+            this.currentImageUrl = data.image_url;
+            this.currentExportUrl = data.export_url;
+            this.imageWidth = data.width;
+            this.imageHeight = data.height;
+            this.mainImage.src = this.currentImageUrl; // Every version has its own URL
+        }
+
         updateUIButtons() {
             undoBtn.disabled = this.undoStack.length === 0;
             redoBtn.disabled = this.redoStack.length === 0;
@@ -109,7 +125,7 @@ function imageEditor() {
         async redo() {
             if (this.redoStack.length > 0) {
                 const command = this.redoStack.pop();
-                const newImageUrl = await command.execute();
+                const newImageUrl = await command.redo();
                 if(newImageUrl) {
                     this.undoStack.push(command);
                     this.updateUIButtons();
@@ -132,8 +148,7 @@ function imageEditor() {
                     params: params
                 });
 
-                this.currentImageUrl = data.image_url;
-                this.mainImage.src = this.currentImageUrl + '?t=' + new Date().getTime(); // Bust cache
+                this.showVersion(data);
                 this.statusMessages.innerHTML = '<div class="alert alert-success">Edit applied successfully.</div>';
                 return this.currentImageUrl;
 
@@ -154,8 +169,7 @@ function imageEditor() {
             try {
                 const data = await api.post('/api/v1/image/undo', { task_id: this.currentTaskId });
 
-                this.currentImageUrl = data.image_url;
-                this.mainImage.src = this.currentImageUrl + '?t=' + new Date().getTime(); // Bust cache
+                this.showVersion(data);
                 this.statusMessages.innerHTML = '<div class="alert alert-success">Undo successful.</div>';
                 return this.currentImageUrl;
 
@@ -164,6 +178,27 @@ function imageEditor() {
                 return null;
             }
         }
+
+        async redoEdit() {
+            if (!this.currentTaskId) {
+                this.statusMessages.innerHTML = '<div class="alert alert-danger">Please upload an image first.</div>';
+                return null;
+            }
+
+            this.statusMessages.innerHTML = `<div class="alert alert-info">Redoing last edit...</div>`;
+
+            try {
+                const data = await api.post('/api/v1/image/redo', { task_id: this.currentTaskId });
+
+                this.showVersion(data);
+                this.statusMessages.innerHTML = '<div class="alert alert-success">Redo successful.</div>';
+                return this.currentImageUrl;
+
+            } catch (error) {
+                this.statusMessages.innerHTML = `<div class="alert alert-danger">${error.message}</div>`;
+                return null;
+            }
+        }
     }
 
     const editorManager = new ImageEditorManager();
@@ -183,8 +218,7 @@ function imageEditor() {
         try {
             const data = await api.upload('/api/v1/image/upload', formData);
             editorManager.currentTaskId = data.task_id;
-            editorManager.currentImageUrl = data.image_url;
-            mainImage.src = editorManager.currentImageUrl;
+            editorManager.showVersion(data);
             imageEditorArea.style.display = 'block';
             statusMessages.innerHTML = '';
             editorManager.undoStack = [];
@@ -212,8 +246,9 @@ function imageEditor() {
             isCropping = false;
             cropOverlay.style.display = 'none';
 
-            const imgWidth = mainImage.naturalWidth;
-            const imgHeight = mainImage.naturalHeight;
+            // Crop coordinates are sent in full-resolution pixels.
+            const imgWidth = editorManager.imageWidth;
+            const imgHeight = editorManager.imageHeight;
             const displayWidth = mainImage.clientWidth;
             const displayHeight = mainImage.clientHeight;
 
@@ -299,28 +334,28 @@ function imageEditor() {
 
     // Resize Tool
     resizeToolBtn.addEventListener('click', () => {
-        resizeWidthInput.value = mainImage.naturalWidth;
-        resizeHeightInput.value = mainImage.naturalHeight;
+        resizeWidthInput.value = editorManager.imageWidth;
+        resizeHeightInput.value = editorManager.imageHeight;
         resizeModal.show();
     });
 
     maintainAspectRatioCheckbox.addEventListener('change', () => {
         if (maintainAspectRatioCheckbox.checked) {
-            const aspectRatio = mainImage.naturalWidth / mainImage.naturalHeight;
+            const aspectRatio = editorManager.imageWidth / editorManager.imageHeight;
             resizeHeightInput.value = Math.round(resizeWidthInput.value / aspectRatio);
         }
     });
 
     resizeWidthInput.addEventListener('input', () => {
         if (maintainAspectRatioCheckbox.checked) {
-            const aspectRatio = mainImage.naturalWidth / mainImage.naturalHeight;
+            const aspectRatio = editorManager.imageWidth / editorManager.imageHeight;
             resizeHeightInput.value = Math.round(resizeWidthInput.value / aspectRatio);
         }
     });
 
     resizeHeightInput.addEventListener('input', () => {
         if (maintainAspectRatioCheckbox.checked) {
-            const aspectRatio = mainImage.naturalWidth / mainImage.naturalHeight;
+            const aspectRatio = editorManager.imageWidth / editorManager.imageHeight;
             resizeWidthInput.value = Math.round(resizeHeightInput.value * aspectRatio);
         }
     });
@@ -381,9 +416,9 @@ function imageEditor() {
     });
 
     downloadImageBtn.addEventListener('click', () => {
-        if (editorManager.currentImageUrl) {
+        if (editorManager.currentExportUrl) {
             const link = document.createElement('a');
-            link.href = editorManager.currentImageUrl;
+            link.href = editorManager.currentExportUrl;
             link.download = 'edited_image.png'; // Or derive from original filename
             document.body.appendChild(link);
             link.click();
@@ -86,22 +86,18 @@ function pdfEditor() {
         formData.append('level', compressionLevel.value);
 
         try {
-            const response = await fetch('/api/pdf/compress', {
+            const response = await fetch('/api/v1/pdf/compress', {
                 method: 'POST',
                 body: formData
             });
 
             if (response.ok) {
-                const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.style.display = 'none';
-                a.href = url;
-                a.download = 'compressed.pdf';
-                document.body.appendChild(a);
-                a.click();
-                window.URL.revokeObjectURL(url);
-                compressStatusMessages.innerHTML = '<div class="alert alert-success">PDF compressed successfully.</div>';
+                const data = await response.json();
+                if (data.status === 'completed') {
+                    showCompressedDownload(data.task_id);
+                } else {
+                    listenForCompression(data.task_id);
+                }
             } else {
                 const error = await response.json();
                 compressStatusMessages.innerHTML = `<div class="alert alert-danger">${error.detail}</div>`;
@@ -110,4 +106,33 @@ function pdfEditor() {
             compressStatusMessages.innerHTML = `<div class="alert alert-danger">An error occurred while compressing the PDF.</div>`;
         }
     });
+
+    function showCompressedDownload(taskId) {
+        compressStatusMessages.innerHTML = `<div class="alert alert-success">PDF compressed successfully. <a href="/api/v1/pdf/${taskId}/download" download>Click here to download</a></div>`;
+    }
+
+    function listenForCompression(taskId) {
+        const eventSource = new EventSource(`/api/v1/pdf/tasks/${taskId}/stream`);
+
+        eventSource.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.status === 'completed') {
+                eventSource.close();
+                showCompressedDownload(taskId);
+            } else if (data.status === 'failed') {
+                eventSource.close();
+                compressStatusMessages.innerHTML = `<div class="alert alert-danger">${data.error_message}</div>`;
+            } else if (data.status === 'processing') {
+                compressStatusMessages.innerHTML = `<div class="alert alert-info">Compressing PDF... ${data.progress}%</div>`;
+            } else {
+                compressStatusMessages.innerHTML = '<div class="alert alert-info">Waiting for a free compression slot...</div>';
+            }
+        };
+
+        eventSource.onerror = (err) => {
+            console.error("EventSource failed:", err);
+            eventSource.close();
+            compressStatusMessages.innerHTML = `<div class="alert alert-danger">Error receiving updates.</div>`;
+        };
+    }
 }
@@ -76,7 +76,18 @@ function ytdl() {
 
         eventSource.onmessage = (event) => {
             const data = JSON.parse(event.data);
-            statusMessages.innerHTML = `<div class="alert alert-info">${data.status}: ${data.progress}%</div>`;
+            if (data.status === 'queued') {
+                statusMessages.innerHTML = `<div class="alert alert-info">queued: position ${data.queue_position}</div>`;
+            } else {
+                let details = '';
+                if (data.speed) {
+                    details += ` at ${(data.speed / 1024 / 1024).toFixed(1)} MB/s`;
+                }
+                if (data.eta) {
+                    details += `, ${data.eta} s left`;
+                }
+                statusMessages.innerHTML = `<div class="alert alert-info">${data.status}: ${data.progress}%${details}</div>`;
+            }
 
             if (data.status === 'completed') {
                 eventSource.close();
@@ -84,6 +95,9 @@ function ytdl() {
             } else if (data.status === 'failed') {
                 eventSource.close();
                 statusMessages.innerHTML = `<div class="alert alert-danger">Download failed: ${data.error_message}</div>`;
+            } else if (data.status === 'cancelled') {
+                eventSource.close();
+                statusMessages.innerHTML = `<div class="alert alert-warning">Download cancelled.</div>`;
             }
         };
 
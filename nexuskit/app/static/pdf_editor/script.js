@@ -120,6 +120,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 const img = document.createElement('img');
                 img.src = pageUrl;
+                img.loading = 'lazy';
                 img.classList.add('img-fluid');
                 img.addEventListener('click', () => {
                     pageView.src = pageUrl;
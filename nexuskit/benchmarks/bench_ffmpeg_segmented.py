@@ -0,0 +1,82 @@
+"""
+Compares single-process and segmented transcoding of a generated test video.
+The input is synthesized with ffmpeg's lavfi `testsrc`/`sine` sources, so the
+benchmark runs offline; ffmpeg and ffprobe must be on PATH.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_ffmpeg_segmented --duration 120 --size 1280x720
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import database  # noqa: E402
+from app.core import config  # noqa: E402
+from app.services import task_service, service_ffmpeg  # noqa: E402
+
+
+def generate_input(path, duration, size):
+    subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc=size={size}:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=440",
+            "-t", str(duration),
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", "60",
+            "-c:a", "aac",
+            path,
+        ],
+        check=True,
+    )
+
+
+def convert(input_path, segmented, threads, preset):
+    task_id = task_service.create_task(tool_name='ffmpeg')
+    started = time.perf_counter()
+    service_ffmpeg.run_ffmpeg_conversion(
+        task_id, input_path, "mp4", False, None, "Medium", None,
+        threads=threads, preset=preset, segmented=segmented,
+    )
+    elapsed = time.perf_counter() - started
+    task = task_service.get_task_status(task_id)
+    if task['status'] != 'completed':
+        raise RuntimeError(task['error_message'])
+    return elapsed, task['result_path']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=120, help="seconds of test video")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 2, help="thread budget per job")
+    parser.add_argument("--workers", type=int, default=config.FFMPEG_SEGMENT_WORKERS, help="concurrent segments")
+    parser.add_argument("--preset", default="veryfast")
+    args = parser.parse_args()
+
+    config.FFMPEG_SEGMENT_WORKERS = args.workers
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_FILE = os.path.join(tmp, "bench.db")
+        database.init_db()
+        input_path = os.path.join(tmp, "input.mkv")
+        generate_input(input_path, args.duration, args.size)
+
+        single, single_output = convert(input_path, False, args.threads, args.preset)
+        single_duration = service_ffmpeg._probe_duration(service_ffmpeg.probe_media(single_output))
+        os.rename(single_output, single_output + ".single")
+        segmented, segmented_output = convert(input_path, True, args.threads, args.preset)
+        segmented_duration = service_ffmpeg._probe_duration(service_ffmpeg.probe_media(segmented_output))
+
+        print(f"input: {args.duration} s of {args.size}, {args.threads} threads, preset {args.preset}")
+        print(f"   single process: {single:7.2f} s (output {single_duration:.2f} s)")
+        print(f"segmented (x{args.workers}): {segmented:7.2f} s (output {segmented_duration:.2f} s), "
+              f"speed-up {single / segmented:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the operations in `image_ops` with the naive equivalent made of
+chained Pillow calls (one `ImageEnhance` or `point` pass per adjustment), per
+operation and for a chain of point operations that `image_ops` fuses into a
+single lookup-table pass.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_image_ops --width 4000 --height 3000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import image_ops  # noqa: E402
+
+
+def pil_gamma(img, gamma):
+    return img.point([round(255 * (i / 255) ** (1 / gamma)) for i in range(256)] * len(img.getbands()))
+
+
+def pil_levels(img, black, white):
+    return img.point([round(min(max((i - black) / (white - black), 0), 1) * 255) for i in range(256)] * len(img.getbands()))
+
+
+def pil_sepia(img):
+    return img.convert("RGB", (
+        0.393, 0.769, 0.189, 0,
+        0.349, 0.686, 0.168, 0,
+        0.272, 0.534, 0.131, 0,
+    ))
+
+
+CASES = [
+    ("brightness", lambda img: ImageEnhance.Brightness(img).enhance(1.2), [("brightness", {"factor": 1.2})]),
+    ("contrast", lambda img: ImageEnhance.Contrast(img).enhance(1.3), [("contrast", {"factor": 1.3})]),
+    ("saturation", lambda img: ImageEnhance.Color(img).enhance(1.5), [("saturation", {"factor": 1.5})]),
+    ("gamma", lambda img: pil_gamma(img, 0.8), [("gamma", {"gamma": 0.8})]),
+    ("levels", lambda img: pil_levels(img, 10, 240), [("levels", {"black": 10, "white": 240})]),
+    ("invert", ImageOps.invert, [("invert", {})]),
+    ("sepia", pil_sepia, [("sepia", {})]),
+    ("blur", lambda img: img.filter(ImageFilter.GaussianBlur(4)), [("blur", {"radius": 4})]),
+    ("rotate 90", lambda img: img.transpose(Image.Transpose.ROTATE_90), [("rotate_90_left", {})]),
+    ("point chain (5 ops)",
+     lambda img: ImageOps.invert(pil_levels(pil_gamma(ImageEnhance.Contrast(ImageEnhance.Brightness(img).enhance(1.2)).enhance(1.3), 0.8), 10, 240)),
+     [("brightness", {"factor": 1.2}), ("contrast", {"factor": 1.3}), ("gamma", {"gamma": 0.8}),
+      ("levels", {"black": 10, "white": 240}), ("invert", {})]),
+]
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # A smooth gradient with some noise, so that no operation hits a trivial case.
+    y, x = np.mgrid[0:args.height, 0:args.width]
+    pixels = np.stack([x * 255 // args.width, y * 255 // args.height, (x + y) * 255 // (args.width + args.height)], axis=2)
+    pixels = np.clip(pixels + np.random.default_rng(0).integers(-20, 20, pixels.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels, "RGB")
+    megapixels = args.width * args.height / 1e6
+    print(f"{args.width}x{args.height} RGB, best of {args.repeat}")
+
+    for name, naive, operations in CASES:
+        pil_time = best_of(lambda: naive(img), args.repeat)
+        ops_time = best_of(lambda: image_ops.apply_operations(img, operations), args.repeat)
+        print(f"{name:>20}: Pillow {megapixels / pil_time:8.1f} MP/s, image_ops {megapixels / ops_time:8.1f} MP/s "
+              f"({pil_time / ops_time:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures what serving an edited version costs in each view format: encode
+time and bytes sent, at full proxy size and at a few `?w=` widths, with the
+settings used by `service_image_editor.get_view_variant`. Uses a synthetic
+photo-like image unless `--image` points to a real one.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_image_view_formats --image photo.jpg
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageFilter, features
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core import config  # noqa: E402
+from app.services import service_image_editor  # noqa: E402
+
+
+def synthetic_photo(width: int, height: int) -> Image.Image:
+    # Smooth gradients with fine grain and some edges, which compresses much
+    # like a photo, unlike pure noise.
+    red = Image.linear_gradient("L").resize((width, height))
+    green = Image.radial_gradient("L").resize((width, height))
+    blue = Image.linear_gradient("L").rotate(90).resize((width, height))
+    img = Image.merge("RGB", (red, green, blue))
+    grain = Image.effect_noise((width, height), 24).convert("RGB")
+    img = Image.blend(img, grain, 0.15)
+    edges = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 0.8, 1.2), 64).convert("RGB")
+    return Image.blend(img, edges, 0.3).filter(ImageFilter.SMOOTH)
+
+
+def encode(img: Image.Image, image_format: str, width: int | None) -> tuple[float, int]:
+    if width is not None:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    output = io.BytesIO()
+    pil_format = service_image_editor.VIEW_FORMATS[image_format][0]
+    started = time.perf_counter()
+    img.save(output, format=pil_format, **service_image_editor._VIEW_SAVE_ARGS[image_format])
+    return time.perf_counter() - started, output.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="an image to use instead of the synthetic one")
+    parser.add_argument("--widths", type=int, nargs="*", default=[640, 1280])
+    args = parser.parse_args()
+
+    if args.image:
+        with Image.open(args.image) as img:
+            img.thumbnail((config.IMAGE_PROXY_MAX_SIDE, config.IMAGE_PROXY_MAX_SIDE), reducing_gap=2.0)
+            img = img.convert("RGB")
+    else:
+        img = synthetic_photo(config.IMAGE_PROXY_MAX_SIDE, config.IMAGE_PROXY_MAX_SIDE * 2 // 3)
+    print(f"{img.width}x{img.height} proxy, quality {config.IMAGE_VIEW_QUALITY}")
+
+    formats = [f for f in service_image_editor.VIEW_FORMATS if f != "avif" or features.check("avif")]
+    for width in [None] + args.widths:
+        _, png_size = encode(img, "png", width)
+        label = "full" if width is None else f"w={width}"
+        for image_format in formats:
+            elapsed, size = encode(img, image_format, width)
+            print(f"{label:>7} {image_format:>5}: {size / 1024:9.1f} KiB ({size / png_size:6.1%} of PNG), encoded in {elapsed * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compares peak memory of the old in-memory PyPDF2 merge (every page in one
+PdfWriter, written to a BytesIO) with the spooled PyMuPDF merge in
+`service_pdf.merge_pdfs`, on generated image-heavy PDFs. Each mode runs in a
+fresh interpreter; peak RSS is reported for the server process and for the PDF
+worker processes it waited for.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_pdf_merge --files 50 --size-mb 20
+"""
+import argparse
+import asyncio
+import glob
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+from starlette.datastructures import UploadFile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import database  # noqa: E402
+from app.services import cleanup_service, pdf_rasterizer, service_pdf  # noqa: E402
+
+PAGES_PER_FILE = 5
+
+
+def make_inputs(directory: str, files: int, size_mb: int):
+    # Noise barely compresses: a maximum quality JPEG of it takes about two
+    # bytes per pixel.
+    side = int((size_mb * 1024 ** 2 / PAGES_PER_FILE / 2) ** 0.5)
+    logo = io.BytesIO()
+    Image.frombytes("RGB", (200, 200), os.urandom(200 * 200 * 3)).save(logo, "PNG")
+    for i in range(files):
+        doc = fitz.open()
+        for p in range(PAGES_PER_FILE):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Document {i + 1}, page {p + 1}", fontsize=20)
+            image = io.BytesIO()
+            Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(image, "JPEG", quality=100)
+            page.insert_image(fitz.Rect(72, 100, 520, 548), stream=image.getvalue())
+            page.insert_image(fitz.Rect(72, 600, 172, 700), stream=logo.getvalue())
+        doc.save(os.path.join(directory, f"input_{i:03d}.pdf"))
+        doc.close()
+
+
+def open_uploads(directory: str) -> list[UploadFile]:
+    return [UploadFile(open(path, "rb"), filename=os.path.basename(path)) for path in sorted(glob.glob(os.path.join(directory, "input_*.pdf")))]
+
+
+def legacy_merge(files) -> int:
+    writer = PdfWriter()
+    for file in files:
+        reader = PdfReader(file.file)
+        for page in reader.pages:
+            writer.add_page(page)
+    output = io.BytesIO()
+    writer.write(output)
+    output.seek(0)
+    return len(output.getvalue())
+
+
+async def streaming_merge(files) -> int:
+    _, merged_path = await service_pdf.merge_pdfs(files)
+    return os.path.getsize(merged_path)
+
+
+def run_mode(mode: str, directory: str):
+    database.DATABASE_FILE = os.path.join(directory, "bench.db")
+    database.init_db()
+    cleanup_service.TEMP_DIR = os.path.join(directory, "tasks")
+    os.makedirs(cleanup_service.TEMP_DIR, exist_ok=True)
+    files = open_uploads(directory)
+
+    started = time.perf_counter()
+    if mode == "legacy":
+        size = legacy_merge(files)
+    else:
+        size = asyncio.run(streaming_merge(files))
+    elapsed = time.perf_counter() - started
+
+    # Reap the workers so that their peak RSS is counted.
+    pdf_rasterizer.shutdown(wait=True)
+    server_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    worker_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"{mode:>9}: {elapsed:6.2f} s, output {size / 1024 ** 2:7.1f} MB, "
+          f"peak RSS server {server_peak:7.1f} MB, worker {worker_peak:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--run", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(args.run, args.dir)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_inputs(tmp, args.files, args.size_mb)
+        total = sum(os.path.getsize(path) for path in glob.glob(os.path.join(tmp, "input_*.pdf")))
+        print(f"{args.files} inputs, {total / 1024 ** 2:.1f} MB in total")
+        for mode in ("legacy", "streaming"):
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_pdf_merge", "--run", mode, "--dir", tmp], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Compares the old PyPDF2 page operations (each one re-parses the document,
+copies every page into a new writer and rewrites the file) with the single-pass
+PyMuPDF engine in `pdf_page_ops`, on a generated document.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_pdf_page_ops --pages 2000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+from PyPDF2 import PdfReader, PdfWriter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import pdf_page_ops  # noqa: E402
+
+
+def make_pdf(path: str, pages: int):
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Benchmark page {i + 1}", fontsize=28)
+        for line in range(30):
+            page.insert_text((72, 120 + line * 16), "The quick brown fox jumps over the lazy dog. " * 2, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def legacy_add_blank_page(pdf_path):
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+    writer.add_blank_page()
+    with open(pdf_path, "wb") as f:
+        writer.write(f)
+
+
+def legacy_delete_pages(pdf_path, pages_to_delete):
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for i in range(len(reader.pages)):
+        if i not in pages_to_delete:
+            writer.add_page(reader.pages[i])
+    with open(pdf_path, "wb") as f:
+        writer.write(f)
+
+
+def legacy_reorder_pages(pdf_path, page_order):
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for page_index in page_order:
+        writer.add_page(reader.pages[page_index])
+    with open(pdf_path, "wb") as f:
+        writer.write(f)
+
+
+def timed(fn, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.pdf")
+        make_pdf(source, args.pages)
+        work = os.path.join(tmp, "work.pdf")
+        print(f"{args.pages} pages, {os.path.getsize(source) / 1024 ** 2:.1f} MB")
+
+        to_delete = list(range(0, args.pages, 10))
+        remaining = args.pages - len(to_delete)
+        reversed_order = list(range(remaining - 1, -1, -1))
+        cases = [
+            ("add blank page", lambda p: legacy_add_blank_page(p), [{"op": "add_blank"}]),
+            ("delete 10% of pages", lambda p: legacy_delete_pages(p, to_delete), [{"op": "delete", "pages": to_delete}]),
+            ("reverse page order", lambda p: legacy_reorder_pages(p, list(range(args.pages - 1, -1, -1))),
+             [{"op": "reorder", "page_order": list(range(args.pages - 1, -1, -1))}]),
+            ("move one page", lambda p: legacy_reorder_pages(p, [args.pages - 1] + list(range(args.pages - 1))),
+             [{"op": "move", "page": args.pages - 1, "to": 0}]),
+        ]
+        for name, legacy, operations in cases:
+            shutil.copyfile(source, work)
+            legacy_time = timed(legacy, work)
+            shutil.copyfile(source, work)
+            engine_time = timed(pdf_page_ops.apply_page_operations, work, operations)
+            print(f"{name:>22}: PyPDF2 {legacy_time:7.3f} s, PyMuPDF {engine_time:7.3f} s ({legacy_time / engine_time:6.1f}x)")
+
+        # A whole editing session: three requests before, one batch now.
+        shutil.copyfile(source, work)
+        legacy_time = (timed(legacy_delete_pages, work, to_delete)
+                       + timed(legacy_reorder_pages, work, reversed_order)
+                       + timed(legacy_add_blank_page, work))
+        shutil.copyfile(source, work)
+        engine_time = timed(pdf_page_ops.apply_page_operations, work, [
+            {"op": "delete", "pages": to_delete},
+            {"op": "reorder", "page_order": reversed_order},
+            {"op": "add_blank"},
+        ])
+        print(f"{'batch of all three':>22}: PyPDF2 {legacy_time:7.3f} s, PyMuPDF {engine_time:7.3f} s ({legacy_time / engine_time:6.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
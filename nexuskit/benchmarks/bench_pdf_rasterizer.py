@@ -0,0 +1,84 @@
+"""
+Measures PDF rasterization throughput (pages/sec) against the number of worker
+processes, for each output format, on a generated document. The serial
+baseline renders every page in this process, like the old upload handler.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_pdf_rasterizer --pages 120 --workers 1 2 4 --dpi 72
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import pdf_rasterizer  # noqa: E402
+
+
+def make_pdf(path: str, pages: int):
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Benchmark page {i + 1}", fontsize=28)
+        for line in range(40):
+            page.insert_text((72, 120 + line * 16), "The quick brown fox jumps over the lazy dog. " * 2, fontsize=9)
+        page.draw_rect(fitz.Rect(72, 760, 300, 800), color=(0.2, 0.4, 0.8), fill=(0.8, 0.9, 1.0))
+    doc.save(path)
+    doc.close()
+
+
+def run_serial(path: str, pages: int, dpi: int, image_format: str, quality: int) -> float:
+    started = time.perf_counter()
+    with fitz.open(path) as doc:
+        for index in range(pages):
+            pdf_rasterizer.render_page(doc[index], dpi, image_format, quality)
+    return time.perf_counter() - started
+
+
+async def run_parallel(path: str, pages: int, dpi: int, image_format: str, quality: int, executor, workers: int) -> float:
+    started = time.perf_counter()
+    rendered = 0
+    async for _ in pdf_rasterizer.render_pages(path, list(range(pages)), dpi, image_format, quality, executor=executor, workers=workers):
+        rendered += 1
+    assert rendered == pages
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--dpi", type=int, default=72)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--formats", nargs="+", default=list(pdf_rasterizer.MEDIA_TYPES))
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.pages} pages at {args.dpi} dpi")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        make_pdf(path, args.pages)
+
+        for image_format in args.formats:
+            elapsed = run_serial(path, args.pages, args.dpi, image_format, args.quality)
+            print(f"{image_format:>5} serial   : {args.pages / elapsed:8.1f} pages/s")
+            for workers in args.workers:
+                executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+                try:
+                    # Warm the pool up so process start-up is not measured.
+                    executor.submit(pow, 1, 1).result()
+                    elapsed = asyncio.run(run_parallel(path, args.pages, args.dpi, image_format, args.quality, executor, workers))
+                finally:
+                    executor.shutdown()
+                print(f"{image_format:>5} {workers:2d} worker{'s' if workers > 1 else ' '}: {args.pages / elapsed:8.1f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
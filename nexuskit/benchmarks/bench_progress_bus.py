@@ -0,0 +1,119 @@
+"""
+Compares the old 1-second SQLite polling loop used by the SSE progress streams
+with the push-based progress bus.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_progress_bus --subscribers 200 --updates 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import database  # noqa: E402
+from app.services import task_service, progress_bus  # noqa: E402
+
+
+class CountingLoader:
+    """Wraps task_service.get_task_status and counts the SQLite reads it makes."""
+
+    def __init__(self):
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, task_id):
+        with self._lock:
+            self.queries += 1
+        return task_service.get_task_status(task_id)
+
+
+def publisher(task_id, updates, interval, sent_at):
+    for progress in range(1, updates + 1):
+        sent_at[progress] = time.perf_counter()
+        task_service.update_task_progress(task_id, progress)
+        time.sleep(interval)
+    sent_at[100] = time.perf_counter()
+    task_service.complete_task(task_id, "/dev/null")
+
+
+async def polling_stream(task_id, load, poll_interval):
+    # Mirrors the previous stream_task_progress implementation.
+    last_progress = -1
+    while True:
+        task = await asyncio.to_thread(load, task_id)
+        if task:
+            if task['progress'] != last_progress:
+                yield task
+                last_progress = task['progress']
+            if task['status'] in ['completed', 'failed']:
+                break
+        await asyncio.sleep(poll_interval)
+
+
+async def consume(stream, sent_at, latencies):
+    async for event in stream:
+        task = json.loads(event["data"]) if "data" in event else event
+        sent = sent_at.get(task['progress'])
+        if sent is not None:
+            latencies.append(time.perf_counter() - sent)
+
+
+async def run(mode, subscribers, updates, interval, poll_interval):
+    task_id = task_service.create_task(tool_name='bench')
+    load = CountingLoader()
+    sent_at = {}
+    latencies = []
+
+    if mode == "polling":
+        streams = [polling_stream(task_id, load, poll_interval) for _ in range(subscribers)]
+    else:
+        streams = [progress_bus.task_event_stream(task_id, load) for _ in range(subscribers)]
+
+    consumers = [asyncio.create_task(consume(s, sent_at, latencies)) for s in streams]
+    await asyncio.sleep(0.1)  # let every subscriber take its initial snapshot
+
+    started = time.perf_counter()
+    await asyncio.to_thread(publisher, task_id, updates, interval, sent_at)
+    await asyncio.gather(*consumers)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "queries": load.queries,
+        "queries_per_sec": load.queries / elapsed,
+        "events": len(latencies),
+        "latency_p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "latency_max_ms": max(latencies) * 1000 if latencies else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between progress updates")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_FILE = os.path.join(tmp, "bench.db")
+        database.init_db()
+        for mode in ("polling", "bus"):
+            result = asyncio.run(run(mode, args.subscribers, args.updates, args.interval, args.poll_interval))
+            print(
+                f"{result['mode']:>8}: {result['queries']:>6} queries "
+                f"({result['queries_per_sec']:8.1f}/s), {result['events']:>6} events, "
+                f"latency p50 {result['latency_p50_ms']:7.1f} ms, max {result['latency_max_ms']:7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Throughput and CPU time per GB of serving a result file: Starlette's
+`FileResponse`, as the download routes used, against
+`result_serving.ResultFileResponse` reading chunks itself and handing the
+file to the server with the `http.response.zerocopysend` and
+`http.response.pathsend` extensions.
+
+A minimal server side writes the responses to a socket that a separate
+process drains, so the CPU time measured is only that of serving. It
+implements both extensions with `loop.sock_sendfile`, i.e. `os.sendfile`, as
+an ASGI server supporting them would.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_result_serving --size-mb 1024 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import FileResponse  # noqa: E402
+from app.services import result_serving  # noqa: E402
+
+_DRAIN = """
+import socket, sys
+sock = socket.socket(fileno=int(sys.argv[1]))
+buffer = bytearray(1024 * 1024)
+while sock.recv_into(buffer):
+    pass
+"""
+
+
+class SocketServer:
+    """The sending half of an ASGI server, writing response bodies to `sock`."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    async def send(self, message: dict):
+        loop = asyncio.get_running_loop()
+        if message["type"] == "http.response.body":
+            await loop.sock_sendall(self.sock, message["body"])
+        elif message["type"] == "http.response.zerocopysend":
+            await loop.sock_sendfile(self.sock, message["file"], message["offset"], message["count"], fallback=False)
+        elif message["type"] == "http.response.pathsend":
+            with open(message["path"], "rb") as file:
+                await loop.sock_sendfile(self.sock, file, fallback=False)
+
+
+async def never_disconnect():
+    await asyncio.Future()
+
+
+def scope(extensions: dict, range_header: str | None) -> dict:
+    headers = [(b"range", range_header.encode())] if range_header else []
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "GET",
+        "path": "/download",
+        "headers": headers,
+        "extensions": extensions,
+    }
+
+
+async def serve(mode: str, task: dict, server: SocketServer, range_header: str | None):
+    if mode == "FileResponse":
+        request_scope = scope({}, range_header)
+        response = FileResponse(task['result_path'], media_type='application/octet-stream')
+    else:
+        extensions = {f"http.response.{mode}": {}} if mode in ("zerocopysend", "pathsend") else {}
+        request_scope = scope(extensions, range_header)
+        response = await result_serving.serve_result(Request(request_scope), task, 'application/octet-stream')
+    await response(request_scope, never_disconnect, server.send)
+
+
+def run(mode: str, task: dict, rounds: int, range_header: str | None, served_bytes: int) -> dict:
+    ours, theirs = socket.socketpair()
+    drain = subprocess.Popen([sys.executable, "-c", _DRAIN, str(theirs.fileno())], pass_fds=[theirs.fileno()])
+    theirs.close()
+    ours.setblocking(False)
+    server = SocketServer(ours)
+
+    async def rounds_of_serving():
+        for _ in range(rounds):
+            await serve(mode, task, server, range_header)
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    asyncio.run(rounds_of_serving())
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    ours.close()
+    drain.wait()
+
+    gigabytes = served_bytes * rounds / 1024 ** 3
+    return {
+        "mb_per_second": served_bytes * rounds / wall / 1024 ** 2,
+        "cpu_s_per_gb": cpu / gigabytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--range", default=None, help="a Range header to send, e.g. 'bytes=0-1048575,4194304-'")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "result.bin")
+        block = os.urandom(1024 * 1024)
+        with open(path, "wb") as file:
+            for _ in range(args.size_mb):
+                file.write(block)
+        size = os.path.getsize(path)
+        task = {"task_id": "bench", "tool_name": "bench", "result_path": path}
+        served_bytes = size
+        if args.range:
+            served_bytes = sum(end - start for start, end in result_serving.parse_ranges(args.range, size))
+
+        modes = ["FileResponse", "read", "zerocopysend"]
+        if not args.range:
+            modes.append("pathsend")
+        print(f"{args.rounds} x {served_bytes / 1024 ** 2:.0f} MB of a {args.size_mb} MB file (in the page cache)")
+        # Warm the page cache so that every mode reads from memory.
+        run("read", task, 1, None, size)
+        for mode in modes:
+            result = run(mode, task, args.rounds, args.range, served_bytes)
+            print(f"{mode:>13}: {result['mb_per_second']:8.0f} MB/s, {result['cpu_s_per_gb']:6.3f} CPU s per GB")
+
+
+if __name__ == "__main__":
+    main()
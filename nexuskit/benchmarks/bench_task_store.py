@@ -0,0 +1,161 @@
+"""
+Load test of the task store: N simulated downloads report progress from their
+own threads as fast as yt-dlp's hooks would, while pollers read task status
+and every download ends with a status change. Compares the old store (default
+rollback journal, an UPDATE and commit per progress report) with the current
+one (WAL, tuned pragmas and write-behind progress in `task_service`).
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_task_store --downloads 32 --seconds 5
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import database  # noqa: E402
+from app.services import task_service  # noqa: E402
+
+
+class LegacyStore:
+    """The task store as it was: a connection per thread, default settings."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def conn(self):
+        if not hasattr(self.local, "conn"):
+            self.local.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.local.conn.row_factory = sqlite3.Row
+        return self.local.conn
+
+    def create_task(self, tool_name):
+        task_id = f"task-{threading.get_ident()}-{time.perf_counter_ns()}"
+        conn = self.conn()
+        conn.execute("INSERT INTO tasks (task_id, tool_name, status) VALUES (?, ?, ?)", (task_id, tool_name, 'pending'))
+        conn.commit()
+        return task_id
+
+    def update_task_progress(self, task_id, progress):
+        conn = self.conn()
+        conn.execute("UPDATE tasks SET progress = ?, status = ? WHERE task_id = ?", (progress, 'processing', task_id))
+        conn.commit()
+
+    def complete_task(self, task_id, result_path):
+        conn = self.conn()
+        conn.execute("UPDATE tasks SET status = ?, progress = 100, result_path = ? WHERE task_id = ?", ('completed', result_path, task_id))
+        conn.commit()
+
+    def get_task_status(self, task_id):
+        row = self.conn().execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+
+def run(store, downloads: int, seconds: float, hook_hz: int, pollers: int) -> dict:
+    latencies = []
+    read_latencies = []
+    errors = []
+    task_ids = [store.create_task('ytdl') for _ in range(downloads)]
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def download(task_id):
+        mine = []
+        deadline = time.perf_counter() + seconds
+        calls = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                store.update_task_progress(task_id, min(99, calls * 100 // int(seconds * hook_hz)))
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            mine.append(time.perf_counter() - started)
+            calls += 1
+            time.sleep(max(0.0, 1 / hook_hz - (time.perf_counter() - started)))
+        try:
+            store.complete_task(task_id, "/tmp/result")
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+        with lock:
+            latencies.extend(mine)
+
+    def poll():
+        mine = []
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                store.get_task_status(task_ids[i % len(task_ids)])
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            mine.append(time.perf_counter() - started)
+            i += 1
+            time.sleep(0.01)
+        with lock:
+            read_latencies.extend(mine)
+
+    threads = [threading.Thread(target=download, args=(task_id,)) for task_id in task_ids]
+    poll_threads = [threading.Thread(target=poll) for _ in range(pollers)]
+    started = time.perf_counter()
+    for thread in threads + poll_threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    for thread in poll_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    completed = sum(1 for task_id in task_ids if (store.get_task_status(task_id) or {}).get('status') == 'completed')
+    latencies.sort()
+    read_latencies.sort()
+    return {
+        "callbacks": len(latencies),
+        "rate": len(latencies) / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "read_p99_ms": read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else 0.0,
+        "errors": len(errors),
+        "completed": completed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--downloads", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--hook-hz", type=int, default=30, help="progress reports per second per download")
+    parser.add_argument("--pollers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_FILE = os.path.join(tmp, "legacy.db")
+        database.init_db()
+        # init_db enables WAL; the old store used the default rollback journal.
+        database.get_db_connection().execute("PRAGMA journal_mode=DELETE")
+        database.close_db_connection()
+        legacy = run(LegacyStore(database.DATABASE_FILE), args.downloads, args.seconds, args.hook_hz, args.pollers)
+
+        database.DATABASE_FILE = os.path.join(tmp, "tuned.db")
+        database.init_db()
+        tuned = run(task_service, args.downloads, args.seconds, args.hook_hz, args.pollers)
+        task_service.flush_progress()
+
+    print(f"{args.downloads} downloads reporting {args.hook_hz}/s for {args.seconds} s, {args.pollers} status pollers")
+    for name, result in (("legacy", legacy), ("tuned", tuned)):
+        print(f"{name:>7}: {result['callbacks']} callbacks ({result['rate']:.0f}/s), "
+              f"hook mean {result['mean_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms, "
+              f"status read p99 {result['read_p99_ms']:.3f} ms, "
+              f"{result['errors']} lock errors, {result['completed']}/{args.downloads} completed")
+
+
+if __name__ == "__main__":
+    main()
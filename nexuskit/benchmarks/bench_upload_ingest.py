@@ -0,0 +1,98 @@
+"""
+Measures peak Python memory and event-loop stalls while ingesting concurrent
+large uploads, comparing the old `buffer.write(file.file.read())` handlers with
+the streaming `upload_ingest.ingest_upload`.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_upload_ingest --uploads 4 --size-mb 256
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from starlette.datastructures import UploadFile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import upload_ingest  # noqa: E402
+
+
+def make_upload(size_bytes: int) -> UploadFile:
+    # Starlette spools multipart bodies to a temporary file; mirror that here.
+    spool = tempfile.TemporaryFile()
+    block = os.urandom(1024 * 1024)
+    written = 0
+    while written < size_bytes:
+        spool.write(block)
+        written += len(block)
+    spool.seek(0)
+    return UploadFile(spool, size=written, filename="upload.bin")
+
+
+async def legacy_ingest(file, task_dir):
+    path = os.path.join(task_dir, file.filename)
+    with open(path, "wb") as buffer:
+        buffer.write(file.file.read())
+
+
+async def streaming_ingest(file, task_dir):
+    await upload_ingest.ingest_upload(file, task_dir, max_bytes=1 << 62)
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run(mode, uploads, size_bytes):
+    ingest = legacy_ingest if mode == "legacy" else streaming_ingest
+    files = [make_upload(size_bytes) for _ in range(uploads)]
+    with tempfile.TemporaryDirectory() as tmp:
+        task_dirs = [os.path.join(tmp, str(i)) for i in range(uploads)]
+        for task_dir in task_dirs:
+            os.makedirs(task_dir)
+
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        tracemalloc.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(ingest(f, d) for f, d in zip(files, task_dirs)))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stop.set()
+        worst_lag = await lag_task
+
+    for f in files:
+        f.file.close()
+    return elapsed, peak, worst_lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    size_bytes = args.size_mb * 1024 * 1024
+    total_mb = args.uploads * args.size_mb
+    for mode in ("legacy", "streaming"):
+        elapsed, peak, worst_lag = asyncio.run(run(mode, args.uploads, size_bytes))
+        print(
+            f"{mode:>9}: {args.uploads} x {args.size_mb} MB in {elapsed:6.2f} s "
+            f"({total_mb / elapsed:7.1f} MB/s), peak Python memory {peak / 1024 ** 2:8.1f} MB, "
+            f"worst event-loop stall {worst_lag * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
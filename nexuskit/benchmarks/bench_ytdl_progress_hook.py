@@ -0,0 +1,119 @@
+"""
+Overhead of the yt-dlp progress hook per callback. Replays the progress
+dictionaries yt-dlp passes during a download, ANSI-coloured display strings
+included, through the old hook (parses `_percent_str` and reports every
+callback) and through `service_ytdl.DownloadProgress`, both reporting to the
+real task store.
+
+Run from the `nexuskit` directory:
+
+    python -m benchmarks.bench_ytdl_progress_hook --callbacks 20000
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import database  # noqa: E402
+from app.core import config  # noqa: E402
+from app.services import service_ytdl, task_service  # noqa: E402
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def legacy_hook(task_id: str):
+    # The hook as it was, except that the ANSI codes and decimals that made
+    # its int() raise are handled, so it can run to the end.
+    def progress_hook(d):
+        if d['status'] == 'downloading':
+            progress = int(float(_ANSI.sub('', d['_percent_str']).strip().replace('%', '')))
+            task_service._update(task_id, progress=progress, status='processing')
+        elif d['status'] == 'finished':
+            task_service._update(task_id, progress=100, status='processing')
+    return progress_hook
+
+
+def callbacks(count: int, total: int, duration: float):
+    # What yt-dlp passes its hooks, about `count / duration` times a second.
+    for i in range(count):
+        downloaded = total * (i + 1) // count
+        elapsed = duration * (i + 1) / count
+        speed = downloaded / elapsed
+        yield {
+            'status': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'elapsed': elapsed,
+            'speed': speed,
+            'eta': (total - downloaded) / speed,
+            '_percent_str': f"\x1b[0;94m{downloaded * 100 / total:5.1f}%\x1b[0m",
+            'filename': '/tmp/video.mp4',
+        }, elapsed
+    yield {'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total, 'filename': '/tmp/video.mp4'}, duration
+
+
+def run(hook, events) -> dict:
+    timings = []
+    for d, _ in events:
+        started = time.perf_counter()
+        hook(d)
+        timings.append(time.perf_counter() - started)
+    task_service.flush_progress()
+    timings.sort()
+    return {
+        "callbacks": len(timings),
+        "mean_us": statistics.mean(timings) * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+        "total_ms": sum(timings) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callbacks", type=int, default=20000)
+    parser.add_argument("--size-mb", type=int, default=2048, help="size of the simulated download")
+    parser.add_argument("--duration", type=float, default=300, help="simulated download time in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_FILE = os.path.join(tmp, "bench.db")
+        database.init_db()
+        events = list(callbacks(args.callbacks, args.size_mb * 1024 ** 2, args.duration))
+
+        legacy = run(legacy_hook(task_service.create_task('ytdl')), events)
+
+        reports = []
+        task_id = task_service.create_task('ytdl')
+        # The replay runs much faster than the simulated download, so the hook
+        # is given the simulated clock to throttle on.
+        clock = iter(elapsed for _, elapsed in events)
+
+        def report(*report_args, **fields):
+            reports.append(report_args[1])
+            task_service.update_task_progress(*report_args, **fields)
+
+        hook = service_ytdl.DownloadProgress(
+            task_id,
+            config.YTDL_PROGRESS_INTERVAL_MS / 1000,
+            config.YTDL_PROGRESS_MIN_DELTA,
+            config.YTDL_PROGRESS_HEARTBEAT_MS / 1000,
+            report=report,
+            clock=lambda: next(clock),
+        )
+        throttled = run(hook, events)
+        task = task_service.get_task_status(task_id)
+
+    print(f"{args.callbacks} callbacks over a simulated {args.duration:.0f} s, {args.size_mb} MB download")
+    for name, result, writes in (("legacy", legacy, legacy["callbacks"]), ("throttled", throttled, len(reports))):
+        print(f"{name:>9}: mean {result['mean_us']:8.2f} us, p99 {result['p99_us']:8.2f} us, "
+              f"{result['total_ms']:8.1f} ms in total, {writes} reports")
+    print(f"final record: progress {task['progress']}, {task['downloaded_bytes']} bytes, eta {task['eta']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import sys
 import os
 
-# Add the parent directory to the Python path to allow importing app.services
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'app')))
+# Add this directory to the Python path to allow importing app.services
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from services import cleanup_service
+from app import database
+from app.services import cleanup_service
 import logging
 
 # Configure logging for the cleanup script
@@ -19,5 +20,6 @@ logging.basicConfig(
 
 if __name__ == "__main__":
     logging.info("Starting periodic cleanup script...")
+    database.init_db()
     cleanup_service.periodic_cleanup_script()
     logging.info("Periodic cleanup script finished.")
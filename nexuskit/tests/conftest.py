@@ -0,0 +1,98 @@
+"""
+Shared fixtures. Run from the `nexuskit` directory:
+
+    python -m pytest tests
+"""
+import http.server
+import mimetypes
+import os
+import re
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import database  # noqa: E402
+from app.core import config  # noqa: E402
+from app.services import cleanup_service, task_store  # noqa: E402
+from fake_redis import FakeRedisServer  # noqa: E402
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of `server.directory`, honouring `Range: bytes=N-`."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = os.path.join(self.server.directory, self.path.split("?")[0].lstrip("/"))
+        range_header = self.headers.get("Range")
+        self.server.requests.append((self.path, range_header))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as file:
+            data = file.read()
+        match = re.match(r"bytes=(\d+)-", range_header or "")
+        start = int(match.group(1)) if match else 0
+        if match:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        content_type = "application/vnd.apple.mpegurl" if path.endswith(".m3u8") else mimetypes.guess_type(path)[0]
+        self.send_header("Content-Type", content_type or "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    """
+    A local HTTP server for media fixtures: files written to its `directory`
+    are served at `url`, and every request's path and Range header is
+    recorded in `requests`.
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    server.directory = tmp_path / "media"
+    server.directory.mkdir()
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_server():
+    server = FakeRedisServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path, monkeypatch):
+    """An empty task store, once with each backend, as the process's store."""
+    monkeypatch.setattr(database, "DATABASE_FILE", str(tmp_path / "tasks.db"))
+    database.init_db()
+    # The store thread opens its own connection to the new database.
+    database.close_db_connection()
+    url = request.getfixturevalue("redis_server").url if request.param == "redis" else "sqlite"
+    monkeypatch.setattr(config, "TASK_STORE_URL", url)
+    task_store.shutdown()
+    yield task_store.get_store()
+    task_store.shutdown()
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    """An empty directory for the task directories."""
+    path = tmp_path / "data"
+    path.mkdir()
+    monkeypatch.setattr(cleanup_service, "TEMP_DIR", str(path))
+    return path
@@ -0,0 +1,204 @@
+"""
+An in-process stand-in for a Redis server, speaking RESP2 over TCP and
+implementing the commands the task store uses: hashes, sets, sorted sets and
+WATCH/MULTI/EXEC transactions. Keys are versioned so that EXEC aborts when a
+watched key was written to by another connection.
+"""
+import asyncio
+import threading
+
+# The reply to an EXEC aborted by a watched key, a null array.
+_ABORTED = object()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+        self.commands = []
+
+    def _touch(self, key: bytes):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _sorted(self, key: bytes) -> list[tuple[bytes, float]]:
+        # Equal scores are ordered by member, as Redis does.
+        return sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    @staticmethod
+    def _bound(value: bytes) -> tuple[float, bool]:
+        exclusive = value.startswith(b"(")
+        value = value.lstrip(b"(")
+        if value in (b"-inf", b"+inf", b"inf"):
+            return float(value.decode()), exclusive
+        return float(value), exclusive
+
+    def run(self, command: str, args: list[bytes]):
+        self.commands.append(command)
+        data = self.data
+        if command == "PING":
+            return "PONG"
+        if command in ("SELECT", "AUTH"):
+            return "OK"
+        if command == "HSET":
+            fields = data.setdefault(args[0], {})
+            added = 0
+            for name, value in zip(args[1::2], args[2::2]):
+                added += name not in fields
+                fields[name] = value
+            self._touch(args[0])
+            return added
+        if command == "HDEL":
+            fields = data.get(args[0], {})
+            removed = sum(fields.pop(name, None) is not None for name in args[1:])
+            if not fields:
+                data.pop(args[0], None)
+            self._touch(args[0])
+            return removed
+        if command == "HGETALL":
+            return [item for name, value in data.get(args[0], {}).items() for item in (name, value)]
+        if command == "HMGET":
+            fields = data.get(args[0], {})
+            return [fields.get(name) for name in args[1:]]
+        if command == "SADD":
+            members = data.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            self._touch(args[0])
+            return added
+        if command == "SREM":
+            members = data.get(args[0], set())
+            removed = len(members & set(args[1:]))
+            members.difference_update(args[1:])
+            self._touch(args[0])
+            return removed
+        if command == "SMEMBERS":
+            return sorted(data.get(args[0], set()))
+        if command == "ZADD":
+            scores = data.setdefault(args[0], {})
+            added = 0
+            for score, member in zip(args[1::2], args[2::2]):
+                added += member not in scores
+                scores[member] = float(score)
+            self._touch(args[0])
+            return added
+        if command == "ZREM":
+            scores = data.get(args[0], {})
+            removed = sum(scores.pop(member, None) is not None for member in args[1:])
+            self._touch(args[0])
+            return removed
+        if command == "ZRANGE":
+            items = self._sorted(args[0])
+            start, stop = int(args[1]), int(args[2])
+            items = items[start:] if stop == -1 else items[start:stop + 1]
+            if len(args) > 3 and args[3].upper() == b"WITHSCORES":
+                return [item for member, score in items for item in (member, repr(score).encode())]
+            return [member for member, _ in items]
+        if command == "ZRANGEBYSCORE":
+            (low, low_exclusive), (high, high_exclusive) = self._bound(args[1]), self._bound(args[2])
+            members = [
+                member for member, score in self._sorted(args[0])
+                if (low < score if low_exclusive else low <= score)
+                and (score < high if high_exclusive else score <= high)
+            ]
+            if len(args) > 3 and args[3].upper() == b"LIMIT":
+                offset, count = int(args[4]), int(args[5])
+                members = members[offset:offset + count]
+            return members
+        if command == "ZRANK":
+            members = [member for member, _ in self._sorted(args[0])]
+            return members.index(args[1]) if args[1] in members else None
+        if command == "DEL":
+            deleted = 0
+            for key in args:
+                deleted += data.pop(key, None) is not None
+                self._touch(key)
+            return deleted
+        return Exception(f"unknown command '{command}'")
+
+    @classmethod
+    def encode(cls, value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if value is _ABORTED:
+            return b"*-1\r\n"
+        if isinstance(value, Exception):
+            return b"-ERR " + str(value).encode() + b"\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, str):
+            return b"+" + value.encode() + b"\r\n"
+        if isinstance(value, bytes):
+            return b"$%d\r\n" % len(value) + value + b"\r\n"
+        return b"*%d\r\n" % len(value) + b"".join(cls.encode(item) for item in value)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        watched = {}
+        transaction = None
+        try:
+            while True:
+                line = await reader.readuntil(b"\r\n")
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int((await reader.readuntil(b"\r\n"))[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                command, args = args[0].decode().upper(), args[1:]
+                if command == "WATCH":
+                    watched.update((key, self.versions.get(key, 0)) for key in args)
+                    reply = "OK"
+                elif command == "UNWATCH":
+                    watched = {}
+                    reply = "OK"
+                elif command == "MULTI":
+                    transaction = []
+                    reply = "OK"
+                elif command == "DISCARD":
+                    transaction, watched = None, {}
+                    reply = "OK"
+                elif command == "EXEC":
+                    if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                        reply = _ABORTED
+                    else:
+                        reply = [self.run(queued, queued_args) for queued, queued_args in transaction]
+                    transaction, watched = None, {}
+                elif transaction is not None:
+                    transaction.append((command, args))
+                    reply = "QUEUED"
+                else:
+                    reply = self.run(command, args)
+                writer.write(self.encode(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class FakeRedisServer:
+    """Runs a `FakeRedis` on a local port, on an event loop in a daemon thread."""
+
+    def __init__(self):
+        self.redis = FakeRedis()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="fake-redis", daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.redis.handle, "127.0.0.1", 0), self.loop
+        ).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            connections = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
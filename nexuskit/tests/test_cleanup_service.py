@@ -0,0 +1,22 @@
+import asyncio
+import os
+
+from app.services import cleanup_service, task_service
+
+
+def test_task_submitted_again_keeps_its_directory(store, temp_dir):
+    task_ids = [task_service.create_task("ffmpeg") for _ in range(2)]
+    for task_id in task_ids:
+        (temp_dir / task_id).mkdir()
+        task_service.complete_task(task_id, str(temp_dir / task_id / "out.mp4"))
+        store.call(store.store.update_task(task_id, {"expires_at": 1.0}))
+    expired = store.call(store.store.get_expired(2.0, 10))
+    assert sorted(expired) == sorted(task_ids)
+
+    # A new conversion of the first one arrives before the batch is deleted.
+    task_service.queue_task(task_ids[0], {})
+    asyncio.run(cleanup_service.scheduler._delete(expired))
+
+    assert os.listdir(temp_dir) == [task_ids[0]]
+    assert task_service.get_task_status(task_ids[0])["status"] == "queued"
+    assert task_service.get_task_status(task_ids[1]) is None
@@ -0,0 +1,152 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from app.core import config
+from app.services import job_scheduler, task_service
+
+
+class Jobs:
+    """A job function that records its runs and blocks until released."""
+
+    def __init__(self):
+        self.runs = []
+        self.release = threading.Event()
+
+    def __call__(self, task_id: str, n: int):
+        self.runs.append(task_id)
+        self.release.wait(5)
+        task_service.complete_task(task_id, f"/results/{n}")
+
+
+@pytest.fixture
+def heartbeat(monkeypatch):
+    monkeypatch.setattr(config, "JOB_HEARTBEAT_SECONDS", 0.05)
+    monkeypatch.setattr(config, "JOB_HEARTBEAT_TIMEOUT", 0.5)
+
+
+@pytest.fixture
+def schedulers():
+    """Starts schedulers with a single resumable pool, as separate server processes would."""
+    started = []
+
+    def start(jobs: Jobs, beat: bool = True, workers: int = 2) -> job_scheduler.JobScheduler:
+        scheduler = job_scheduler.JobScheduler()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        scheduler._add_pool("test", jobs, executor, workers, 10, resume_interrupted=True)
+        if beat:
+            scheduler._heartbeat = threading.Thread(target=scheduler._beat, daemon=True)
+            scheduler._heartbeat.start()
+        started.append(scheduler)
+        return scheduler
+
+    yield start
+    for scheduler in started:
+        scheduler.shutdown()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def queue(n: int) -> str:
+    task_id = task_service.create_task("test")
+    task_service.queue_task(task_id, {"n": n})
+    return task_id
+
+
+def test_queued_jobs_run_once_across_schedulers(store, schedulers, heartbeat):
+    task_ids = [queue(n) for n in range(6)]
+    jobs = Jobs()
+    jobs.release.set()
+    for _ in range(3):
+        schedulers(jobs)
+    wait_for(lambda: all(task_service.get_task_status(t)["status"] == "completed" for t in task_ids))
+    assert sorted(jobs.runs) == sorted(task_ids)
+
+
+def test_running_job_stays_with_its_live_owner(store, schedulers, heartbeat):
+    task_id = queue(1)
+    jobs = Jobs()
+    first = schedulers(jobs)
+    wait_for(lambda: jobs.runs == [task_id])
+
+    # Well past the timeout, a newly started process leaves it alone.
+    time.sleep(3 * config.JOB_HEARTBEAT_TIMEOUT)
+    schedulers(jobs)
+    time.sleep(3 * config.JOB_HEARTBEAT_SECONDS)
+    assert jobs.runs == [task_id]
+    task = store.call(store.store.get_task(task_id))
+    assert (task["status"], task["owner"]) == ("processing", first.owner)
+
+    jobs.release.set()
+    wait_for(lambda: task_service.get_task_status(task_id)["status"] == "completed")
+
+
+def test_job_of_a_stopped_owner_is_resumed(store, schedulers, heartbeat):
+    task_id = queue(1)
+    jobs = Jobs()
+    first = schedulers(jobs)
+    second = schedulers(jobs)
+    wait_for(lambda: jobs.runs == [task_id])
+    assert store.call(store.store.get_task(task_id))["owner"] == first.owner
+
+    # The first process dies: its job stops being kept alive.
+    first._stopping.set()
+    first._heartbeat.join()
+    wait_for(lambda: len(jobs.runs) == 2)
+    assert jobs.runs == [task_id, task_id]
+    second._stopping.set()
+    second._heartbeat.join()
+    task = store.call(store.store.get_task(task_id))
+    assert (task["status"], task["owner"]) == ("processing", second.owner)
+    # Nor can the first one keep it alive any more.
+    task_service.touch_tasks([task_id], first.owner)
+    assert store.call(store.store.get_task(task_id))["last_used_at"] == task["last_used_at"]
+
+    jobs.release.set()
+    wait_for(lambda: task_service.get_task_status(task_id)["status"] == "completed")
+
+
+def test_startup_requeues_jobs_left_by_a_crash(store, schedulers, heartbeat):
+    task_id = queue(1)
+    stale = time.time() - 10 * config.JOB_HEARTBEAT_TIMEOUT
+    store.call(store.store.update_task(task_id, {"status": "processing", "owner": "gone", "last_used_at": stale}))
+    later = queue(2)
+
+    jobs = Jobs()
+    jobs.release.set()
+    schedulers(jobs, beat=False, workers=1)
+    wait_for(lambda: task_service.get_task_status(later)["status"] == "completed")
+    assert task_service.get_task_status(task_id)["status"] == "completed"
+    # It keeps its place ahead of the jobs queued after it.
+    assert jobs.runs == [task_id, later]
+
+
+def test_task_with_a_job_cannot_be_submitted_again(store, schedulers):
+    jobs = Jobs()
+    scheduler = schedulers(jobs, beat=False, workers=1)
+    running, waiting = task_service.create_task("test"), task_service.create_task("test")
+    scheduler.submit("test", running, n=1)
+    wait_for(lambda: jobs.runs == [running])
+    scheduler.submit("test", waiting, n=2)
+
+    for task_id in (running, waiting):
+        with pytest.raises(job_scheduler.TaskAlreadyQueuedError):
+            scheduler.submit("test", task_id, n=3)
+    # Neither the running job's task nor the queue were touched.
+    assert task_service.get_task_status(running)["status"] == "processing"
+    assert list(scheduler._pools["test"].pending.items()) == [(waiting, {"n": 2})]
+
+    jobs.release.set()
+    wait_for(lambda: task_service.get_task_status(waiting)["status"] == "completed")
+    assert task_service.get_task_status(running)["result_path"] == "/results/1"
+    assert task_service.get_task_status(waiting)["result_path"] == "/results/2"
+    # Once done, it can be converted again.
+    scheduler.submit("test", running, n=3)
+    wait_for(lambda: task_service.get_task_status(running)["result_path"] == "/results/3")
@@ -0,0 +1,144 @@
+import os
+
+import fitz
+import pytest
+
+from app.services import pdf_page_ops
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    """A four-page document; page n reads "Page n" and is 200 + 10n points wide."""
+    path = tmp_path / "document.pdf"
+    with fitz.open() as doc:
+        for n in range(4):
+            doc.new_page(width=200 + 10 * n, height=300).insert_text((20, 50), f"Page {n}")
+        doc.save(path)
+    return str(path)
+
+
+def pages(pdf_path: str) -> list[tuple[str, float]]:
+    """The text and width of every page; blank pages read ""."""
+    with fitz.open(pdf_path) as doc:
+        return [(page.get_text().strip(), page.rect.width) for page in doc]
+
+
+def live_objects(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return sum(doc.xref_object(xref) != "null" for xref in range(1, doc.xref_length()))
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("operations, plan", [
+    ([], [0, 1, 2, 3]),
+    ([{"op": "delete", "pages": [1, 3]}], [0, 2]),
+    ([{"op": "reorder", "page_order": [3, 2, 1, 0]}], [3, 2, 1, 0]),
+    ([{"op": "reorder", "page_order": [0, 0, 1]}], [0, 0, 1]),
+    ([{"op": "move", "page": 3, "to": 0}], [3, 0, 1, 2]),
+    ([{"op": "add_blank"}, {"op": "add_blank", "at": 0}], [None, 0, 1, 2, 3, None]),
+    # Each operation sees the positions left by the ones before it.
+    (
+        [
+            {"op": "delete", "pages": [0]},
+            {"op": "move", "page": 0, "to": 2},
+            {"op": "add_blank", "at": 1},
+            {"op": "reorder", "page_order": [3, 0, 1, 2]},
+        ],
+        [1, 2, None, 3],
+    ),
+])
+def test_build_page_plan(operations, plan):
+    assert pdf_page_ops.build_page_plan(4, operations) == plan
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "delete", "pages": [4]}],
+    [{"op": "delete", "pages": [-1]}],
+    [{"op": "reorder", "page_order": [0, 1, 9]}],
+    [{"op": "move", "page": 4, "to": 0}],
+    [{"op": "move", "page": 0, "to": 4}],
+    [{"op": "add_blank", "at": 5}],
+    [{"op": "delete", "pages": [0]}, {"op": "move", "page": 3, "to": 0}],
+    [{"op": "rotate"}],
+])
+def test_build_page_plan_rejects_missing_pages(operations):
+    with pytest.raises(ValueError):
+        pdf_page_ops.build_page_plan(4, operations)
+
+
+@pytest.mark.parametrize("sources, move", [
+    ([0, 1, 2, 3], None),
+    ([3, 0, 1, 2], (3, 0)),
+    ([1, 2, 3, 0], (0, 3)),
+    ([0, 2, 1, 3], (2, 1)),
+    ([1, 0, 3, 2], None),
+])
+def test_single_move(sources, move):
+    assert pdf_page_ops._single_move(sources) == move
+
+
+@pytest.mark.parametrize("operations, expected", [
+    ([{"op": "move", "page": 3, "to": 1}], [0, 3, 1, 2]),
+    ([{"op": "move", "page": 0, "to": 3}], [1, 2, 3, 0]),
+    ([{"op": "reorder", "page_order": [2, 0, 3, 1]}], [2, 0, 3, 1]),
+    ([{"op": "add_blank", "at": 2}], [0, 1, None, 2, 3]),
+])
+def test_keeping_every_page_appends_to_the_file(pdf_path, operations, expected):
+    original = read(pdf_path)
+    assert pdf_page_ops.apply_page_operations(pdf_path, operations) == len(expected)
+    assert read(pdf_path).startswith(original)
+    assert [text for text, _ in pages(pdf_path)] == [f"Page {n}" if n is not None else "" for n in expected]
+
+
+def test_dropping_pages_rewrites_the_file(pdf_path):
+    original = read(pdf_path)
+    objects = live_objects(pdf_path)
+    assert pdf_page_ops.apply_page_operations(pdf_path, [{"op": "delete", "pages": [0, 2]}]) == 2
+    assert not read(pdf_path).startswith(original)
+    assert pages(pdf_path) == [("Page 1", 210), ("Page 3", 230)]
+    # The dropped pages' objects are gone from the file.
+    assert live_objects(pdf_path) < objects
+
+
+def test_mixed_batch(pdf_path):
+    operations = [
+        {"op": "delete", "pages": [1]},
+        {"op": "move", "page": 2, "to": 0},
+        {"op": "add_blank", "at": 1},
+        {"op": "add_blank"},
+    ]
+    assert pdf_page_ops.apply_page_operations(pdf_path, operations) == 5
+    # Blank pages take the size of the last kept page.
+    assert pages(pdf_path) == [("Page 3", 230), ("", 220), ("Page 0", 200), ("Page 2", 220), ("", 220)]
+
+
+def test_replacing_every_page_with_blanks(pdf_path):
+    operations = [{"op": "delete", "pages": [0, 1, 2, 3]}, {"op": "add_blank"}, {"op": "add_blank"}]
+    assert pdf_page_ops.apply_page_operations(pdf_path, operations) == 2
+    assert pages(pdf_path) == [("", 230), ("", 230)]
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "move", "page": 0, "to": 1}, {"op": "delete", "pages": [7]}],
+    [{"op": "delete", "pages": [0, 1, 2, 3]}],
+])
+def test_rejected_batches_leave_the_file_alone(pdf_path, operations):
+    original = read(pdf_path)
+    with pytest.raises(ValueError):
+        pdf_page_ops.apply_page_operations(pdf_path, operations)
+    assert read(pdf_path) == original
+    assert os.listdir(os.path.dirname(pdf_path)) == ["document.pdf"]
+
+
+def test_readers_keep_the_version_they_opened(pdf_path):
+    with open(pdf_path, "rb") as reader:
+        pdf_page_ops.apply_page_operations(pdf_path, [{"op": "add_blank"}])
+        before = reader.read()
+    with fitz.open(stream=before, filetype="pdf") as doc:
+        assert len(doc) == 4
+    assert len(pages(pdf_path)) == 5
+    assert os.listdir(os.path.dirname(pdf_path)) == ["document.pdf"]
@@ -0,0 +1,198 @@
+import email.utils
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core import config
+from app.services import result_serving
+
+SIZE = 5000
+
+
+@pytest.fixture
+def result(tmp_path) -> bytes:
+    data = os.urandom(SIZE)
+    (tmp_path / "result.bin").write_bytes(data)
+    return data
+
+
+@pytest.fixture
+def client(tmp_path, result, monkeypatch):
+    """Serves the result file at /download, sending it in small chunks."""
+    monkeypatch.setattr(config, "DOWNLOAD_CHUNK_BYTES", 1024)
+    monkeypatch.setattr(result_serving, "accounting", result_serving.DownloadAccounting())
+    task = {"task_id": "task", "tool_name": "ffmpeg", "result_path": str(tmp_path / "result.bin")}
+    app = FastAPI()
+
+    @app.get("/download")
+    async def download(request: Request):
+        return await result_serving.serve_result(request, task, "application/octet-stream")
+
+    return TestClient(app)
+
+
+def validators(client) -> tuple[str, str]:
+    headers = client.get("/download").headers
+    return headers["etag"], headers["last-modified"]
+
+
+def http_date(offset: int, last_modified: str) -> str:
+    return email.utils.formatdate(email.utils.parsedate_to_datetime(last_modified).timestamp() + offset, usegmt=True)
+
+
+def byteranges(response) -> list[tuple[str, bytes]]:
+    """The Content-Range and body of every part of a multipart/byteranges response."""
+    media_type, _, boundary = response.headers["content-type"].partition("; boundary=")
+    assert media_type == "multipart/byteranges"
+    body = response.content
+    assert body.endswith(f"--{boundary}--\r\n".encode())
+    parts = []
+    for part in body.split(f"--{boundary}".encode())[1:-1]:
+        head, _, content = part.partition(b"\r\n\r\n")
+        fields = dict(line.split(": ", 1) for line in head.decode().strip().split("\r\n"))
+        assert content.endswith(b"\r\n")
+        parts.append((fields["Content-Range"], content[:-2]))
+    return parts
+
+
+@pytest.mark.parametrize("header, ranges", [
+    ("bytes=0-99", [(0, 100)]),
+    ("bytes=4900-", [(4900, 5000)]),
+    ("bytes=-100", [(4900, 5000)]),
+    ("bytes=4990-9999", [(4990, 5000)]),
+    ("bytes=-9999", [(0, 5000)]),
+    (" Bytes = 10-19 , 0-4 ", [(0, 5), (10, 20)]),
+    # Overlapping and adjacent ranges are merged.
+    ("bytes=100-199,150-299", [(100, 300)]),
+    ("bytes=200-299,100-199", [(100, 300)]),
+    ("bytes=0-9,500-599,-100,590-4899", [(0, 10), (500, 5000)]),
+    # Those past the end are left out.
+    ("bytes=0-9,6000-", [(0, 10)]),
+    ("bytes=5000-,-0", []),
+])
+def test_parse_ranges(header, ranges):
+    assert result_serving.parse_ranges(header, SIZE) == ranges
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-9",
+    "bytes=",
+    "bytes=-",
+    "bytes=a-9",
+    "bytes=9-0",
+    "bytes=0-9;1-2",
+])
+def test_parse_ranges_ignores_malformed_headers(header):
+    assert result_serving.parse_ranges(header, SIZE) is None
+
+
+def test_parse_ranges_caps_the_number_of_ranges(monkeypatch):
+    monkeypatch.setattr(config, "DOWNLOAD_MAX_RANGES", 2)
+    assert result_serving.parse_ranges("bytes=0-0,2-2", SIZE) == [(0, 1), (2, 3)]
+    assert result_serving.parse_ranges("bytes=0-0,2-2,4-4", SIZE) is None
+    assert result_serving.parse_ranges("bytes=0-0", 0) is None
+
+
+def test_whole_file(client, result):
+    response = client.get("/download")
+    assert response.status_code == 200
+    assert response.content == result
+    assert response.headers["content-length"] == str(SIZE)
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-disposition"] == 'attachment; filename="result.bin"'
+    assert "content-range" not in response.headers
+
+
+def test_single_range(client, result):
+    response = client.get("/download", headers={"Range": "bytes=1000-3999"})
+    assert response.status_code == 206
+    assert response.content == result[1000:4000]
+    assert response.headers["content-range"] == f"bytes 1000-3999/{SIZE}"
+    assert response.headers["content-length"] == "3000"
+
+
+def test_merged_ranges_are_sent_as_one(client, result):
+    response = client.get("/download", headers={"Range": "bytes=0-99,50-199,200-299"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 0-299/{SIZE}"
+    assert response.content == result[:300]
+
+
+def test_several_ranges(client, result):
+    response = client.get("/download", headers={"Range": "bytes=-10,0-9,2000-3499"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == str(len(response.content))
+    assert byteranges(response) == [
+        (f"bytes 0-9/{SIZE}", result[:10]),
+        (f"bytes 2000-3499/{SIZE}", result[2000:3500]),
+        (f"bytes 4990-4999/{SIZE}", result[4990:]),
+    ]
+
+
+def test_too_many_ranges_send_the_whole_file(client, result, monkeypatch):
+    monkeypatch.setattr(config, "DOWNLOAD_MAX_RANGES", 2)
+    response = client.get("/download", headers={"Range": "bytes=0-0,10-10,20-20"})
+    assert response.status_code == 200
+    assert response.content == result
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/download", headers={"Range": f"bytes={SIZE}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+    assert response.content == b""
+
+
+def test_if_range(client, result):
+    etag, last_modified = validators(client)
+    for if_range in (etag, last_modified):
+        response = client.get("/download", headers={"Range": "bytes=0-9", "If-Range": if_range})
+        assert (response.status_code, response.content) == (206, result[:10])
+    # A weak, different or older validator means the file changed: all of it is sent.
+    for if_range in (f"W/{etag}", '"other"', http_date(-60, last_modified)):
+        response = client.get("/download", headers={"Range": "bytes=0-9", "If-Range": if_range})
+        assert (response.status_code, response.content) == (200, result)
+
+
+@pytest.mark.parametrize("headers, status_code", [
+    ({"If-None-Match": "{etag}"}, 304),
+    ({"If-None-Match": '"other", W/{etag}'}, 304),
+    ({"If-None-Match": "*"}, 304),
+    ({"If-None-Match": '"other"'}, 200),
+    ({"If-Modified-Since": "{last_modified}"}, 304),
+    ({"If-Modified-Since": "{earlier}"}, 200),
+    ({"If-Modified-Since": "yesterday"}, 200),
+    # If-None-Match takes precedence over If-Modified-Since.
+    ({"If-None-Match": '"other"', "If-Modified-Since": "{later}"}, 200),
+    ({"If-None-Match": "{etag}", "If-Modified-Since": "{earlier}"}, 304),
+    # As it does over ranges.
+    ({"If-None-Match": "{etag}", "Range": "bytes=0-9"}, 304),
+])
+def test_conditional_requests(client, headers, status_code):
+    etag, last_modified = validators(client)
+    values = {
+        "etag": etag,
+        "last_modified": last_modified,
+        "earlier": http_date(-60, last_modified),
+        "later": http_date(60, last_modified),
+    }
+    response = client.get("/download", headers={name: value.format(**values) for name, value in headers.items()})
+    assert response.status_code == status_code
+    assert response.headers["etag"] == etag
+    if status_code == 304:
+        assert response.content == b""
+        assert "content-disposition" not in response.headers
+    else:
+        assert len(response.content) == SIZE
+
+
+def test_downloads_are_accounted(client):
+    client.get("/download")
+    client.get("/download", headers={"Range": "bytes=0-9"})
+    client.get("/download", headers={"If-None-Match": "*"})
+    stats = result_serving.accounting.stats()["ffmpeg"]
+    assert {name: stats[name] for name in ("downloads", "partial", "not_modified", "interrupted", "bytes_sent")} == {
+        "downloads": 3, "partial": 1, "not_modified": 1, "interrupted": 0, "bytes_sent": SIZE + 10,
+    }
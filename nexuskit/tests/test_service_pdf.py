@@ -0,0 +1,92 @@
+import asyncio
+import base64
+import concurrent.futures
+import io
+import os
+
+import fitz
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.apis import router_pdf
+from app.core import config
+from app.services import pdf_rasterizer, service_pdf, task_service
+from app.services.preview_cache import BytesLRUCache
+
+
+def make_pdf(pages: int) -> bytes:
+    with fitz.open() as doc:
+        for n in range(pages):
+            doc.new_page().insert_text((72, 72), f"Page {n}")
+        return doc.tobytes()
+
+
+@pytest.fixture
+def editor_task(store, temp_dir, monkeypatch):
+    """A PDF editor task with a three-page document, and no previews cached yet."""
+    monkeypatch.setattr(service_pdf, "_preview_cache", BytesLRUCache(config.PDF_PREVIEW_CACHE_MAX_BYTES))
+    task_id = task_service.create_task("pdf-editor")
+    (temp_dir / task_id).mkdir()
+    pdf_path = temp_dir / task_id / "document.pdf"
+    pdf_path.write_bytes(make_pdf(3))
+    task_service.complete_task(task_id, str(pdf_path))
+    return task_id
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router_pdf.router, prefix="/api/v1/pdf")
+    return TestClient(app)
+
+
+def signature() -> str:
+    output = io.BytesIO()
+    Image.new("RGBA", (40, 20), (0, 0, 255, 255)).save(output, "PNG")
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def test_upload_lists_the_previews(store, temp_dir, client):
+    response = client.post("/api/v1/pdf/upload", files={"file": ("a.pdf", make_pdf(2), "application/pdf")})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["num_pages"] == 2
+    assert body["pages"][1].startswith(f"/api/v1/pdf/preview/{body['task_id']}/page_1.png?rev=")
+
+
+def test_previews_wait_for_an_edit_in_progress(editor_task):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        with service_pdf._document_lock(editor_task):
+            preview = executor.submit(service_pdf.render_page_preview, editor_task, "page_1.png")
+            with pytest.raises(concurrent.futures.TimeoutError):
+                preview.result(timeout=0.2)
+        assert Image.open(io.BytesIO(preview.result(timeout=5))).format == "PNG"
+
+
+def test_signing_swaps_in_a_complete_file(editor_task):
+    pdf_path = task_service.get_task_status(editor_task)["result_path"]
+    with open(pdf_path, "rb") as reader:
+        # As a download that started before the edit.
+        original = reader.read(10)
+        service_pdf.add_signature(editor_task, 1, 10, 10, 30, signature())
+        original += reader.read()
+    with fitz.open(stream=original, filetype="pdf") as doc:
+        assert sum(len(page.get_images()) for page in doc) == 0
+    with fitz.open(pdf_path) as doc:
+        assert [len(page.get_images()) for page in doc] == [0, 1, 0]
+    assert os.listdir(os.path.dirname(pdf_path)) == ["document.pdf"]
+
+
+def test_rendering_every_preview_leaves_no_snapshot(editor_task):
+    async def render():
+        return [page async for page in service_pdf.render_all_previews(editor_task, image_format="jpeg")]
+
+    try:
+        pages = asyncio.run(render())
+    finally:
+        pdf_rasterizer.shutdown(wait=True)
+    assert sorted(page["page"] for page in pages) == [0, 1, 2]
+    pdf_path = task_service.get_task_status(editor_task)["result_path"]
+    assert os.listdir(os.path.dirname(pdf_path)) == ["document.pdf"]
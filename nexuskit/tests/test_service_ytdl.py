@@ -0,0 +1,39 @@
+import os
+
+from app.services import service_ytdl, task_service
+
+
+def test_interrupted_download_resumes_from_its_part_file(store, temp_dir, media_server):
+    video = os.urandom(2_000_000)
+    (media_server.directory / "big.mp4").write_bytes(video)
+    task_id = task_service.create_task("ytdl")
+    # What an earlier run cut off halfway left in the task directory.
+    (temp_dir / task_id).mkdir()
+    (temp_dir / task_id / "big.mp4.part").write_bytes(video[:1_000_000])
+
+    service_ytdl.run_download_task(task_id, media_server.url + "/big.mp4", "best", False, None)
+
+    task = task_service.get_task_status(task_id)
+    assert task["status"] == "completed", task["error_message"]
+    with open(task["result_path"], "rb") as file:
+        assert file.read() == video
+    assert ("/big.mp4", "bytes=1000000-") in media_server.requests
+    assert os.listdir(temp_dir / task_id) == ["big.mp4"]
+
+
+def test_hls_download_fetches_every_fragment(store, temp_dir, media_server):
+    segments = [os.urandom(50_000) for _ in range(6)]
+    playlist = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for n, segment in enumerate(segments):
+        (media_server.directory / f"s{n}.ts").write_bytes(segment)
+        playlist += ["#EXTINF:2.0,", f"s{n}.ts"]
+    (media_server.directory / "v.m3u8").write_text("\n".join(playlist + ["#EXT-X-ENDLIST", ""]))
+    task_id = task_service.create_task("ytdl")
+
+    service_ytdl.run_download_task(task_id, media_server.url + "/v.m3u8", "best", False, None)
+
+    task = task_service.get_task_status(task_id)
+    assert task["status"] == "completed", task["error_message"]
+    with open(task["result_path"], "rb") as file:
+        assert file.read() == b"".join(segments)
+    assert service_ytdl.fragment_budget._in_use == 0
@@ -0,0 +1,264 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.task_store import RedisError, RespConnection
+
+
+class ScriptedServer:
+    """Answers each command with the next canned reply, closing the connection on None."""
+
+    def __init__(self, replies: list[bytes | None]):
+        self.replies = list(replies)
+        self.received = []
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while self.replies:
+                line = await reader.readuntil(b"\r\n")
+                request = line
+                for _ in range(int(line[1:-2])):
+                    header = await reader.readuntil(b"\r\n")
+                    request += header + await reader.readexactly(int(header[1:-2]) + 2)
+                self.received.append(request)
+                reply = self.replies.pop(0)
+                if reply is None:
+                    break
+                writer.write(reply)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+
+def run_scripted(replies, scenario, **connection_args):
+    """Runs `scenario(connection)` against a `ScriptedServer`; returns its result and the server."""
+    async def main():
+        server = ScriptedServer(replies)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        connection = RespConnection("127.0.0.1", listener.sockets[0].getsockname()[1], **connection_args)
+        try:
+            return await scenario(connection), server
+        finally:
+            await connection.close()
+            listener.close()
+
+    return asyncio.run(main())
+
+
+# --- RESP client ---
+
+def test_commands_are_sent_as_arrays_of_bulk_strings():
+    _, server = run_scripted([b":1\r\n"], lambda connection: connection.execute("HSET", "key", "name", 1.5, b"\x00\r\n"))
+    assert server.received == [b"*5\r\n$4\r\nHSET\r\n$3\r\nkey\r\n$4\r\nname\r\n$3\r\n1.5\r\n$3\r\n\x00\r\n\r\n"]
+
+
+@pytest.mark.parametrize("reply, expected", [
+    (b"+OK\r\n", "OK"),
+    (b":-42\r\n", -42),
+    (b"$5\r\nhello\r\n", b"hello"),
+    (b"$4\r\na\r\nb\r\n", b"a\r\nb"),
+    (b"$0\r\n\r\n", b""),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*0\r\n", []),
+    (b"*3\r\n$1\r\na\r\n$-1\r\n*2\r\n:1\r\n+QUEUED\r\n", [b"a", None, [1, "QUEUED"]]),
+])
+def test_replies_are_decoded(reply, expected):
+    result, _ = run_scripted([reply], lambda connection: connection.execute("GET", "key"))
+    assert result == expected
+
+
+def test_error_reply_raises_and_keeps_the_connection():
+    async def scenario(connection):
+        with pytest.raises(RedisError, match="WRONGTYPE"):
+            await connection.execute("HGETALL", "key")
+        return await connection.execute("PING")
+
+    result, server = run_scripted([b"-WRONGTYPE wrong kind of value\r\n", b"+PONG\r\n"], scenario)
+    assert result == "PONG"
+    assert server.connections == 1
+
+
+def test_unexpected_reply_raises():
+    with pytest.raises(RedisError, match="Unexpected reply"):
+        run_scripted([b"%1\r\n"], lambda connection: connection.execute("HELLO"))
+
+
+def test_connecting_authenticates_and_selects_the_database():
+    _, server = run_scripted(
+        [b"+OK\r\n", b"+OK\r\n", b"+PONG\r\n"],
+        lambda connection: connection.execute("PING"),
+        db=3, password="secret",
+    )
+    assert server.received == [
+        b"*2\r\n$4\r\nAUTH\r\n$6\r\nsecret\r\n",
+        b"*2\r\n$6\r\nSELECT\r\n$1\r\n3\r\n",
+        b"*1\r\n$4\r\nPING\r\n",
+    ]
+
+
+def test_dropped_connection_is_reopened():
+    async def scenario(connection):
+        with pytest.raises((ConnectionError, asyncio.IncompleteReadError)):
+            await connection.execute("PING")
+        return await connection.execute("PING")
+
+    result, server = run_scripted([None, b"+PONG\r\n"], scenario)
+    assert result == "PONG"
+    assert server.connections == 2
+
+
+def test_round_trip_through_a_redis_server(redis_server):
+    async def main():
+        connection = RespConnection("127.0.0.1", redis_server.port)
+        other = RespConnection("127.0.0.1", redis_server.port)
+        try:
+            assert await connection.execute("HSET", "task", "name", "résumé", "data", b"\x00\xff") == 2
+            assert await connection.execute("HMGET", "task", "name", "missing", "data") == ["résumé".encode(), None, b"\x00\xff"]
+
+            async with connection.lock:
+                execute = connection.execute_locked
+                await execute("WATCH", "task")
+                assert await execute("MULTI") == "OK"
+                assert await execute("ZADD", "times", 2.5, "task") == "QUEUED"
+                assert await execute("EXEC") == [1]
+
+                # A write by another client between WATCH and EXEC aborts it.
+                await execute("WATCH", "task")
+                await other.execute("HSET", "task", "name", "changed")
+                await execute("MULTI")
+                await execute("HSET", "task", "name", "lost")
+                assert await execute("EXEC") is None
+            assert await connection.execute("HMGET", "task", "name") == [b"changed"]
+            assert await connection.execute("ZRANGE", "times", 0, -1, "WITHSCORES") == [b"task", b"2.5"]
+        finally:
+            await connection.close()
+            await other.close()
+
+    asyncio.run(main())
+
+
+# --- Task store contract, with each backend ---
+
+def test_create_and_get(store):
+    before = time.time()
+    task_id = store.call(store.store.create_task("tool", before + 60))
+    task = store.call(store.store.get_task(task_id))
+    assert task["task_id"] == task_id
+    assert task["tool_name"] == "tool"
+    assert task["status"] == "pending"
+    assert task["expires_at"] == before + 60
+    assert before <= task["last_used_at"] <= time.time()
+    assert task["result_path"] is None and task["owner"] is None
+    assert store.call(store.store.get_task("missing")) is None
+
+
+def test_update_sets_and_clears_fields(store):
+    task_id = store.call(store.store.create_task("tool", time.time() + 60))
+    store.call(store.store.update_task(task_id, {"status": "completed", "progress": 100, "result_path": "/r", "speed": 1.5}))
+    store.call(store.store.update_task(task_id, {"result_path": None}))
+    task = store.call(store.store.get_task(task_id))
+    assert (task["status"], task["progress"], task["result_path"], task["speed"]) == ("completed", 100, None, 1.5)
+    with pytest.raises(ValueError):
+        store.call(store.store.update_task(task_id, {"colour": "blue"}))
+
+
+def test_update_if_checks_every_expected_field(store):
+    task_id = store.call(store.store.create_task("tool", time.time() + 60))
+    update_if = store.store.update_task_if
+    assert not store.call(update_if(task_id, {"status": ("queued",)}, {"status": "processing"}))
+    # None stands for a field without a value.
+    assert store.call(update_if(task_id, {"status": ("pending",), "owner": (None,)}, {"owner": "a"}))
+    assert not store.call(update_if(task_id, {"owner": ("b",)}, {"owner": "c"}))
+    assert store.call(update_if(task_id, {"owner": ("a", "b")}, {"owner": None, "progress": 5}))
+    assert not store.call(update_if("missing", {"owner": (None,)}, {"owner": "a"}))
+    task = store.call(store.store.get_task(task_id))
+    assert (task["status"], task["owner"], task["progress"]) == ("pending", None, 5)
+
+
+def test_update_if_has_exactly_one_winner(store):
+    task_id = store.call(store.store.create_task("tool", time.time() + 60))
+    store.call(store.store.update_task(task_id, {"status": "queued", "queued_at": 1.0}))
+
+    async def race():
+        return await asyncio.gather(*(
+            store.store.update_task_if(task_id, {"status": ("queued",)}, {"status": "processing", "owner": str(n)})
+            for n in range(8)
+        ))
+
+    assert sum(store.call(race())) == 1
+    assert store.call(store.store.get_tasks("tool", "queued")) == []
+
+
+def test_get_tasks_follows_status_changes_in_queue_order(store):
+    create = store.store.create_task
+    task_ids = [store.call(create("tool", time.time() + 60)) for _ in range(4)]
+    store.call(create("other", time.time() + 60))
+    for task_id, queued_at in zip(task_ids, (3.0, 1.0, 2.0, 1.0)):
+        store.call(store.store.update_task(task_id, {"status": "queued", "queued_at": queued_at}))
+    store.call(store.store.update_task(task_ids[2], {"status": "processing"}))
+
+    queued = store.call(store.store.get_tasks("tool", "queued"))
+    expected = sorted([(1.0, task_ids[1]), (1.0, task_ids[3]), (3.0, task_ids[0])])
+    assert [task["task_id"] for task in queued] == [task_id for _, task_id in expected]
+    assert [store.call(store.store.queue_position(task)) for task in queued] == [1, 2, 3]
+    assert [task["task_id"] for task in store.call(store.store.get_tasks("tool", "processing"))] == [task_ids[2]]
+
+
+def test_write_progress_only_touches_active_tasks(store):
+    active = store.call(store.store.create_task("tool", time.time() + 60))
+    done = store.call(store.store.create_task("tool", time.time() + 60))
+    store.call(store.store.update_task(active, {"status": "queued", "queued_at": 1.0, "eta": 9}))
+    store.call(store.store.update_task(done, {"status": "completed", "progress": 100}))
+    store.call(store.store.write_progress({active: {"progress": 40, "speed": 2.0}, done: {"progress": 10}}))
+
+    task = store.call(store.store.get_task(active))
+    assert (task["status"], task["progress"], task["speed"], task["eta"]) == ("processing", 40, 2.0, None)
+    assert store.call(store.store.get_tasks("tool", "queued")) == []
+    assert store.call(store.store.get_task(done))["progress"] == 100
+
+
+def test_expiry_and_activity_queries(store):
+    create = store.store.create_task
+    finished = [store.call(create("tool", expires_at)) for expires_at in (30.0, 10.0, 20.0)]
+    running = store.call(create("tool", 5.0))
+    for task_id, last_used_at in zip(finished, (3.0, 1.0, 2.0)):
+        store.call(store.store.update_task(task_id, {"status": "completed", "last_used_at": last_used_at}))
+    store.call(store.store.update_task(running, {"status": "processing", "last_used_at": 0.5}))
+
+    assert sorted(store.call(store.store.get_expiry_times())) == [
+        (5.0, running), (10.0, finished[1]), (20.0, finished[2]), (30.0, finished[0])
+    ]
+    assert store.call(store.store.get_expired(20.0, 10)) == [finished[1], finished[2]]
+    assert store.call(store.store.get_expired(100.0, 1)) == [finished[1]]
+    assert store.call(store.store.get_least_recently_used(2)) == [finished[1], finished[2]]
+    assert store.call(store.store.get_stale(1.0, 10)) == [running]
+    assert store.call(store.store.get_stale(0.5, 10)) == []
+    assert running not in store.call(store.store.get_least_recently_used(10))
+
+
+def test_delete_removes_tasks_from_every_query(store):
+    task_id = store.call(store.store.create_task("tool", 1.0))
+    store.call(store.store.update_task(task_id, {"status": "completed", "last_used_at": 1.0}))
+    assert store.call(store.store.delete_tasks([task_id, "missing"])) == [task_id]
+    assert store.call(store.store.get_task(task_id)) is None
+    assert store.call(store.store.get_tasks("tool", "completed")) == []
+    assert store.call(store.store.get_expiry_times()) == []
+    assert store.call(store.store.get_least_recently_used(10)) == []
+
+
+def test_delete_leaves_active_tasks_alone(store):
+    # Picked for deletion once finished, then submitted again.
+    task_ids = [store.call(store.store.create_task("tool", 1.0)) for _ in range(4)]
+    for task_id, status in zip(task_ids, ("pending", "queued", "processing", "failed")):
+        store.call(store.store.update_task(task_id, {"status": status, "queued_at": 1.0}))
+    assert store.call(store.store.delete_tasks(task_ids)) == [task_ids[3]]
+    assert [store.call(store.store.get_task(task_id))["status"] for task_id in task_ids[:3]] == [
+        "pending", "queued", "processing"
+    ]
+    assert [task["task_id"] for task in store.call(store.store.get_tasks("tool", "queued"))] == [task_ids[1]]
+    assert sorted(store.call(store.store.get_expiry_times())) == sorted((1.0, task_id) for task_id in task_ids[:3])
@@ -0,0 +1,151 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.apis import router_ytdl
+from app.services import ytdl_info
+
+
+@pytest.fixture
+def executor():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """A fresh metadata cache; returns the URLs extracted through it, in order."""
+    monkeypatch.setattr(ytdl_info, "cache", ytdl_info.InfoCache(ttl=60, max_entries=100))
+    extracted = []
+    extract_video = ytdl_info._extract_video
+
+    def counted(url):
+        extracted.append(url)
+        return extract_video(url)
+
+    monkeypatch.setattr(ytdl_info, "_extract_video", counted)
+    return extracted
+
+
+@pytest.fixture
+def videos(media_server):
+    """Two direct video links and a page embedding both, as the generic extractor sees them."""
+    for name in ("a.mp4", "b.mp4"):
+        (media_server.directory / name).write_bytes(name.encode() * 5000)
+    (media_server.directory / "list.html").write_text(
+        '<html><head><title>My list</title></head><body>'
+        '<video src="a.mp4"></video><video src="b.mp4"></video></body></html>'
+    )
+    return media_server.url
+
+
+@pytest.mark.parametrize("url, normalized", [
+    ("HTTPS://Example.COM:443/v?b=2&a=1#t=10", "https://example.com/v?a=1&b=2"),
+    ("http://example.com:8080/v?utm_source=x&fbclid=y&id=3", "http://example.com:8080/v?id=3"),
+    ("https://youtu.be/abc?si=zz&t=3", "https://youtube.com/watch?v=abc"),
+    ("https://m.youtube.com/watch?feature=share&v=abc&list=L", "https://youtube.com/watch?list=L&v=abc"),
+])
+def test_normalize_url(url, normalized):
+    assert ytdl_info.normalize_url(url) == normalized
+
+
+def test_cache_hits_until_the_ttl(executor, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ytdl_info.time, "monotonic", lambda: now[0])
+    cache = ytdl_info.InfoCache(ttl=10, max_entries=10)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"n": len(loads)}
+
+    assert cache.get_or_load("k", load, executor).result() == {"n": 1}
+    now[0] += 9
+    assert cache.get_or_load("k", load, executor).result() == {"n": 1}
+    now[0] += 2
+    assert cache.get_or_load("k", load, executor).result() == {"n": 2}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_cache_evicts_the_least_recently_used(executor):
+    cache = ytdl_info.InfoCache(ttl=60, max_entries=2)
+    for key in ("a", "b"):
+        cache.get_or_load(key, lambda key=key: key, executor).result()
+    cache.get_or_load("a", lambda: "again", executor).result()
+    cache.get_or_load("c", lambda: "c", executor).result()
+    assert cache.get_or_load("a", lambda: "again", executor).result() == "a"
+    assert cache.get_or_load("b", lambda: "again", executor).result() == "again"
+
+
+def test_concurrent_loads_of_a_key_are_single_flight(executor):
+    cache = ytdl_info.InfoCache(ttl=60, max_entries=10)
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        release.wait(5)
+        return "value"
+
+    futures = [cache.get_or_load("k", load, executor) for _ in range(5)]
+    release.set()
+    assert [future.result() for future in futures] == ["value"] * 5
+    assert len(loads) == 1
+
+
+def test_failures_are_not_cached(executor):
+    cache = ytdl_info.InfoCache(ttl=60, max_entries=10)
+
+    def fail():
+        raise ValueError("no")
+
+    with pytest.raises(ValueError):
+        cache.get_or_load("k", fail, executor).result()
+    assert cache.get_or_load("k", lambda: "value", executor).result() == "value"
+    assert cache.stats()["entries"] == 1
+
+
+def test_fetch_video_info_extracts_each_video_once(videos, extractions):
+    async def fetch():
+        first = await ytdl_info.fetch_video_info(videos + "/a.mp4")
+        # Concurrent requests for other spellings of the same URL share it.
+        others = await asyncio.gather(
+            ytdl_info.fetch_video_info(videos.replace("http", "HTTP") + "/a.mp4#start"),
+            ytdl_info.fetch_video_info(videos + "/a.mp4?utm_source=mail"),
+        )
+        return first, others
+
+    first, others = asyncio.run(fetch())
+    assert first["title"] == "a"
+    assert [f["ext"] for f in first["formats"]] == ["mp4"]
+    assert others == [first, first]
+    assert extractions == [videos + "/a.mp4"]
+
+
+def test_fetch_many_reports_failures_per_url(videos, extractions):
+    urls = [videos + "/a.mp4", videos + "/missing.mp4", videos + "/b.mp4", videos + "/a.mp4"]
+    items = asyncio.run(ytdl_info.fetch_many(urls))
+    assert [item["url"] for item in items] == urls
+    assert [item["info"]["title"] if item["info"] else None for item in items] == ["a", None, "b", "a"]
+    assert "404" in items[1]["error"]
+    assert sorted(extractions) == sorted(urls[:3])
+
+
+def test_batch_endpoint_resolves_a_playlist(videos, extractions):
+    app = FastAPI()
+    app.include_router(router_ytdl.router)
+    client = TestClient(app)
+
+    response = client.post("/fetch-info/batch", json={"playlist_url": videos + "/list.html", "limit": 1})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["title"], body["entries"]) == ("My list", 2)
+    assert [item["info"]["title"] for item in body["items"]] == ["a"]
+
+    assert client.post("/fetch-info/batch", json={}).status_code == 422
+    assert client.post("/fetch-info", json={"url": videos + "/missing.mp4"}).status_code == 400